@@ -1,10 +1,12 @@
 """FastAPI приложение для API endpoints."""
 import logging
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.api.routes import router as api_router
+from app.config import WEBHOOK_IN_API
+from app.db import instrumentation
 
 logger = logging.getLogger(__name__)
 
@@ -27,6 +29,15 @@ async def lifespan(app: FastAPI):
         logger.error("Проверьте переменную DATABASE_URL в Railway")
         # Не поднимаем исключение, чтобы увидеть другие ошибки
     
+    # Webhook бота в этом же процессе (отдельный порт WEBHOOK_PORT)
+    webhook_runner = None
+    if WEBHOOK_IN_API:
+        from app.bot import create_bot, start_services
+        from app.webhook import start_webhook
+        await start_services()
+        bot, dp = await create_bot()
+        webhook_runner = await start_webhook(bot, dp)
+    
     logger.info("✅ API сервер готов к работе")
     logger.info("=" * 60)
     
@@ -34,6 +45,11 @@ async def lifespan(app: FastAPI):
     
     # Shutdown
     logger.info("Остановка API сервера...")
+    if webhook_runner is not None:
+        from app.bot import stop_services
+        from app.webhook import stop_webhook
+        await stop_webhook(webhook_runner)
+        await stop_services()
 
 
 app = FastAPI(
@@ -52,6 +68,25 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+
+@app.middleware("http")
+async def track_db_queries(request: Request, call_next):
+    """
+    Учитывать SQL-запросы запроса под шаблоном маршрута (GET /api/users/{user_id}).
+
+    Запросы без маршрута учитываются под одним именем UNMATCHED_ROUTE: иначе
+    каждый несуществующий путь создавал бы свою гистограмму.
+    """
+    with instrumentation.track(instrumentation.UNMATCHED_ROUTE) as stats:
+        try:
+            response = await call_next(request)
+        finally:
+            route = request.scope.get("route")
+            if route is not None:
+                stats.name = f"{request.method} {route.path}"
+    return response
+
 # Подключение роутеров
 app.include_router(api_router, prefix="/api", tags=["api"])
 
@@ -1,8 +1,9 @@
 """API routes для работы с базой данных."""
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, func
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import selectinload
 
 from app.api.auth import verify_api_key
@@ -15,36 +16,74 @@ from app.api.schemas import (
     SessionRunCreate, SessionRunResponse,
     PerformedSetCreate, PerformedSetResponse
 )
-from app.db.init_db import async_session_maker
+from app.db.init_db import async_session_maker, read_session_maker
 from app.db.models import User, Session, WorkoutDay, Exercise, Set, SessionRun, PerformedSet
-from app.db import crud
+from app.db import crud, instrumentation
 
 router = APIRouter()
 
 
-async def get_db_session():
-    """Dependency для получения сессии базы данных."""
-    async with async_session_maker() as session:
-        yield session
+# Методы, которые только читают данные и могут обслуживаться репликой
+READ_ONLY_METHODS = {"GET", "HEAD"}
+
+
+async def get_db_session(request: Request):
+    """
+    Dependency для получения сессии базы данных.
+    
+    GET/HEAD-запросы идут в engine для чтения (DATABASE_READ_URL, если задан),
+    остальные — в основную БД.
+    """
+    session_maker = read_session_maker if request.method in READ_ONLY_METHODS else async_session_maker
+    async with session_maker() as session:
+        try:
+            yield session
+        except IntegrityError:
+            # Пользователь из кэша мог быть удалён другим процессом (ботом)
+            crud.forget_cached_users(session)
+            raise
+
+
+# Размер страницы, если передан только курсор
+DEFAULT_PAGE_SIZE = 50
+
+
+def _is_paged(limit: Optional[int], after: Optional[str], before: Optional[str]) -> bool:
+    """Запрошена ли страница; без limit и курсоров списки отдаются целиком, как до пагинации."""
+    return limit is not None or after is not None or before is not None
 
 
 # ========== User Endpoints ==========
 @router.get("/users", dependencies=[Depends(verify_api_key)], response_model=dict)
-async def get_users_with_programs(session: AsyncSession = Depends(get_db_session)):
+async def get_users_with_programs(
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    session: AsyncSession = Depends(get_db_session)
+):
     """
-    Получить список всех пользователей с их программами и количеством программ.
+    Получить пользователей с их программами и количеством программ.
     
+    Без limit и курсоров возвращаются все пользователи, total_users — их число.
+    С limit (или курсором) — страница: total_users и total_programs считаются
+    по странице, следующая страница: ?after=<next_cursor>, предыдущая: ?before=<prev_cursor>.
     Требует авторизации через API ключ в заголовке X-API-Key.
     """
     try:
-        result = await session.execute(
-            select(User).order_by(User.created_at)
-        )
-        users = result.scalars().all()
-        
+        # Программы загружаются одним запросом на страницу, без запроса на пользователя
+        if not _is_paged(limit, after, before):
+            page = await crud.get_users_page(session, limit=None, with_programs=True)
+        else:
+            page = await crud.get_users_page(
+                session, limit=limit or DEFAULT_PAGE_SIZE, after=after, before=before, with_programs=True
+            )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    try:
         users_data = []
-        for user in users:
-            programs = await crud.get_user_sessions(session, user.id)
+        for user in page.items:
+            programs = user.sessions
             programs_count = len(programs)
             
             programs_data = []
@@ -67,7 +106,9 @@ async def get_users_with_programs(session: AsyncSession = Depends(get_db_session
         return {
             "users": users_data,
             "total_users": len(users_data),
-            "total_programs": sum(u["programs_count"] for u in users_data)
+            "total_programs": sum(u["programs_count"] for u in users_data),
+            "next_cursor": page.next_cursor,
+            "prev_cursor": page.prev_cursor
         }
     
     except Exception as e:
@@ -113,33 +154,48 @@ async def create_user(user_data: UserCreate, session: AsyncSession = Depends(get
 @router.delete("/users/{user_id}", dependencies=[Depends(verify_api_key)], status_code=status.HTTP_204_NO_CONTENT)
 async def delete_user(user_id: int, session: AsyncSession = Depends(get_db_session)):
     """Удалить пользователя и все связанные данные."""
-    result = await session.execute(
-        select(User).where(User.id == user_id)
-    )
-    user = result.scalar_one_or_none()
-    if not user:
+    telegram_id = await crud.delete_user(session, user_id)
+    if telegram_id is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Пользователь с ID {user_id} не найден"
         )
-    
-    await session.delete(user)
-    await session.commit()
     return None
 
 
 # ========== Program (Session) Endpoints ==========
 @router.get("/programs", dependencies=[Depends(verify_api_key)], response_model=List[ProgramResponse])
 async def get_programs(
+    response: Response,
     user_id: Optional[int] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    after: Optional[str] = None,
+    before: Optional[str] = None,
     session: AsyncSession = Depends(get_db_session)
 ):
-    """Получить список всех программ. Опционально фильтр по user_id."""
-    if user_id:
-        programs = await crud.get_user_sessions(session, user_id)
-    else:
-        programs = await crud.get_all_sessions(session)
-    return programs
+    """
+    Получить программы. Опционально фильтр по user_id.
+    
+    Без limit и курсоров возвращаются все программы в прежнем порядке: программы
+    пользователя — от старых к новым, все программы — от новых к старым.
+    С limit (или курсором) — страница от новых к старым; курсоры соседних
+    страниц возвращаются в заголовках X-Next-Cursor и X-Prev-Cursor.
+    """
+    if not _is_paged(limit, after, before):
+        if user_id:
+            return await crud.get_user_sessions(session, user_id)
+        return (await crud.get_all_sessions(session, limit=None)).items
+    try:
+        page = await crud.get_all_sessions(
+            session, user_id=user_id, limit=limit or DEFAULT_PAGE_SIZE, after=after, before=before
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    if page.next_cursor:
+        response.headers["X-Next-Cursor"] = page.next_cursor
+    if page.prev_cursor:
+        response.headers["X-Prev-Cursor"] = page.prev_cursor
+    return page.items
 
 
 @router.get("/programs/{program_id}", dependencies=[Depends(verify_api_key)], response_model=ProgramDetailResponse)
@@ -168,7 +224,12 @@ async def create_program(program_data: ProgramCreate, session: AsyncSession = De
             detail=f"Пользователь с ID {program_data.user_id} не найден"
         )
     
-    program = await crud.create_session(session, program_data.user_id, program_data.name)
+    program = await crud.create_program_tree(
+        session,
+        program_data.user_id,
+        program_data.name,
+        [day.model_dump() for day in program_data.days]
+    )
     return program
 
 
@@ -299,12 +360,9 @@ async def update_exercise(
             detail=f"Упражнение с ID {exercise_id} не найдено"
         )
     
-    if exercise_data.name is not None:
-        exercise.name = exercise_data.name
-    if exercise_data.order is not None:
-        exercise.order = exercise_data.order
-    
-    await session.commit()
+    exercise = await crud.update_exercise(
+        session, exercise, name=exercise_data.name, order=exercise_data.order
+    )
     await session.refresh(exercise)
     return exercise
 
@@ -396,12 +454,13 @@ async def create_performed_set(set_data: PerformedSetCreate, session: AsyncSessi
             detail=f"Запуск тренировки с ID {set_data.session_run_id} не найден"
         )
     
-    performed_set = await crud.create_performed_set(
+    performed_set, _ = await crud.create_performed_set(
         session,
         set_data.exercise_id,
         set_data.set_index,
         set_data.weight,
-        set_data.session_run_id
+        set_data.session_run_id,
+        user_id=run.user_id
     )
     return performed_set
 
@@ -420,3 +479,10 @@ async def get_performed_sets(run_id: int, session: AsyncSession = Depends(get_db
     performed_sets = await crud.get_performed_sets_by_run(session, run_id)
     return performed_sets
 
+
+# ========== Metrics Endpoints ==========
+
+@router.get("/metrics/db", dependencies=[Depends(verify_api_key)], response_model=dict)
+async def get_db_metrics():
+    """Гистограммы числа SQL-запросов и времени в БД по маршрутам API этого процесса."""
+    return instrumentation.snapshot()
@@ -31,9 +31,22 @@ class ProgramBase(BaseModel):
     name: str = Field(..., min_length=1, max_length=200)
 
 
+class ProgramTreeExercise(BaseModel):
+    """Упражнение в составе создаваемой программы."""
+    name: str = Field(..., min_length=1, max_length=200)
+    reps: List[int] = Field(default_factory=list)
+
+
+class ProgramTreeDay(BaseModel):
+    """День в составе создаваемой программы."""
+    name: str = Field(..., min_length=1, max_length=200)
+    exercises: List[ProgramTreeExercise] = Field(default_factory=list)
+
+
 class ProgramCreate(ProgramBase):
-    """Схема для создания программы."""
+    """Схема для создания программы (опционально сразу с днями, упражнениями и подходами)."""
     user_id: int
+    days: List[ProgramTreeDay] = Field(default_factory=list)
 
 
 class ProgramResponse(ProgramBase):
@@ -1,13 +1,26 @@
 """Инициализация и настройка бота."""
+import asyncio
 import logging
+from typing import Optional
+
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.base import BaseSession
 from aiogram.enums import ParseMode
+from sqlalchemy.exc import IntegrityError
 
-from app.config import BOT_TOKEN
-from app.db.init_db import init_db, get_session
+from app.config import (
+    BOT_TOKEN, DB_METRICS_LOG_INTERVAL_MINUTES, FSM_STORAGE, PERFORMED_SETS_WRITE_BEHIND,
+    ROLLUP_HORIZON_DAYS
+)
+from app.db import crud, instrumentation
+from app.db.fsm_storage import DatabaseStorage
+from app.db.init_db import init_db, engine, async_session_maker, read_session_maker
+from app.db.lazy_session import LazySession, current_session
 from app.handlers import start, add_program, delete_program, training, stats
+from app.services import workout_state, write_behind
+from app.services.compaction import compaction_loop
 
 # Настройка логирования
 logging.basicConfig(
@@ -23,6 +36,29 @@ async def setup_database():
     logger.info("База данных готова к работе")
 
 
+async def start_services():
+    """Инициализация БД и фоновые задачи процесса бота (polling или webhook)."""
+    await setup_database()
+    
+    # Журнал отложенной записи подходов: воспроизведение после перезапуска
+    if PERFORMED_SETS_WRITE_BEHIND:
+        await write_behind.start()
+    
+    # Фоновое сжатие старой истории подходов (ROLLUP_HORIZON_DAYS > 0)
+    if ROLLUP_HORIZON_DAYS > 0:
+        asyncio.create_task(compaction_loop())
+    
+    # Сводка SQL-запросов по хендлерам в лог
+    if DB_METRICS_LOG_INTERVAL_MINUTES > 0:
+        asyncio.create_task(instrumentation.log_summary_loop(DB_METRICS_LOG_INTERVAL_MINUTES))
+
+
+async def stop_services():
+    """Дописать отложенные подходы перед остановкой процесса."""
+    if PERFORMED_SETS_WRITE_BEHIND:
+        await write_behind.stop()
+
+
 def setup_handlers(dp: Dispatcher):
     """Регистрация всех обработчиков."""
     # Системные обработчики (команды) - высокий приоритет
@@ -42,35 +78,99 @@ def setup_handlers(dp: Dispatcher):
     dp.include_router(ai_handler.router)
 
 
-async def create_bot() -> tuple[Bot, Dispatcher]:
-    """Создание и настройка бота."""
+async def create_bot(session: Optional[BaseSession] = None) -> tuple[Bot, Dispatcher]:
+    """Создание и настройка бота.
+    
+    Args:
+        session: HTTP-сессия Bot API (например, с адресом локального сервера в bench_webhook.py)
+    """
     bot = Bot(
         token=BOT_TOKEN,
+        session=session,
         default=DefaultBotProperties(parse_mode=ParseMode.HTML)
     )
     
-    dp = Dispatcher(storage=MemoryStorage())
+    if FSM_STORAGE == "memory":
+        storage = MemoryStorage()
+    else:
+        # Незавершённые тренировки переживают перезапуск, состояние общее для процессов
+        storage = DatabaseStorage(engine)
+    dp = Dispatcher(storage=storage)
     
     # Middleware для работы с БД
     from aiogram import BaseMiddleware
+    from aiogram.dispatcher.flags import get_flag
     from typing import Callable, Dict, Any, Awaitable
     
-    class DatabaseMiddleware(BaseMiddleware):
+    class UpdateSessionMiddleware(BaseMiddleware):
+        """
+        Одна ленивая сессия БД на update для хендлера и хранилища FSM:
+        соединение берётся из пула только при первом запросе, commit — один раз
+        после обработки, поэтому состояние FSM фиксируется вместе с данными.
+        """
         async def __call__(
             self,
             handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
             event: Any,
             data: Dict[str, Any]
         ) -> Any:
-            async for session in get_session():
-                data["session"] = session
+            session = LazySession(async_session_maker)
+            data["session"] = session
+            token = current_session.set(session)
+            # Update без хендлера (только чтение FSM) учитывается под общим именем;
+            # DatabaseMiddleware переименовывает область в имя хендлера
+            with instrumentation.track(instrumentation.UNMATCHED_ROUTE) as stats:
+                commit = False
                 try:
                     result = await handler(event, data)
+                    commit = True
                     return result
+                except IntegrityError:
+                    # Пользователь из кэша мог быть удалён, а упражнения дня тренировки
+                    # изменены другим процессом (API): следующий update перечитает их из БД
+                    crud.forget_cached_users(session)
+                    workout_state.forget_days()
+                    raise
                 finally:
-                    await session.close()
+                    current_session.reset(token)
+                    await session.finish(commit)
+                    if session.is_used:
+                        # Время выполнения запросов, без ожидания соединения и работы хендлера
+                        logger.debug(
+                            f"{stats.name}: {stats.count} SQL-запросов, в БД {stats.duration_ms:.1f} мс"
+                        )
+    
+    class DatabaseMiddleware(BaseMiddleware):
+        """
+        Относит запросы update к хендлеру (имя и бюджет запросов) и передаёт
+        хендлеру с флагом READ_ONLY отдельную сессию чтения.
+        """
+        async def __call__(
+            self,
+            handler: Callable[[Any, Dict[str, Any]], Awaitable[Any]],
+            event: Any,
+            data: Dict[str, Any]
+        ) -> Any:
+            stats = instrumentation.current_stats()
+            if stats is not None:
+                callback = data["handler"].callback
+                stats.name = f"{callback.__module__}.{callback.__name__}"
+                stats.budget = get_flag(data, instrumentation.QUERY_BUDGET)
+            if not get_flag(data, crud.READ_ONLY):
+                return await handler(event, data)
+            # Хендлер только читает: сессия на реплике (или основной БД), без commit
+            session = LazySession(read_session_maker, unit_of_work=False)
+            data["session"] = session
+            try:
+                return await handler(event, data)
+            finally:
+                await session.finish(False)
     
-    # Регистрируем middleware для всех типов обновлений
+    # Сессия update открывается до FSMContextMiddleware: get_state/set_state
+    # хранилища в БД идут через неё
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UpdateSessionMiddleware())
+    dp.update.outer_middleware(dp.fsm)
     dp.message.middleware(DatabaseMiddleware())
     dp.callback_query.middleware(DatabaseMiddleware())
     
@@ -148,16 +148,152 @@ else:
 logger.info(f"Final DATABASE_URL: {DATABASE_URL.split('@')[0] if '@' in DATABASE_URL else DATABASE_URL}@***")
 logger.info(f"Final DB_PATH: {DB_PATH}")
 
+# Реплика только для чтения (статистика, GET-запросы API). Если не задана — основная БД
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL")
+if DATABASE_READ_URL:
+    if DATABASE_READ_URL.startswith("postgres://"):
+        DATABASE_READ_URL = DATABASE_READ_URL.replace("postgres://", "postgresql+asyncpg://", 1)
+    elif DATABASE_READ_URL.startswith("postgresql://"):
+        DATABASE_READ_URL = DATABASE_READ_URL.replace("postgresql://", "postgresql+asyncpg://", 1)
+    logger.info(f"Read replica URL: {DATABASE_READ_URL.split('@')[0]}@***")
+
 # Экспорт переменных для использования в других модулях
 __all__ = [
     "BOT_TOKEN",
     "DATABASE_URL",
+    "DATABASE_READ_URL",
     "DB_PATH",
     "IS_RAILWAY",
     "HAS_DATA_VOLUME",
-    "MAX_PROGRAMS_PER_USER"
+    "MAX_PROGRAMS_PER_USER",
+    "PROGRAMS_PAGE_SIZE",
+    "USER_CACHE_TTL",
+    "USER_CACHE_MAX_SIZE",
+    "SQLITE_JOURNAL_MODE",
+    "SQLITE_SYNCHRONOUS",
+    "SQLITE_MMAP_SIZE",
+    "SQLITE_CACHE_SIZE",
+    "SQLITE_BUSY_TIMEOUT_MS",
+    "SQLITE_POOL_SIZE",
+    "DB_POOL_SIZE",
+    "DB_MAX_OVERFLOW",
+    "DB_POOL_PRE_PING",
+    "DB_POOL_RECYCLE",
+    "DB_STATEMENT_CACHE_SIZE",
+    "PERFORMED_SETS_PARTITIONING",
+    "PARTITION_MONTHS_AHEAD",
+    "PARTITION_CHECK_INTERVAL_HOURS",
+    "ROLLUP_HORIZON_DAYS",
+    "ROLLUP_INTERVAL_HOURS",
+    "ROLLUP_BATCH_SIZE",
+    "ROLLUP_KEEP_RECENT_RUNS",
+    "DB_QUERY_BUDGET_STRICT",
+    "DB_METRICS_LOG_INTERVAL_MINUTES",
+    "SLOW_QUERY_THRESHOLD_MS",
+    "SLOW_QUERY_LOG_FILE",
+    "SLOW_QUERY_LOG_MAX_BYTES",
+    "SLOW_QUERY_LOG_BACKUP_COUNT",
+    "SLOW_QUERY_EXPLAIN_ANALYZE",
+    "PERFORMED_SETS_WRITE_BEHIND",
+    "WRITE_BEHIND_JOURNAL_PATH",
+    "WRITE_BEHIND_FLUSH_SECONDS",
+    "FSM_STORAGE",
+    "FSM_CACHE_SIZE",
+    "FSM_CACHE_TTL",
+    "WORKOUT_CACHE_SIZE",
+    "WORKOUT_CACHE_TTL",
+    "BOT_MODE",
+    "WEBHOOK_URL",
+    "WEBHOOK_PATH",
+    "WEBHOOK_SECRET",
+    "WEBHOOK_HOST",
+    "WEBHOOK_PORT",
+    "WEBHOOK_IN_API"
 ]
 
 # Лимиты
 MAX_PROGRAMS_PER_USER = 2
 
+# Размер страницы в списке программ для выбора («Выбрать существующую программу»)
+PROGRAMS_PAGE_SIZE = int(os.getenv("PROGRAMS_PAGE_SIZE", "10"))
+
+# Кэш пользователей (telegram_id -> id, username): время жизни записи в секундах и размер.
+# Кэш у каждого процесса свой: удалённый в другом процессе пользователь вытесняется
+# по TTL или при первой записи, упавшей на внешнем ключе
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "300"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "10000"))
+
+
+# Профиль движка SQLite (PRAGMA выставляются при каждом подключении)
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # байты
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # < 0 — в КиБ (64 МиБ)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Открытые подключения к файлу SQLite переиспользуются, PRAGMA не повторяются на каждую транзакцию
+SQLITE_POOL_SIZE = int(os.getenv("SQLITE_POOL_SIZE", "5"))
+
+# Профиль движка PostgreSQL (asyncpg)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # секунды
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+# Помесячное секционирование performed_sets (только PostgreSQL, см. app/db/partitioning.py)
+PERFORMED_SETS_PARTITIONING = os.getenv("PERFORMED_SETS_PARTITIONING", "false").lower() in ("1", "true", "yes")
+PARTITION_MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+PARTITION_CHECK_INTERVAL_HOURS = float(os.getenv("PARTITION_CHECK_INTERVAL_HOURS", "24"))
+
+# Сжатие старой истории performed_sets в performed_set_rollups (0 — выключено)
+ROLLUP_HORIZON_DAYS = int(os.getenv("ROLLUP_HORIZON_DAYS", "0"))
+ROLLUP_INTERVAL_HOURS = float(os.getenv("ROLLUP_INTERVAL_HOURS", "24"))
+ROLLUP_BATCH_SIZE = int(os.getenv("ROLLUP_BATCH_SIZE", "500"))  # пар (запуск, упражнение) за транзакцию
+# Сколько последних запусков с каждой парой (упражнение, подход) не сжимаются:
+# по ним считаются предыдущие веса, в том числе пока идёт текущая тренировка
+ROLLUP_KEEP_RECENT_RUNS = int(os.getenv("ROLLUP_KEEP_RECENT_RUNS", "2"))
+
+# Бюджет SQL-запросов хендлеров (app/db/instrumentation.py): true — превышение
+# выбрасывает исключение (для тестов и CI), иначе только предупреждение в логе
+DB_QUERY_BUDGET_STRICT = os.getenv("DB_QUERY_BUDGET_STRICT", "false").lower() in ("1", "true", "yes")
+
+# Как часто бот пишет в лог сводку SQL-запросов по хендлерам, минуты (0 — не писать)
+DB_METRICS_LOG_INTERVAL_MINUTES = int(os.getenv("DB_METRICS_LOG_INTERVAL_MINUTES", "60"))
+
+# Журнал медленных запросов (app/db/slow_query_log.py): запросы дольше порога
+# пишутся в файл вместе с планом выполнения (0 — выключено)
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "500"))
+SLOW_QUERY_LOG_FILE = os.getenv("SLOW_QUERY_LOG_FILE", "logs/slow_queries.log")
+SLOW_QUERY_LOG_MAX_BYTES = int(os.getenv("SLOW_QUERY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+SLOW_QUERY_LOG_BACKUP_COUNT = int(os.getenv("SLOW_QUERY_LOG_BACKUP_COUNT", "3"))
+# EXPLAIN ANALYZE для медленных SELECT на PostgreSQL: запрос выполняется второй
+# раз на основной базе, когда она и так медленная. По умолчанию — только EXPLAIN
+SLOW_QUERY_EXPLAIN_ANALYZE = os.getenv("SLOW_QUERY_EXPLAIN_ANALYZE", "false").lower() in ("1", "true", "yes")
+
+# Отложенная запись подходов во время тренировки (app/services/write_behind.py):
+# подход подтверждается после записи в локальный журнал, в БД пишется пачками
+PERFORMED_SETS_WRITE_BEHIND = os.getenv("PERFORMED_SETS_WRITE_BEHIND", "false").lower() in ("1", "true", "yes")
+WRITE_BEHIND_JOURNAL_PATH = os.getenv("WRITE_BEHIND_JOURNAL_PATH", "data/performed_sets.journal")
+WRITE_BEHIND_FLUSH_SECONDS = float(os.getenv("WRITE_BEHIND_FLUSH_SECONDS", "5"))
+
+# Хранилище состояний FSM: memory — в памяти процесса, database — таблица
+# fsm_states (переживает перезапуск, общее для нескольких процессов бота;
+# включается явно)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))  # чатов в кэше процесса
+FSM_CACHE_TTL = int(os.getenv("FSM_CACHE_TTL", "3600"))  # секунды
+
+# Кэш структуры тренировочных дней и прошлых весов для идущих тренировок
+# (app/services/workout_state.py)
+WORKOUT_CACHE_SIZE = int(os.getenv("WORKOUT_CACHE_SIZE", "5000"))
+WORKOUT_CACHE_TTL = float(os.getenv("WORKOUT_CACHE_TTL", "21600"))  # секунды
+
+# Режим получения обновлений: polling или webhook (app/webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес, например https://bot.example.com
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # secret_token setWebhook: A-Z, a-z, 0-9, _ и -
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Запускать webhook-сервер в процессе API (app/api/main.py) вместо отдельного бота
+WEBHOOK_IN_API = os.getenv("WEBHOOK_IN_API", "false").lower() in ("1", "true", "yes")
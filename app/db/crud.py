@@ -1,19 +1,109 @@
 """CRUD операции для работы с базой данных."""
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timedelta
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, desc
+from sqlalchemy import (
+    select, func, desc, delete, insert, literal, null, true, and_, event, tuple_, union_all, Integer
+)
 from sqlalchemy.orm import selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 
 from app.db.models import (
-    User, Session, WorkoutDay, Exercise, Set, SessionRun, PerformedSet
+    User, Session, WorkoutDay, Exercise, ExerciseKey, Set, SessionRun, PerformedSet,
+    LatestWeight, PerformedSetRollup
+)
+from app.config import (
+    USER_CACHE_TTL, USER_CACHE_MAX_SIZE, PERFORMED_SETS_PARTITIONING, ROLLUP_BATCH_SIZE,
+    ROLLUP_KEEP_RECENT_RUNS
 )
+from app.db.pagination import EPOCH, Page, paginate
+from app.services.parser import normalize_exercise_name
+from app.utils.cache import TTLCache
+
+
+# Ключ в session.info: режим единицы работы (commit делает вызывающий код один раз)
+UNIT_OF_WORK = "unit_of_work"
+
+# Флаг хендлера aiogram: хендлер только читает, сессию можно взять из реплики
+READ_ONLY = "read_only"
+
+
+def begin_unit_of_work(session: AsyncSession):
+    """
+    Включить режим единицы работы для сессии.
+    
+    В этом режиме create_* и другие функции записи только выполняют flush
+    (первичные ключи читаются через RETURNING), а commit выполняет вызывающий код
+    (например, UpdateSessionMiddleware в app/bot.py — один раз на update).
+    """
+    session.info[UNIT_OF_WORK] = True
+
+
+async def _commit(session: AsyncSession):
+    """Зафиксировать изменения: commit, а в режиме единицы работы — только flush."""
+    if session.info.get(UNIT_OF_WORK):
+        await session.flush()
+    else:
+        await session.commit()
+
+
+async def _save(session: AsyncSession, obj):
+    """Добавить объект и записать его в БД (flush читает сгенерированные значения через RETURNING)."""
+    session.add(obj)
+    await session.flush()
+    await _commit(session)
+    return obj
+
+
+def _after_commit(session: AsyncSession, callback):
+    """Выполнить callback после успешного commit сессии (в т.ч. отложенного)."""
+    event.listen(session.sync_session, "after_commit", lambda _: callback(), once=True)
+
+
+def _forget_workout_days(session: AsyncSession, day_ids: Optional[List[int]] = None):
+    """После commit убрать структуру дней из кэша тренировок процесса (None — всех дней)."""
+    def forget():
+        # workout_state импортирует crud
+        from app.services import workout_state
+        workout_state.forget_days(day_ids)
+
+    _after_commit(session, forget)
+
+
+def _dialect_insert(session: AsyncSession, model):
+    """INSERT с поддержкой ON CONFLICT для текущего диалекта (PostgreSQL или SQLite)."""
+    if session.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    return dialect_insert(model)
 
 
 # ========== User ==========
+# telegram_id -> (id, username, created_at); попадание в кэш не обращается к БД.
+# Кэш у каждого процесса свой: пользователь, удалённый другим процессом (API),
+# остаётся в нём до TTL или до первой записи, упавшей с IntegrityError
+# (см. forget_cached_users)
+_user_cache = TTLCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
+
+# Ключ в session.info: telegram_id пользователей, взятых из кэша в этой сессии
+CACHED_USERS = "cached_users"
+
+
+def _cached_user(session: AsyncSession, telegram_id: int, cached: tuple) -> User:
+    """Пользователь из записи кэша (не привязан к сессии)."""
+    session.info.setdefault(CACHED_USERS, set()).add(telegram_id)
+    user_id, username, created_at = cached
+    return User(id=user_id, telegram_id=telegram_id, username=username, created_at=created_at)
+
+
 async def get_or_create_user(session: AsyncSession, telegram_id: int, username: Optional[str] = None) -> User:
     """Получить или создать пользователя.
     
+    Если пользователь есть в кэше и username не изменился, БД не используется
+    (возвращается объект User, не привязанный к сессии). Иначе выполняется один
+    INSERT ... ON CONFLICT DO UPDATE ... RETURNING.
+    
     Args:
         session: Сессия базы данных
         telegram_id: Telegram ID пользователя
@@ -22,25 +112,94 @@ async def get_or_create_user(session: AsyncSession, telegram_id: int, username:
     Returns:
         User: Пользователь (существующий или созданный)
     """
-    result = await session.execute(
-        select(User).where(User.telegram_id == telegram_id)
-    )
-    user = result.scalar_one_or_none()
-    if not user:
-        # Создаем нового пользователя
-        user = User(telegram_id=telegram_id, username=username)
-        session.add(user)
-        await session.commit()
-        await session.refresh(user)
-    else:
-        # Обновляем username, если он изменился (username может меняться)
-        if user.username != username:
-            user.username = username
-            await session.commit()
-            await session.refresh(user)
+    cached = _user_cache.get(telegram_id)
+    if cached is not None and cached[1] == username:
+        return _cached_user(session, telegram_id, cached)
+    
+    # Создаем пользователя или обновляем username (username может меняться)
+    stmt = _dialect_insert(session, User).values(telegram_id=telegram_id, username=username)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["telegram_id"],
+        set_={"username": stmt.excluded.username}
+    ).returning(User)
+    try:
+        result = await session.scalars(stmt, execution_options={"populate_existing": True})
+        user = result.one()
+        # Кэшируем только зафиксированного пользователя
+        cached = (user.id, user.username, user.created_at)
+        _after_commit(session, lambda: _user_cache.set(telegram_id, cached))
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    
     return user
 
 
+async def get_user_by_telegram_id(session: AsyncSession, telegram_id: int) -> Optional[User]:
+    """Найти пользователя без записи в БД (подходит для сессий на реплике)."""
+    cached = _user_cache.get(telegram_id)
+    if cached is not None:
+        return _cached_user(session, telegram_id, cached)
+    
+    result = await session.execute(select(User).where(User.telegram_id == telegram_id))
+    return result.scalar_one_or_none()
+
+
+def forget_user(telegram_id: int):
+    """Убрать пользователя из кэша (например, после удаления)."""
+    _user_cache.pop(telegram_id)
+
+
+def forget_cached_users(session: AsyncSession):
+    """
+    Убрать из кэша пользователей, взятых из него в этой сессии.
+    
+    Вызывается при IntegrityError: пользователь мог быть удалён другим
+    процессом, и его id из кэша нарушает внешний ключ. Следующий
+    get_or_create_user прочитает (или создаст) пользователя в БД.
+    """
+    for telegram_id in session.info.pop(CACHED_USERS, ()):
+        forget_user(telegram_id)
+
+
+async def get_users_page(
+    session: AsyncSession,
+    limit: Optional[int] = 50,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    with_programs: bool = False
+) -> Page:
+    """
+    Получить страницу пользователей в порядке регистрации (keyset по created_at, id).
+    
+    Args:
+        limit: Размер страницы (None — все пользователи)
+        with_programs: Загрузить программы пользователей (user.sessions) одним
+            дополнительным запросом на всю страницу
+    
+    Raises:
+        ValueError: Если курсор некорректен
+    """
+    page = await paginate(
+        session, select(User), User.created_at, User.id, limit, after=after, before=before
+    )
+    if with_programs and page.items:
+        # Не selectinload: он загрузил бы программы и для лишней (limit + 1) строки
+        # пагинации, а при limit >= 500 разбил бы IN на два запроса
+        result = await session.execute(
+            select(Session)
+            .where(Session.user_id.in_([user.id for user in page.items]))
+            .order_by(Session.created_at)
+        )
+        programs_by_user: Dict[int, List[Session]] = {}
+        for program in result.scalars():
+            programs_by_user.setdefault(program.user_id, []).append(program)
+        for user in page.items:
+            set_committed_value(user, "sessions", programs_by_user.get(user.id, []))
+    return page
+
+
 # ========== Session (Program) ==========
 async def get_user_sessions(session: AsyncSession, user_id: int) -> List[Session]:
     """Получить все программы пользователя."""
@@ -61,23 +220,135 @@ async def get_session_by_id(session: AsyncSession, session_id: int) -> Optional[
 async def create_session(session: AsyncSession, user_id: int, name: str) -> Session:
     """Создать новую программу."""
     new_session = Session(user_id=user_id, name=name)
-    session.add(new_session)
-    await session.commit()
-    await session.refresh(new_session)
-    return new_session
+    return await _save(session, new_session)
+
+
+async def create_program_tree(
+    session: AsyncSession, user_id: int, name: str, days: List[dict]
+) -> Session:
+    """
+    Создать программу целиком (дни, упражнения, подходы) за одну транзакцию.
+    
+    Args:
+        session: Сессия базы данных
+        user_id: ID пользователя
+        name: Название программы
+        days: Список дней вида
+            [{"name": str, "exercises": [{"name": str, "reps": [int, ...]}, ...]}, ...]
+            Индекс дня и порядок упражнений берутся из позиции в списке,
+            подходы нумеруются с 1.
+    
+    Returns:
+        Session: Созданная программа
+    """
+    try:
+        session_id = (await session.execute(
+            insert(Session)
+            .values(user_id=user_id, name=name)
+            .returning(Session.session_id)
+        )).scalar_one()
+        
+        day_rows = [
+            {"session_id": session_id, "day_index": day_index, "name": day["name"]}
+            for day_index, day in enumerate(days)
+        ]
+        day_ids = []
+        if day_rows:
+            result = await session.execute(
+                insert(WorkoutDay).returning(WorkoutDay.id, sort_by_parameter_order=True),
+                day_rows
+            )
+            day_ids = list(result.scalars().all())
+        
+        key_ids = await get_or_create_exercise_key_ids(
+            session, [exercise["name"] for day in days for exercise in day["exercises"]]
+        )
+        exercise_rows = []
+        exercise_reps = []
+        for day_id, day in zip(day_ids, days):
+            for order, exercise in enumerate(day["exercises"]):
+                exercise_rows.append({
+                    "workout_day_id": day_id,
+                    "name": exercise["name"],
+                    "order": order,
+                    "exercise_key_id": key_ids[exercise["name"]]
+                })
+                exercise_reps.append(exercise["reps"])
+        exercise_ids = []
+        if exercise_rows:
+            result = await session.execute(
+                insert(Exercise).returning(Exercise.exercise_id, sort_by_parameter_order=True),
+                exercise_rows
+            )
+            exercise_ids = list(result.scalars().all())
+        
+        set_rows = [
+            {"exercise_id": exercise_id, "set_index": set_index, "reps": reps, "weight": None}
+            for exercise_id, reps_list in zip(exercise_ids, exercise_reps)
+            for set_index, reps in enumerate(reps_list, start=1)
+        ]
+        if set_rows:
+            await session.execute(insert(Set), set_rows)
+        
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    
+    return await get_session_by_id(session, session_id)
 
 
 async def delete_session(session: AsyncSession, session_id: int) -> bool:
-    """Удалить программу и все связанные данные."""
-    result = await session.execute(
-        select(Session).where(Session.session_id == session_id)
-    )
-    session_obj = result.scalar_one_or_none()
-    if session_obj:
-        await session.delete(session_obj)
-        await session.commit()
-        return True
-    return False
+    """
+    Удалить программу и все связанные данные.
+    
+    Дни, упражнения, подходы, запуски и история удаляются одним DELETE
+    каскадом в БД (ON DELETE CASCADE), без загрузки в память. Строки
+    latest_weights, взятые из запусков этой программы, пересобираются из
+    оставшейся истории в той же транзакции. После commit дни программы
+    убираются из кэша тренировок процесса.
+    """
+    try:
+        day_ids = (await session.scalars(
+            select(WorkoutDay.id).where(WorkoutDay.session_id == session_id)
+        )).all()
+        _forget_workout_days(session, day_ids)
+        stale_weights = (await session.execute(
+            select(LatestWeight.user_id, LatestWeight.exercise_key_id)
+            .join(SessionRun, LatestWeight.session_run_id == SessionRun.id)
+            .where(SessionRun.session_id == session_id)
+            .distinct()
+        )).all()
+        result = await session.execute(
+            delete(Session).where(Session.session_id == session_id)
+        )
+        await _refresh_latest_weights(session, stale_weights)
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    return result.rowcount > 0
+
+
+async def delete_user(session: AsyncSession, user_id: int) -> Optional[int]:
+    """
+    Удалить пользователя и все его данные одним DELETE (каскад в БД).
+    
+    Returns:
+        Optional[int]: telegram_id удалённого пользователя или None, если его не было
+    """
+    telegram_id = await session.scalar(select(User.telegram_id).where(User.id == user_id))
+    if telegram_id is None:
+        return None
+    try:
+        _forget_workout_days(session)
+        await session.execute(delete(User).where(User.id == user_id))
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    forget_user(telegram_id)
+    return telegram_id
 
 
 async def count_user_sessions(session: AsyncSession, user_id: int) -> int:
@@ -88,13 +359,35 @@ async def count_user_sessions(session: AsyncSession, user_id: int) -> int:
     return result.scalar() or 0
 
 
-async def get_all_sessions(session: AsyncSession, exclude_user_id: Optional[int] = None) -> List[Session]:
-    """Получить все программы (опционально исключая программы конкретного пользователя)."""
-    query = select(Session).order_by(Session.created_at.desc())
+async def get_all_sessions(
+    session: AsyncSession,
+    exclude_user_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    limit: Optional[int] = 20,
+    after: Optional[str] = None,
+    before: Optional[str] = None
+) -> Page:
+    """
+    Получить страницу программ, от новых к старым (keyset по created_at, session_id).
+    
+    Args:
+        exclude_user_id: Исключить программы этого пользователя
+        user_id: Только программы этого пользователя
+        limit: Размер страницы (None — все программы)
+        after / before: Курсоры next_cursor / prev_cursor предыдущей страницы
+    
+    Raises:
+        ValueError: Если курсор некорректен
+    """
+    query = select(Session)
     if exclude_user_id:
         query = query.where(Session.user_id != exclude_user_id)
-    result = await session.execute(query)
-    return list(result.scalars().all())
+    if user_id:
+        query = query.where(Session.user_id == user_id)
+    return await paginate(
+        session, query, Session.created_at, Session.session_id, limit,
+        after=after, before=before, descending=True
+    )
 
 
 async def get_session_with_details(session: AsyncSession, session_id: int) -> Optional[Session]:
@@ -109,43 +402,104 @@ async def get_session_with_details(session: AsyncSession, session_id: int) -> Op
     return result.scalar_one_or_none()
 
 
+def _numbered_days(session_id: int):
+    """Дни программы с порядковым номером (для сопоставления копии с оригиналом)."""
+    return (
+        select(
+            WorkoutDay.id,
+            func.row_number().over(order_by=(WorkoutDay.day_index, WorkoutDay.id)).label("rn")
+        )
+        .where(WorkoutDay.session_id == session_id)
+        .subquery()
+    )
+
+
+def _numbered_exercises(session_id: int):
+    """Упражнения программы с порядковым номером в пределах всей программы."""
+    return (
+        select(
+            Exercise.exercise_id,
+            func.row_number().over(
+                order_by=(WorkoutDay.day_index, WorkoutDay.id, Exercise.order, Exercise.exercise_id)
+            ).label("rn")
+        )
+        .join(WorkoutDay, Exercise.workout_day_id == WorkoutDay.id)
+        .where(WorkoutDay.session_id == session_id)
+        .subquery()
+    )
+
+
 async def copy_session_without_weights(
     session: AsyncSession, 
     source_session_id: int, 
     target_user_id: int, 
     new_name: str
 ) -> Session:
-    """Скопировать программу без сохранённых весов."""
-    # Получаем исходную программу со всеми деталями
-    source_session = await get_session_with_details(session, source_session_id)
+    """
+    Скопировать программу без сохранённых весов.
+    
+    Копирование выполняется на стороне БД набором INSERT ... SELECT в одной транзакции
+    (по одному запросу на таблицу), без загрузки программы в память.
+    Строки копии сопоставляются с оригиналом по порядковому номеру (ROW_NUMBER),
+    поэтому дубли day_index или order копируются корректно.
+    """
+    source_session = await get_session_by_id(session, source_session_id)
     if not source_session:
         raise ValueError(f"Программа с ID {source_session_id} не найдена")
     
-    # Создаём новую программу для пользователя
-    new_session = await create_session(session, target_user_id, new_name)
-    
-    # Копируем дни, упражнения и подходы (без весов)
-    for workout_day in source_session.workout_days:
-        new_day = await create_workout_day(
-            session, new_session.session_id, workout_day.day_index, workout_day.name
+    try:
+        # Создаём новую программу для пользователя
+        new_session_id = (await session.execute(
+            insert(Session)
+            .values(user_id=target_user_id, name=new_name)
+            .returning(Session.session_id)
+        )).scalar_one()
+        
+        # Дни
+        await session.execute(
+            insert(WorkoutDay).from_select(
+                ["session_id", "day_index", "name"],
+                select(
+                    literal(new_session_id, Integer),
+                    WorkoutDay.day_index,
+                    WorkoutDay.name
+                )
+                .where(WorkoutDay.session_id == source_session_id)
+                .order_by(WorkoutDay.day_index, WorkoutDay.id)
+            )
         )
         
-        for exercise in workout_day.exercises:
-            new_exercise = await create_exercise(
-                session, new_day.id, exercise.name, exercise.order
+        # Упражнения: старый день -> новый день по порядковому номеру
+        old_days = _numbered_days(source_session_id)
+        new_days = _numbered_days(new_session_id)
+        await session.execute(
+            insert(Exercise).from_select(
+                ["workout_day_id", "name", "order", "exercise_key_id"],
+                select(new_days.c.id, Exercise.name, Exercise.order, Exercise.exercise_key_id)
+                .join(old_days, Exercise.workout_day_id == old_days.c.id)
+                .join(new_days, new_days.c.rn == old_days.c.rn)
+                .order_by(old_days.c.rn, Exercise.order, Exercise.exercise_id)
             )
-            
-            # Копируем подходы без весов
-            for set_obj in exercise.sets:
-                await create_set(
-                    session, 
-                    new_exercise.exercise_id, 
-                    set_obj.set_index, 
-                    set_obj.reps, 
-                    weight=None  # Не копируем веса
-                )
+        )
+        
+        # Подходы без весов: старое упражнение -> новое упражнение по порядковому номеру
+        old_exercises = _numbered_exercises(source_session_id)
+        new_exercises = _numbered_exercises(new_session_id)
+        await session.execute(
+            insert(Set).from_select(
+                ["exercise_id", "set_index", "reps", "weight"],
+                select(new_exercises.c.exercise_id, Set.set_index, Set.reps, null())
+                .join(old_exercises, Set.exercise_id == old_exercises.c.exercise_id)
+                .join(new_exercises, new_exercises.c.rn == old_exercises.c.rn)
+            )
+        )
+        
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
     
-    return new_session
+    return await get_session_by_id(session, new_session_id)
 
 
 # ========== WorkoutDay ==========
@@ -154,10 +508,7 @@ async def create_workout_day(
 ) -> WorkoutDay:
     """Создать тренировочный день."""
     workout_day = WorkoutDay(session_id=session_id, day_index=day_index, name=name)
-    session.add(workout_day)
-    await session.commit()
-    await session.refresh(workout_day)
-    return workout_day
+    return await _save(session, workout_day)
 
 
 async def get_workout_days(session: AsyncSession, session_id: int) -> List[WorkoutDay]:
@@ -181,15 +532,106 @@ async def get_workout_day_by_id(session: AsyncSession, day_id: int) -> Optional[
     return result.scalar_one_or_none()
 
 
+# ========== ExerciseKey ==========
+def _exercise_key_id_subquery(exercise_name: str):
+    """Подзапрос ID ключа каталога для названия упражнения."""
+    return (
+        select(ExerciseKey.id)
+        .where(ExerciseKey.key == normalize_exercise_name(exercise_name))
+        .scalar_subquery()
+    )
+
+
+async def get_or_create_exercise_key_ids(
+    session: AsyncSession, exercise_names: List[str]
+) -> Dict[str, int]:
+    """
+    Получить ID ключей каталога для названий упражнений, создав недостающие.
+    
+    Не коммитит: вызывающий код сохраняет ключи вместе с упражнениями.
+    
+    Returns:
+        {exercise_name: exercise_key_id}
+    """
+    keys_by_name = {name: normalize_exercise_name(name) for name in exercise_names}
+    keys = set(keys_by_name.values())
+    if not keys:
+        return {}
+    
+    result = await session.execute(
+        select(ExerciseKey.key, ExerciseKey.id).where(ExerciseKey.key.in_(keys))
+    )
+    ids_by_key = dict(result.all())
+    
+    missing = keys - ids_by_key.keys()
+    if missing:
+        # ON CONFLICT DO NOTHING: ключ мог создать параллельный запрос
+        await session.execute(
+            _dialect_insert(session, ExerciseKey).on_conflict_do_nothing(index_elements=["key"]),
+            [{"key": key} for key in missing]
+        )
+        result = await session.execute(
+            select(ExerciseKey.key, ExerciseKey.id).where(ExerciseKey.key.in_(missing))
+        )
+        ids_by_key.update(result.all())
+    
+    return {name: ids_by_key[key] for name, key in keys_by_name.items()}
+
+
 # ========== Exercise ==========
 async def create_exercise(
     session: AsyncSession, workout_day_id: int, name: str, order: int
 ) -> Exercise:
     """Создать упражнение."""
-    exercise = Exercise(workout_day_id=workout_day_id, name=name, order=order)
-    session.add(exercise)
-    await session.commit()
-    await session.refresh(exercise)
+    key_ids = await get_or_create_exercise_key_ids(session, [name])
+    exercise = Exercise(
+        workout_day_id=workout_day_id, name=name, order=order, exercise_key_id=key_ids[name]
+    )
+    _forget_workout_days(session, [workout_day_id])
+    return await _save(session, exercise)
+
+
+async def update_exercise(
+    session: AsyncSession,
+    exercise: Exercise,
+    name: Optional[str] = None,
+    order: Optional[int] = None
+) -> Exercise:
+    """
+    Изменить название и/или порядок упражнения.
+    
+    При смене названия меняется ключ каталога, и история упражнения переходит
+    к новому ключу: строки latest_weights старого и нового ключа для
+    пользователей, выполнявших упражнение, пересобираются из истории.
+    После commit день упражнения убирается из кэша тренировок процесса.
+    """
+    try:
+        _forget_workout_days(session, [exercise.workout_day_id])
+        if name is not None:
+            old_key_id = exercise.exercise_key_id
+            key_ids = await get_or_create_exercise_key_ids(session, [name])
+            exercise.name = name
+            exercise.exercise_key_id = key_ids[name]
+            if exercise.exercise_key_id != old_key_id:
+                await session.flush()
+                user_ids = (await session.scalars(
+                    select(PerformedSet.user_id)
+                    .where(PerformedSet.exercise_id == exercise.exercise_id, PerformedSet.user_id.is_not(None))
+                    .distinct()
+                )).all()
+                await _refresh_latest_weights(session, [
+                    (user_id, key_id)
+                    for user_id in user_ids
+                    for key_id in (old_key_id, exercise.exercise_key_id)
+                    if key_id is not None
+                ])
+        if order is not None:
+            exercise.order = order
+        await session.flush()
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
     return exercise
 
 
@@ -210,10 +652,10 @@ async def create_set(
 ) -> Set:
     """Создать подход."""
     set_obj = Set(exercise_id=exercise_id, set_index=set_index, reps=reps, weight=weight)
-    session.add(set_obj)
-    await session.commit()
-    await session.refresh(set_obj)
-    return set_obj
+    day_id = await session.scalar(select(Exercise.workout_day_id).where(Exercise.exercise_id == exercise_id))
+    if day_id is not None:
+        _forget_workout_days(session, [day_id])
+    return await _save(session, set_obj)
 
 
 # ========== SessionRun ==========
@@ -222,10 +664,7 @@ async def create_session_run(
 ) -> SessionRun:
     """Создать запуск тренировки."""
     session_run = SessionRun(user_id=user_id, session_id=session_id)
-    session.add(session_run)
-    await session.commit()
-    await session.refresh(session_run)
-    return session_run
+    return await _save(session, session_run)
 
 
 async def get_session_run(session: AsyncSession, run_id: int) -> Optional[SessionRun]:
@@ -239,24 +678,272 @@ async def get_session_run(session: AsyncSession, run_id: int) -> Optional[Sessio
 
 
 # ========== PerformedSet ==========
+def _partitioned(session: AsyncSession) -> bool:
+    """
+    Добавлять ли в запросы истории нижнюю границу timestamp.
+    
+    Граница нужна только секционированной performed_sets в PostgreSQL: по ней
+    отсекаются секции прошлых месяцев. В SQLite это лишнее условие.
+    """
+    return PERFORMED_SETS_PARTITIONING and session.bind.dialect.name == "postgresql"
+
+
+def _not_before(lower_bound):
+    """
+    Условие «подход не раньше lower_bound» (подзапрос с моментом времени).
+    
+    Запас в сутки: timestamp подходов из бота — дата сообщения Telegram с
+    точностью до секунды.
+    """
+    return PerformedSet.timestamp >= func.coalesce(lower_bound, EPOCH) - timedelta(days=1)
+
+
+def _program_created_at(*conditions):
+    """Подзапрос: created_at программы, к которой относятся conditions."""
+    return (
+        select(Session.created_at)
+        .join(WorkoutDay, WorkoutDay.session_id == Session.session_id)
+        .join(Exercise, Exercise.workout_day_id == WorkoutDay.id)
+        .where(*conditions)
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+def _run_sets(session: AsyncSession, session_run_id: int):
+    """
+    Условие «подходы запуска тренировки».
+    
+    Для секционированной performed_sets добавляется нижняя граница timestamp
+    (подход не может быть раньше начала запуска).
+    """
+    condition = PerformedSet.session_run_id == session_run_id
+    if _partitioned(session):
+        started_at = (
+            select(SessionRun.started_at)
+            .where(SessionRun.id == session_run_id)
+            .scalar_subquery()
+        )
+        condition = and_(condition, _not_before(started_at))
+    return condition
+
+
+def _exercise_sets(session: AsyncSession, exercise_id: int):
+    """
+    Условие «подходы упражнения» для запросов истории.
+    
+    Для секционированной performed_sets добавляется нижняя граница timestamp:
+    подход упражнения не может быть раньше создания его программы (копия
+    программы получает новые упражнения). Более узкой границы у истории нет:
+    последний подход может быть сколь угодно старым, а ORDER BY timestamp DESC
+    LIMIT 1 в оставшихся секциях читает по одной записи покрывающего индекса.
+    """
+    condition = PerformedSet.exercise_id == exercise_id
+    if _partitioned(session):
+        condition = and_(condition, _not_before(_program_created_at(Exercise.exercise_id == exercise_id)))
+    return condition
+
+
 async def create_performed_set(
     session: AsyncSession,
     exercise_id: int,
     set_index: int,
     weight: float,
-    session_run_id: int
-) -> PerformedSet:
-    """Создать запись о выполненном подходе."""
-    performed_set = PerformedSet(
+    session_run_id: int,
+    user_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+    timestamp: Optional[datetime] = None
+) -> Tuple[PerformedSet, bool]:
+    """
+    Создать запись о выполненном подходе.
+    
+    user_id денормализуется из запуска тренировки; если он не передан,
+    берётся из session_runs.
+    
+    Запись идемпотентна по (idempotency_key, timestamp): повтор с тем же ключом
+    и временем (повторная доставка update) ничего не пишет и возвращает уже
+    сохранённый подход.
+    
+    Returns:
+        (подход, created): created=False, если подход с этим ключом уже был сохранён
+    """
+    if user_id is None:
+        user_id = await session.scalar(
+            select(SessionRun.user_id).where(SessionRun.id == session_run_id)
+        )
+    if timestamp is None:
+        timestamp = datetime.utcnow()
+    stmt = _dialect_insert(session, PerformedSet).values(
+        user_id=user_id,
         exercise_id=exercise_id,
         set_index=set_index,
         weight=weight,
-        session_run_id=session_run_id
+        session_run_id=session_run_id,
+        timestamp=timestamp,
+        idempotency_key=idempotency_key
+    ).on_conflict_do_nothing(index_elements=["idempotency_key", "timestamp"]).returning(PerformedSet)
+    performed_set = (await session.scalars(stmt)).one_or_none()
+    if performed_set is None:
+        return (await session.scalars(
+            select(PerformedSet).where(
+                PerformedSet.idempotency_key == idempotency_key,
+                PerformedSet.timestamp == timestamp
+            )
+        )).one(), False
+    
+    # timestamp в условии позволяет PostgreSQL читать только секцию текущего месяца
+    await _upsert_latest_weights(
+        session,
+        and_(PerformedSet.id == performed_set.id, PerformedSet.timestamp == performed_set.timestamp)
     )
-    session.add(performed_set)
-    await session.commit()
-    await session.refresh(performed_set)
-    return performed_set
+    await _commit(session)
+    return performed_set, True
+
+
+async def create_performed_sets(session: AsyncSession, sets: List[dict]) -> int:
+    """
+    Записать пачку выполненных подходов одной транзакцией (журнал write-behind).
+
+    Каждый элемент: exercise_id, set_index, weight, session_run_id, timestamp и
+    необязательные user_id и idempotency_key. Подходы удалённых запусков и
+    упражнений пропускаются, а уже записанные (тот же ключ идемпотентности или
+    тот же запуск, упражнение, подход и timestamp) не дублируются, поэтому
+    повторное воспроизведение журнала безопасно.
+
+    Returns:
+        int: Количество подходов, переданных в INSERT (без отброшенных заранее)
+    """
+    if not sets:
+        return 0
+    run_ids = {item["session_run_id"] for item in sets}
+    run_users = dict((await session.execute(
+        select(SessionRun.id, SessionRun.user_id).where(SessionRun.id.in_(run_ids))
+    )).all())
+    exercise_ids = set((await session.scalars(
+        select(Exercise.exercise_id).where(Exercise.exercise_id.in_({item["exercise_id"] for item in sets}))
+    )).all())
+    existing = set((await session.execute(
+        select(
+            PerformedSet.session_run_id, PerformedSet.exercise_id,
+            PerformedSet.set_index, PerformedSet.timestamp
+        ).where(PerformedSet.session_run_id.in_(run_ids))
+    )).all())
+
+    rows = [
+        {
+            "user_id": item.get("user_id") or run_users[item["session_run_id"]],
+            "exercise_id": item["exercise_id"],
+            "set_index": item["set_index"],
+            "weight": item["weight"],
+            "timestamp": item["timestamp"],
+            "session_run_id": item["session_run_id"],
+            "idempotency_key": item.get("idempotency_key"),
+        }
+        for item in sets
+        if item["session_run_id"] in run_users
+        and item["exercise_id"] in exercise_ids
+        and (item["session_run_id"], item["exercise_id"], item["set_index"], item["timestamp"]) not in existing
+    ]
+    if rows:
+        await session.execute(
+            _dialect_insert(session, PerformedSet).on_conflict_do_nothing(
+                index_elements=["idempotency_key", "timestamp"]
+            ),
+            rows
+        )
+        await _upsert_latest_weights(
+            session,
+            and_(
+                PerformedSet.session_run_id.in_({row["session_run_id"] for row in rows}),
+                PerformedSet.timestamp >= min(row["timestamp"] for row in rows)
+            )
+        )
+    await _commit(session)
+    return len(rows)
+
+
+async def _upsert_latest_weights(session: AsyncSession, performed_sets_filter):
+    """
+    Обновить latest_weights по выполненным подходам, подходящим под фильтр.
+    
+    Запись заменяется только более свежим подходом, поэтому порядок вызовов не важен.
+    Если под фильтр попадает несколько подходов одного ключа, берётся последний.
+    """
+    ranked = (
+        select(
+            PerformedSet.user_id,
+            Exercise.exercise_key_id,
+            PerformedSet.set_index,
+            PerformedSet.weight,
+            PerformedSet.timestamp,
+            PerformedSet.session_run_id,
+            func.row_number().over(
+                partition_by=(PerformedSet.user_id, Exercise.exercise_key_id, PerformedSet.set_index),
+                order_by=(desc(PerformedSet.timestamp), desc(PerformedSet.id))
+            ).label("rn")
+        )
+        .join(Exercise, PerformedSet.exercise_id == Exercise.exercise_id)
+        .where(
+            performed_sets_filter,
+            PerformedSet.user_id.is_not(None),
+            Exercise.exercise_key_id.is_not(None),
+            PerformedSet.timestamp.is_not(None)
+        )
+        .subquery()
+    )
+    stmt = _dialect_insert(session, LatestWeight).from_select(
+        ["user_id", "exercise_key_id", "set_index", "weight", "timestamp", "session_run_id"],
+        select(
+            ranked.c.user_id,
+            ranked.c.exercise_key_id,
+            ranked.c.set_index,
+            ranked.c.weight,
+            ranked.c.timestamp,
+            ranked.c.session_run_id
+        ).where(ranked.c.rn == 1)
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "exercise_key_id", "set_index"],
+        set_={
+            "weight": stmt.excluded.weight,
+            "timestamp": stmt.excluded.timestamp,
+            "session_run_id": stmt.excluded.session_run_id
+        },
+        where=LatestWeight.timestamp <= stmt.excluded.timestamp
+    )
+    await session.execute(stmt)
+
+
+async def _refresh_latest_weights(session: AsyncSession, pairs):
+    """
+    Пересобрать строки latest_weights для пар (user_id, exercise_key_id) из
+    performed_sets (после удаления истории или смены ключа упражнения).
+    """
+    pairs = [tuple(pair) for pair in pairs]
+    if not pairs:
+        return
+    await session.execute(
+        delete(LatestWeight).where(tuple_(LatestWeight.user_id, LatestWeight.exercise_key_id).in_(pairs))
+    )
+    await _upsert_latest_weights(session, tuple_(PerformedSet.user_id, Exercise.exercise_key_id).in_(pairs))
+
+
+async def rebuild_latest_weights(session: AsyncSession) -> int:
+    """
+    Пересобрать таблицу latest_weights из истории performed_sets.
+    
+    Returns:
+        int: Количество записей в latest_weights после пересборки
+    """
+    try:
+        await session.execute(LatestWeight.__table__.delete())
+        await _upsert_latest_weights(session, true())
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    result = await session.execute(select(func.count()).select_from(LatestWeight))
+    return result.scalar() or 0
 
 
 async def get_last_weight_for_set(
@@ -267,10 +954,9 @@ async def get_last_weight_for_set(
     # Исключаем текущую тренировку, если она еще не завершена
     subquery = (
         select(PerformedSet.weight)
-        .join(SessionRun, PerformedSet.session_run_id == SessionRun.id)
         .where(
-            SessionRun.user_id == user_id,
-            PerformedSet.exercise_id == exercise_id,
+            PerformedSet.user_id == user_id,
+            _exercise_sets(session, exercise_id),
             PerformedSet.set_index == set_index
         )
         .order_by(desc(PerformedSet.timestamp))
@@ -293,23 +979,30 @@ async def get_performed_sets_by_run(
     """Получить все выполненные подходы для запуска тренировки."""
     result = await session.execute(
         select(PerformedSet)
-        .where(PerformedSet.session_run_id == session_run_id)
+        .where(_run_sets(session, session_run_id))
         .options(selectinload(PerformedSet.exercise))
         .order_by(PerformedSet.exercise_id, PerformedSet.set_index)
     )
     return list(result.scalars().all())
 
 
+async def count_performed_sets_by_run(session: AsyncSession, session_run_id: int) -> int:
+    """Количество выполненных подходов запуска тренировки."""
+    result = await session.execute(
+        select(func.count()).select_from(PerformedSet).where(_run_sets(session, session_run_id))
+    )
+    return result.scalar() or 0
+
+
 async def get_last_performed_set_for_exercise(
     session: AsyncSession, user_id: int, exercise_id: int, set_index: int
 ) -> Optional[PerformedSet]:
     """Получить последний выполненный подход для упражнения и сета."""
     result = await session.execute(
         select(PerformedSet)
-        .join(SessionRun, PerformedSet.session_run_id == SessionRun.id)
         .where(
-            SessionRun.user_id == user_id,
-            PerformedSet.exercise_id == exercise_id,
+            PerformedSet.user_id == user_id,
+            _exercise_sets(session, exercise_id),
             PerformedSet.set_index == set_index
         )
         .order_by(desc(PerformedSet.timestamp))
@@ -323,20 +1016,15 @@ async def get_last_weight_for_exercise_by_name(
     session: AsyncSession, user_id: int, exercise_name: str, set_index: int
 ) -> Optional[float]:
     """Получить последний вес для упражнения по названию (независимо от exercise_id)."""
-    # Ищем по названию упражнения среди всех упражнений пользователя
-    subquery = (
-        select(PerformedSet.weight)
-        .join(SessionRun, PerformedSet.session_run_id == SessionRun.id)
-        .join(Exercise, PerformedSet.exercise_id == Exercise.exercise_id)
+    # Поиск по первичному ключу latest_weights: (пользователь, упражнение из каталога, подход)
+    result = await session.execute(
+        select(LatestWeight.weight)
         .where(
-            SessionRun.user_id == user_id,
-            Exercise.name == exercise_name,
-            PerformedSet.set_index == set_index
+            LatestWeight.user_id == user_id,
+            LatestWeight.exercise_key_id == _exercise_key_id_subquery(exercise_name),
+            LatestWeight.set_index == set_index
         )
-        .order_by(desc(PerformedSet.timestamp))
-        .limit(1)
     )
-    result = await session.execute(subquery)
     return result.scalar_one_or_none()
 
 
@@ -344,15 +1032,27 @@ async def get_last_performed_set_for_exercise_by_name(
     session: AsyncSession, user_id: int, exercise_name: str, set_index: int
 ) -> Optional[PerformedSet]:
     """Получить последний выполненный подход для упражнения по названию."""
+    exercise_key_id = _exercise_key_id_subquery(exercise_name)
+    conditions = [
+        PerformedSet.user_id == user_id,
+        Exercise.exercise_key_id == exercise_key_id,
+        PerformedSet.set_index == set_index
+    ]
+    if _partitioned(session):
+        # Время последнего подхода уже есть в latest_weights: остаются секции не старше него
+        conditions.append(_not_before(
+            select(LatestWeight.timestamp)
+            .where(
+                LatestWeight.user_id == user_id,
+                LatestWeight.exercise_key_id == exercise_key_id,
+                LatestWeight.set_index == set_index
+            )
+            .scalar_subquery()
+        ))
     result = await session.execute(
         select(PerformedSet)
-        .join(SessionRun, PerformedSet.session_run_id == SessionRun.id)
         .join(Exercise, PerformedSet.exercise_id == Exercise.exercise_id)
-        .where(
-            SessionRun.user_id == user_id,
-            Exercise.name == exercise_name,
-            PerformedSet.set_index == set_index
-        )
+        .where(*conditions)
         .order_by(desc(PerformedSet.timestamp))
         .limit(1)
         .options(selectinload(PerformedSet.exercise))
@@ -360,6 +1060,142 @@ async def get_last_performed_set_for_exercise_by_name(
     return result.scalar_one_or_none()
 
 
+async def get_previous_sets_for_day(
+    session: AsyncSession, user_id: int, workout_day_id: int
+) -> Dict[Tuple[int, int], Tuple[float, datetime]]:
+    """
+    Получить прошлые веса для всех подходов дня одним запросом.
+    
+    Для каждого упражнения дня и каждого set_index берётся последний выполненный подход:
+    сначала того же exercise_id (эта программа, покрывающий индекс performed_sets),
+    а если его нет — того же упражнения из каталога в других программах пользователя
+    (по первичному ключу таблицы latest_weights).
+    
+    Returns:
+        {(exercise_id, set_index): (weight, timestamp)}
+    """
+    day_exercise_ids = select(Exercise.exercise_id).where(Exercise.workout_day_id == workout_day_id)
+    conditions = [
+        PerformedSet.user_id == user_id,
+        PerformedSet.exercise_id.in_(day_exercise_ids)
+    ]
+    if _partitioned(session):
+        # Подходы упражнений дня не раньше создания программы (см. _exercise_sets)
+        conditions.append(_not_before(_program_created_at(WorkoutDay.id == workout_day_id)))
+    ranked = (
+        select(
+            PerformedSet.exercise_id,
+            PerformedSet.set_index,
+            PerformedSet.weight,
+            PerformedSet.timestamp,
+            func.row_number().over(
+                partition_by=(PerformedSet.exercise_id, PerformedSet.set_index),
+                order_by=(desc(PerformedSet.timestamp), desc(PerformedSet.id))
+            ).label("rn")
+        )
+        .where(*conditions)
+        .subquery()
+    )
+    same_exercise = (
+        select(
+            ranked.c.exercise_id,
+            ranked.c.set_index,
+            ranked.c.weight,
+            ranked.c.timestamp,
+            literal(0, Integer).label("priority")
+        )
+        .where(ranked.c.rn == 1)
+    )
+    same_key = (
+        select(
+            Exercise.exercise_id,
+            LatestWeight.set_index,
+            LatestWeight.weight,
+            LatestWeight.timestamp,
+            literal(1, Integer).label("priority")
+        )
+        .join(
+            LatestWeight,
+            and_(
+                LatestWeight.user_id == user_id,
+                LatestWeight.exercise_key_id == Exercise.exercise_key_id
+            )
+        )
+        .where(Exercise.workout_day_id == workout_day_id)
+    )
+    result = await session.execute(union_all(same_exercise, same_key))
+    previous_sets = {}
+    for row in result:
+        key = (row.exercise_id, row.set_index)
+        if row.priority == 0 or key not in previous_sets:
+            previous_sets[key] = (row.weight, row.timestamp)
+    return previous_sets
+
+
+async def get_previous_weights_for_run(
+    session: AsyncSession, user_id: int, session_run_id: int
+) -> Dict[Tuple[int, int], Optional[float]]:
+    """
+    Получить предыдущий вес для каждого подхода запуска тренировки одним запросом.
+    
+    Для каждой пары (exercise_id, set_index) из запуска берётся последний подход
+    пользователя из других запусков (текущий исключается по ID).
+    
+    Returns:
+        {(exercise_id, set_index): previous_weight или None}
+    """
+    current = (
+        select(PerformedSet.exercise_id, PerformedSet.set_index)
+        .where(_run_sets(session, session_run_id))
+        .distinct()
+        .subquery()
+    )
+    conditions = [
+        PerformedSet.user_id == user_id,
+        PerformedSet.session_run_id != session_run_id
+    ]
+    if _partitioned(session):
+        # Упражнения запуска принадлежат его программе: их подходы не раньше её создания
+        conditions.append(_not_before(
+            select(Session.created_at)
+            .join(SessionRun, SessionRun.session_id == Session.session_id)
+            .where(SessionRun.id == session_run_id)
+            .scalar_subquery()
+        ))
+    ranked = (
+        select(
+            PerformedSet.exercise_id,
+            PerformedSet.set_index,
+            PerformedSet.weight,
+            func.row_number().over(
+                partition_by=(PerformedSet.exercise_id, PerformedSet.set_index),
+                order_by=(desc(PerformedSet.timestamp), desc(PerformedSet.id))
+            ).label("rn")
+        )
+        .join(
+            current,
+            and_(
+                current.c.exercise_id == PerformedSet.exercise_id,
+                current.c.set_index == PerformedSet.set_index
+            )
+        )
+        .where(*conditions)
+        .subquery()
+    )
+    result = await session.execute(
+        select(current.c.exercise_id, current.c.set_index, ranked.c.weight)
+        .outerjoin(
+            ranked,
+            and_(
+                ranked.c.exercise_id == current.c.exercise_id,
+                ranked.c.set_index == current.c.set_index,
+                ranked.c.rn == 1
+            )
+        )
+    )
+    return {(row.exercise_id, row.set_index): row.weight for row in result}
+
+
 async def get_exercise_statistics(
     session: AsyncSession, user_id: int, exercise_id: int
 ) -> dict:
@@ -370,10 +1206,9 @@ async def get_exercise_statistics(
     # Получаем все выполненные подходы для этого упражнения
     result = await session.execute(
         select(PerformedSet)
-        .join(SessionRun, PerformedSet.session_run_id == SessionRun.id)
         .where(
-            SessionRun.user_id == user_id,
-            PerformedSet.exercise_id == exercise_id
+            PerformedSet.user_id == user_id,
+            _exercise_sets(session, exercise_id)
         )
         .order_by(PerformedSet.set_index, PerformedSet.timestamp)
     )
@@ -386,9 +1221,205 @@ async def get_exercise_statistics(
             stats[ps.set_index] = []
         stats[ps.set_index].append((ps.timestamp, ps.weight))
     
+    # Старая история хранится сжатой (performed_set_rollups)
+    result = await session.execute(
+        select(PerformedSetRollup.timestamp, PerformedSetRollup.sets)
+        .where(
+            PerformedSetRollup.user_id == user_id,
+            PerformedSetRollup.exercise_id == exercise_id
+        )
+    )
+    rollups = result.all()
+    if rollups:
+        for rollup in rollups:
+            for set_index, weight in rollup.sets:
+                stats.setdefault(set_index, []).append((rollup.timestamp, weight))
+        for history in stats.values():
+            history.sort(key=lambda item: item[0])
+        stats = dict(sorted(stats.items()))
+    
     return stats
 
 
+async def get_exercise_volume(
+    session: AsyncSession, user_id: int, exercise_id: int
+) -> List[Tuple[datetime, float]]:
+    """
+    Получить объём упражнения по тренировкам.
+    Возвращает список [(timestamp, volume), ...] по одному на запуск, от старых к новым.
+    """
+    result = await session.execute(
+        select(func.min(PerformedSet.timestamp), func.sum(_set_volume()))
+        .where(
+            PerformedSet.user_id == user_id,
+            _exercise_sets(session, exercise_id)
+        )
+        .group_by(PerformedSet.session_run_id)
+    )
+    volumes = [(timestamp, volume) for timestamp, volume in result]
+    
+    # Старая история: объём посчитан при сжатии той же формулой
+    result = await session.execute(
+        select(PerformedSetRollup.timestamp, PerformedSetRollup.volume)
+        .where(
+            PerformedSetRollup.user_id == user_id,
+            PerformedSetRollup.exercise_id == exercise_id
+        )
+    )
+    volumes.extend((timestamp, volume) for timestamp, volume in result)
+    volumes.sort(key=lambda item: item[0])
+    return volumes
+
+
+def _set_volume():
+    """
+    Объём подхода (вес × повторения) для статистики и сжатия истории.
+    
+    Выполненные повторения не записываются, берутся повторения подхода из программы.
+    """
+    reps = (
+        select(Set.reps)
+        .where(Set.exercise_id == PerformedSet.exercise_id, Set.set_index == PerformedSet.set_index)
+        .limit(1)
+        .scalar_subquery()
+    )
+    return PerformedSet.weight * func.coalesce(reps, 0)
+
+
+# ========== Rollups ==========
+
+
+async def get_users_with_history_before(session: AsyncSession, older_than: datetime) -> List[int]:
+    """ID пользователей, у которых есть подходы старше older_than."""
+    result = await session.execute(
+        select(PerformedSet.user_id)
+        .where(PerformedSet.timestamp < older_than, PerformedSet.user_id.is_not(None))
+        .distinct()
+    )
+    return list(result.scalars().all())
+
+
+async def compact_user_performed_sets(
+    session: AsyncSession, user_id: int, older_than: datetime, batch_size: int = ROLLUP_BATCH_SIZE
+) -> int:
+    """
+    Сжать старые подходы пользователя в performed_set_rollups.
+    
+    Группа (запуск, упражнение) сжимается, если все её подходы старше older_than
+    и ни один из них не входит в ROLLUP_KEEP_RECENT_RUNS последних запусков с той
+    же парой (упражнение, подход). Группы обрабатываются порциями по batch_size:
+    rollup-строки и удаление сжатых подходов каждой порции фиксируются своей
+    транзакцией, поэтому длинная история не держит одну большую транзакцию.
+    
+    Returns:
+        int: Количество созданных rollup-строк
+    """
+    run_rank = func.dense_rank().over(
+        partition_by=(PerformedSet.exercise_id, PerformedSet.set_index),
+        order_by=desc(PerformedSet.session_run_id)
+    )
+    ranked = (
+        select(
+            PerformedSet.session_run_id,
+            PerformedSet.exercise_id,
+            PerformedSet.timestamp,
+            run_rank.label("run_rank")
+        )
+        .where(PerformedSet.user_id == user_id)
+        .subquery()
+    )
+    result = await session.execute(
+        select(ranked.c.session_run_id, ranked.c.exercise_id, func.min(ranked.c.timestamp).label("first_timestamp"))
+        .group_by(ranked.c.session_run_id, ranked.c.exercise_id)
+        .having(
+            func.max(ranked.c.timestamp) < older_than,
+            func.min(ranked.c.run_rank) > ROLLUP_KEEP_RECENT_RUNS
+        )
+        .order_by(ranked.c.session_run_id, ranked.c.exercise_id)
+    )
+    rows = result.all()
+    
+    total = 0
+    for start in range(0, len(rows), max(batch_size, 1)):
+        batch = rows[start:start + batch_size]
+        groups = {(row.session_run_id, row.exercise_id) for row in batch}
+        # Подходы порции лежат между её самым ранним подходом и older_than
+        since = min(row.first_timestamp for row in batch)
+        total += await _compact_groups(session, user_id, since, older_than, groups)
+    return total
+
+
+async def _compact_groups(
+    session: AsyncSession, user_id: int, since: datetime, older_than: datetime, groups: set
+) -> int:
+    """
+    Сжать одну порцию групп (запуск, упражнение) и зафиксировать транзакцию.
+    
+    Для секционированной performed_sets чтение и удаление ограничены
+    timestamp >= since: PostgreSQL читает только секции месяцев порции.
+    """
+    in_range = [PerformedSet.timestamp < older_than]
+    if _partitioned(session):
+        in_range.append(PerformedSet.timestamp >= since)
+    result = await session.execute(
+        select(
+            PerformedSet.id,
+            PerformedSet.session_run_id,
+            PerformedSet.exercise_id,
+            PerformedSet.set_index,
+            PerformedSet.weight,
+            PerformedSet.timestamp,
+            _set_volume().label("volume")
+        )
+        .where(
+            PerformedSet.user_id == user_id,
+            *in_range,
+            PerformedSet.session_run_id.in_({run_id for run_id, _ in groups})
+        )
+        .order_by(PerformedSet.timestamp, PerformedSet.id)
+    )
+    rows_by_group: Dict[Tuple[int, int], list] = {}
+    for row in result:
+        key = (row.session_run_id, row.exercise_id)
+        if key in groups:
+            rows_by_group.setdefault(key, []).append(row)
+    
+    rollups = []
+    ids = []
+    for (session_run_id, exercise_id), rows in rows_by_group.items():
+        top_set = max(rows, key=lambda row: (row.volume, row.weight))
+        rollups.append({
+            "user_id": user_id,
+            "session_run_id": session_run_id,
+            "exercise_id": exercise_id,
+            "timestamp": rows[0].timestamp,
+            "set_count": len(rows),
+            "max_weight": max(row.weight for row in rows),
+            "top_set_weight": top_set.weight,
+            "volume": sum(row.volume for row in rows),
+            "sets": [[row.set_index, row.weight] for row in rows],
+        })
+        ids.extend(row.id for row in rows)
+    if not rollups:
+        return 0
+    
+    try:
+        await session.execute(insert(PerformedSetRollup), rollups)
+        # Удаляем порциями, чтобы не упереться в лимит параметров SQLite
+        for start in range(0, len(ids), 500):
+            await session.execute(
+                PerformedSet.__table__.delete().where(
+                    PerformedSet.id.in_(ids[start:start + 500]),
+                    *in_range
+                )
+            )
+        await _commit(session)
+    except Exception:
+        await session.rollback()
+        raise
+    return len(rollups)
+
+
 async def get_exercise_by_id(session: AsyncSession, exercise_id: int) -> Optional[Exercise]:
     """Получить упражнение по ID."""
     result = await session.execute(
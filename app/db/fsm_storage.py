@@ -0,0 +1,172 @@
+"""
+Хранилище состояний FSM aiogram в базе данных (FSM_STORAGE=database).
+
+Состояние и данные каждого чата лежат в одной строке fsm_states, поэтому
+незавершённые тренировки переживают перезапуск, а несколько процессов бота
+(webhook за балансировщиком) видят общее состояние.
+
+- Данные сериализуются в компактный JSON (без пробелов, без \\u-экранирования).
+- Каждая запись увеличивает version. Процесс кэширует строку по ключу не
+  дольше FSM_CACHE_TTL и при чтении сверяет только version и updated_at: если
+  строку не менял другой процесс, данные не передаются и не перечитываются.
+  updated_at отличает строку, созданную заново после удаления (version снова 1).
+- Строка без state и data удаляется (state.clear() в конце диалога), поэтому
+  в fsm_states остаются только чаты с незавершённым диалогом.
+- Внутри update чтение и запись идут через сессию update
+  (lazy_session.current_session): состояние фиксируется одним commit с данными
+  хендлера, без второго соединения из пула (на SQLite отдельная транзакция
+  ждала бы блокировку записи сессии хендлера). Кэш процесса обновляется только
+  после commit; при откате изменения FSM отбрасываются вместе с данными.
+"""
+import json
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from sqlalchemy import delete, event, select, update
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import FSM_CACHE_SIZE, FSM_CACHE_TTL
+from app.db.lazy_session import current_session
+from app.db.models import FsmState
+from app.utils.cache import TTLCache
+
+# Запись кэша: (version, state, data в JSON, updated_at)
+CachedState = Tuple[int, Optional[str], Optional[str], Optional[datetime]]
+# Строки нет
+EMPTY: CachedState = (0, None, None, None)
+
+# Ключ session.info: строки fsm_states, прочитанные и записанные в транзакции update
+FSM_ROWS = "fsm_rows"
+
+
+def _dumps(data: Dict[str, Any]) -> Optional[str]:
+    if not data:
+        return None
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class DatabaseStorage(BaseStorage):
+    """Хранилище FSM в таблице fsm_states с кэшем, проверяемым по версии строки."""
+
+    def __init__(self, engine: AsyncEngine, key_builder: Optional[KeyBuilder] = None):
+        self._engine = engine
+        self._key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._cache = TTLCache(max_size=FSM_CACHE_SIZE, ttl=FSM_CACHE_TTL)
+
+    def _insert(self):
+        if self._engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        return dialect_insert(FsmState)
+
+    async def _read(self, executor, storage_key: str, cached: Optional[CachedState]) -> CachedState:
+        """Прочитать строку через сессию или соединение (только version и updated_at, если кэш актуален)."""
+        if cached is not None:
+            current = (await executor.execute(
+                select(FsmState.version, FsmState.updated_at).where(FsmState.key == storage_key)
+            )).first()
+            if current is None:
+                return EMPTY
+            if tuple(current) == (cached[0], cached[3]):
+                return cached
+        row = (await executor.execute(
+            select(FsmState.version, FsmState.state, FsmState.data, FsmState.updated_at)
+            .where(FsmState.key == storage_key)
+        )).first()
+        return tuple(row) if row is not None else EMPTY
+
+    def _stage(self, session, storage_key: str, row: CachedState):
+        """Запомнить строку в транзакции update; в кэш процесса она попадёт после commit."""
+        rows = session.info.get(FSM_ROWS)
+        if rows is None:
+            rows = session.info[FSM_ROWS] = {}
+
+            def apply(_):
+                for staged_key, staged_row in rows.items():
+                    self._cache.set(staged_key, staged_row)
+
+            event.listen(session.sync_session, "after_commit", apply, once=True)
+        rows[storage_key] = row
+
+    async def _load(self, key: StorageKey) -> CachedState:
+        storage_key = self._key_builder.build(key)
+        session = current_session.get()
+        if session is None:
+            async with self._engine.connect() as conn:
+                loaded = await self._read(conn, storage_key, self._cache.get(storage_key))
+            self._cache.set(storage_key, loaded)
+            return loaded
+        # Повторное чтение в том же update (get_state в middleware, get_data в хендлере)
+        staged = session.info.get(FSM_ROWS, {}).get(storage_key)
+        if staged is not None:
+            return staged
+        loaded = await self._read(session, storage_key, self._cache.get(storage_key))
+        self._stage(session, storage_key, loaded)
+        return loaded
+
+    async def _write(
+        self, executor, storage_key: str, column: str, value: Optional[str], known: Optional[CachedState]
+    ) -> CachedState:
+        """
+        Записать state или data и новую версию строки; строку без state и data удалить.
+
+        known — последняя известная строка: если вторая колонка в ней не пуста,
+        удаление не пробуется. Удаление условное (вторая колонка IS NULL),
+        поэтому устаревшее known не стирает данные, записанные другим процессом.
+        """
+        now = datetime.utcnow()
+        returning = (FsmState.version, FsmState.state, FsmState.data, FsmState.updated_at)
+        if value is None:
+            other, other_index = (FsmState.data, 2) if column == "state" else (FsmState.state, 1)
+            if known is None or known[other_index] is None:
+                result = await executor.execute(
+                    delete(FsmState).where(FsmState.key == storage_key, other.is_(None))
+                )
+                if result.rowcount:
+                    return EMPTY
+            # Пустое значение не создаёт строку
+            row = (await executor.execute(
+                update(FsmState)
+                .where(FsmState.key == storage_key)
+                .values(**{column: None}, version=FsmState.version + 1, updated_at=now)
+                .returning(*returning)
+            )).first()
+            return tuple(row) if row is not None else EMPTY
+        stmt = self._insert().values(key=storage_key, version=1, updated_at=now, **{column: value})
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={column: value, "version": FsmState.version + 1, "updated_at": now}
+        ).returning(*returning)
+        return tuple((await executor.execute(stmt)).one())
+
+    async def _save(self, key: StorageKey, column: str, value: Optional[str]):
+        """Записать колонку в транзакции update, если она есть, иначе отдельной транзакцией."""
+        storage_key = self._key_builder.build(key)
+        session = current_session.get()
+        if session is None:
+            async with self._engine.begin() as conn:
+                row = await self._write(conn, storage_key, column, value, self._cache.get(storage_key))
+            self._cache.set(storage_key, row)
+            return
+        known = session.info.get(FSM_ROWS, {}).get(storage_key) or self._cache.get(storage_key)
+        row = await self._write(session, storage_key, column, value, known)
+        self._stage(session, storage_key, row)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._save(key, "state", state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._load(key))[1]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._save(key, "data", _dumps(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        data = (await self._load(key))[2]
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        self._cache.clear()
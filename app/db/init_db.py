@@ -1,17 +1,73 @@
 """Инициализация базы данных."""
+import asyncio
 import logging
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy import event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession, async_sessionmaker
+from app import config
 from app.config import DATABASE_URL
-from app.db.models import Base
+from app.db import instrumentation, partitioning, slow_query_log
+from app.db.migrations import migrate
 
 logger = logging.getLogger(__name__)
 
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Применить профиль SQLite к новому подключению."""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={config.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={config.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size={int(config.SQLITE_MMAP_SIZE)}")
+        cursor.execute(f"PRAGMA cache_size={int(config.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA busy_timeout={int(config.SQLITE_BUSY_TIMEOUT_MS)}")
+        # Без этого SQLite игнорирует внешние ключи и ON DELETE CASCADE
+        cursor.execute("PRAGMA foreign_keys=ON")
+    finally:
+        cursor.close()
+
+
+def build_engine(database_url: str) -> AsyncEngine:
+    """
+    Создать async engine с профилем настроек для backend.
+    
+    SQLite: WAL, synchronous, mmap_size, cache_size, busy_timeout и foreign_keys
+    на каждом подключении; подключения к файлу держатся в пуле (без пула aiosqlite
+    открывает подключение и повторяет PRAGMA на каждую транзакцию).
+    PostgreSQL (asyncpg): размер пула, pre-ping, recycle и кэш prepared statements.
+    Параметры берутся из app.config.
+    """
+    url_lower = database_url.lower()
+    if "sqlite" in url_lower:
+        pool_args = {}
+        if ":memory:" not in url_lower:
+            pool_args = {"poolclass": AsyncAdaptedQueuePool, "pool_size": config.SQLITE_POOL_SIZE}
+        sqlite_engine = create_async_engine(
+            database_url,
+            echo=False,
+            future=True,
+            connect_args={"timeout": config.SQLITE_BUSY_TIMEOUT_MS / 1000},
+            **pool_args
+        )
+        event.listen(sqlite_engine.sync_engine, "connect", _set_sqlite_pragmas)
+        return sqlite_engine
+    if "postgres" in url_lower:
+        return create_async_engine(
+            database_url,
+            echo=False,
+            future=True,
+            pool_size=config.DB_POOL_SIZE,
+            max_overflow=config.DB_MAX_OVERFLOW,
+            pool_pre_ping=config.DB_POOL_PRE_PING,
+            pool_recycle=config.DB_POOL_RECYCLE,
+            connect_args={"prepared_statement_cache_size": config.DB_STATEMENT_CACHE_SIZE}
+        )
+    return create_async_engine(database_url, echo=False, future=True)
+
+
 # Создаём async engine
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=False,
-    future=True
-)
+engine = build_engine(DATABASE_URL)
+instrumentation.install(engine)
 
 # Создаём session factory
 async_session_maker = async_sessionmaker(
@@ -20,6 +76,18 @@ async_session_maker = async_sessionmaker(
     expire_on_commit=False
 )
 
+# Engine для чтения: реплика из DATABASE_READ_URL или основной engine.
+# Данные на реплике могут немного отставать, поэтому путь записи тренировки её не использует
+read_engine = build_engine(config.DATABASE_READ_URL) if config.DATABASE_READ_URL else engine
+if read_engine is not engine:
+    instrumentation.install(read_engine)
+
+read_session_maker = async_sessionmaker(
+    read_engine,
+    class_=AsyncSession,
+    expire_on_commit=False
+)
+
 
 async def init_db():
     """Создание всех таблиц в базе данных."""
@@ -102,13 +170,13 @@ async def init_db():
     else:
         logger.warning(f"Неизвестный тип базы данных: {DATABASE_URL[:50]}...")
     
-    # Создаем таблицы (только если их нет - create_all не перезаписывает существующие таблицы)
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
-        logger.info("Таблицы проверены/созданы (существующие таблицы не перезаписываются)")
+    # Создаём таблицы и выполняем миграции. Если версия схемы актуальна,
+    # это один SELECT без рефлексии таблиц
+    await migrate(engine, is_postgresql)
     
-    # Выполняем миграции для существующих таблиц
-    await _run_migrations()
+    if is_postgresql and config.PERFORMED_SETS_PARTITIONING:
+        await _ensure_performed_sets_partitions()
+        _start_partitions_loop()
     
     # Проверяем, создался ли файл базы данных (для SQLite)
     if is_sqlite and DB_PATH:
@@ -141,67 +209,50 @@ async def init_db():
     logger.info("✅ База данных инициализирована")
 
 
-async def _run_migrations():
-    """Выполнение миграций базы данных."""
-    from sqlalchemy import text
-    from app.config import DATABASE_URL
-    
-    # Определяем тип базы данных
-    url_lower = DATABASE_URL.lower()
-    is_postgresql = "postgresql" in url_lower or "postgres" in url_lower
-    is_sqlite = "sqlite" in url_lower
-    
+_partitions_task = None
+
+
+async def _ensure_performed_sets_partitions():
+    """Создать секции performed_sets на ближайшие месяцы (если таблица секционирована)."""
     try:
         async with engine.begin() as conn:
-            # Проверяем, существует ли колонка username в таблице users
-            if is_postgresql:
-                # Для PostgreSQL
-                result = await conn.execute(text("""
-                    SELECT column_name 
-                    FROM information_schema.columns 
-                    WHERE table_name = 'users' 
-                    AND column_name = 'username'
-                    AND table_schema = 'public'
-                """))
-                column_exists = result.fetchone() is not None
-                
-                if not column_exists:
-                    logger.info("Выполнение миграции: добавление колонки username в таблицу users...")
-                    await conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR"))
-                    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_username ON users(username)"))
-                    logger.info("✅ Миграция выполнена: колонка username добавлена")
-                else:
-                    logger.info("✅ Колонка username уже существует")
-            else:
-                # Для SQLite
-                # SQLite не поддерживает ALTER TABLE ADD COLUMN IF NOT EXISTS напрямую
-                # Но мы можем проверить через PRAGMA table_info
-                try:
-                    result = await conn.execute(text("PRAGMA table_info(users)"))
-                    columns = result.fetchall()
-                    column_exists = any(col[1] == 'username' for col in columns)
-                    
-                    if not column_exists:
-                        logger.info("Выполнение миграции: добавление колонки username в таблицу users...")
-                        # SQLite требует более сложную миграцию через создание новой таблицы
-                        # Но для простоты используем ALTER TABLE (работает в SQLite 3.1.3+)
-                        await conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR"))
-                        await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_username ON users(username)"))
-                        logger.info("✅ Миграция выполнена: колонка username добавлена")
-                    else:
-                        logger.info("✅ Колонка username уже существует")
-                except Exception as e:
-                    logger.error(f"❌ Ошибка при проверке/добавлении колонки username в SQLite: {e}")
-                    logger.error("Возможно, требуется ручная миграция для SQLite")
+            if not await partitioning.is_partitioned(conn):
+                logger.warning(
+                    "⚠️ PERFORMED_SETS_PARTITIONING включено, но performed_sets не секционирована. "
+                    "Выполните: python -m app.db.maintenance partition-performed-sets"
+                )
+                return
+            months = await partitioning.ensure_partitions(conn)
+        logger.info(f"✅ Секции performed_sets готовы на {months} мес.")
     except Exception as e:
-        logger.error(f"❌ Ошибка при выполнении миграции: {e}")
-        logger.error("Продолжаем работу, но могут возникнуть проблемы с полем username")
-        # Не прерываем работу бота, так как это может быть временная проблема
+        logger.error(f"❌ Ошибка при создании секций performed_sets: {e}")
+        logger.error("Новые подходы попадут в секцию DEFAULT до следующей проверки")
+
+
+async def _partitions_loop():
+    """Раз в PARTITION_CHECK_INTERVAL_HOURS создавать секции на следующие месяцы."""
+    while True:
+        await asyncio.sleep(config.PARTITION_CHECK_INTERVAL_HOURS * 3600)
+        await _ensure_performed_sets_partitions()
+
+
+def _start_partitions_loop():
+    # Процесс, работающий дольше PARTITION_MONTHS_AHEAD месяцев, иначе писал бы всё в DEFAULT
+    global _partitions_task
+    if config.PARTITION_CHECK_INTERVAL_HOURS > 0 and (_partitions_task is None or _partitions_task.done()):
+        _partitions_task = asyncio.create_task(_partitions_loop())
 
 
 async def close_db():
     """Закрытие соединения с базой данных."""
+    global _partitions_task
+    if _partitions_task is not None:
+        _partitions_task.cancel()
+        _partitions_task = None
+    await slow_query_log.stop()
     await engine.dispose()
+    if read_engine is not engine:
+        await read_engine.dispose()
     logger.info("Соединение с базой данных закрыто")
 
 
@@ -209,4 +260,3 @@ async def get_session() -> AsyncSession:
     """Получить сессию базы данных."""
     async with async_session_maker() as session:
         yield session
-
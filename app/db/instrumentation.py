@@ -0,0 +1,208 @@
+"""
+Учёт SQL-запросов по хендлерам бота и маршрутам API.
+
+Хуки before/after_cursor_execute на engine добавляют каждый запрос в текущую
+область учёта (contextvar). Область открывается на время обработки update
+(UpdateSessionMiddleware, имя хендлера задаёт DatabaseMiddleware) или
+HTTP-запроса (middleware API) через track(). По
+завершении области число запросов и время в БД попадают в гистограммы по имени
+хендлера/маршрута: snapshot() и GET /api/metrics/db в API, периодическая
+сводка в лог (DB_METRICS_LOG_INTERVAL_MINUTES) в процессе бота. Запросы дольше
+SLOW_QUERY_THRESHOLD_MS записываются в журнал медленных запросов (slow_query_log).
+
+Бюджет запросов задаётся флагом хендлера aiogram (flags={"query_budget": N})
+или контекстным менеджером query_budget(N) в тестах и бенчмарках. Превышение
+логируется; при DB_QUERY_BUDGET_STRICT=true выбрасывается QueryBudgetExceeded.
+"""
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from app.config import DB_QUERY_BUDGET_STRICT, SLOW_QUERY_THRESHOLD_MS
+from app.db import slow_query_log
+
+logger = logging.getLogger(__name__)
+
+# Флаг хендлера aiogram с бюджетом запросов на update
+QUERY_BUDGET = "query_budget"
+
+# Имя области для HTTP-запросов без маршрута (404): путь из URL не попадает в метрики
+UNMATCHED_ROUTE = "<unmatched>"
+
+QUERY_COUNT_BUCKETS = [1, 2, 3, 5, 10, 20, 50, 100]
+DB_TIME_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500]
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Область учёта выполнила больше запросов, чем разрешено бюджетом."""
+
+
+class QueryStats:
+    """Запросы, выполненные в одной области учёта."""
+
+    def __init__(self, name: str, budget: Optional[int] = None):
+        self.name = name
+        # Имя и бюджет можно уточнить внутри области (middleware хендлера)
+        self.budget = budget
+        self.count = 0
+        self.duration_ms = 0.0
+        self.statements: List[str] = []
+
+    def add(self, statement: str, duration_ms: float):
+        self.count += 1
+        self.duration_ms += duration_ms
+        self.statements.append(statement)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (значение <= границы)."""
+
+    def __init__(self, buckets: List[float]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def as_dict(self) -> dict:
+        labels = [f"<={bound:g}" for bound in self.buckets] + ["+Inf"]
+        return {
+            "buckets": dict(zip(labels, self.counts)),
+            "count": self.count,
+            "sum": round(self.sum, 3),
+        }
+
+
+_current: ContextVar[Optional[QueryStats]] = ContextVar("db_query_stats", default=None)
+# имя области -> {"queries": Histogram, "db_time_ms": Histogram}
+_histograms: Dict[str, Dict[str, Histogram]] = {}
+
+
+def current_stats() -> Optional[QueryStats]:
+    """Статистика текущей области учёта (None вне области)."""
+    return _current.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration_ms = (time.perf_counter() - conn.info["query_start_time"].pop()) * 1000
+    stats = _current.get()
+    if stats is not None:
+        stats.add(statement, duration_ms)
+    if SLOW_QUERY_THRESHOLD_MS > 0 and duration_ms >= SLOW_QUERY_THRESHOLD_MS:
+        slow_query_log.record(
+            conn, statement, parameters, executemany, duration_ms, stats.name if stats else None
+        )
+
+
+def _handle_error(context):
+    # after_cursor_execute не вызывается для упавшего запроса: снимаем его время со стека
+    conn = context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def install(engine: AsyncEngine):
+    """Подключить учёт запросов к engine."""
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine.sync_engine, "handle_error", _handle_error)
+
+
+def _observe(stats: QueryStats):
+    histograms = _histograms.get(stats.name)
+    if histograms is None:
+        histograms = _histograms[stats.name] = {
+            "queries": Histogram(QUERY_COUNT_BUCKETS),
+            "db_time_ms": Histogram(DB_TIME_BUCKETS_MS),
+        }
+    histograms["queries"].observe(stats.count)
+    histograms["db_time_ms"].observe(stats.duration_ms)
+
+
+def _check_budget(stats: QueryStats, budget: Optional[int], strict: bool):
+    if budget is None or stats.count <= budget:
+        return
+    message = f"{stats.name}: {stats.count} SQL-запросов при бюджете {budget}"
+    if strict:
+        raise QueryBudgetExceeded(message + ":\n" + "\n".join(stats.statements))
+    logger.warning(message)
+
+
+@contextmanager
+def track(name: str, budget: Optional[int] = None):
+    """
+    Учитывать запросы внутри блока под именем name.
+
+    Вложенные области не создаются: запросы относятся к внешней области.
+    """
+    if _current.get() is not None:
+        yield _current.get()
+        return
+    stats = QueryStats(name, budget)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        _observe(stats)
+    _check_budget(stats, stats.budget, DB_QUERY_BUDGET_STRICT)
+
+
+@contextmanager
+def query_budget(max_queries: int, name: str = "query_budget"):
+    """
+    Для тестов и бенчмарков: выбросить QueryBudgetExceeded, если блок выполнил
+    больше max_queries запросов (независимо от DB_QUERY_BUDGET_STRICT).
+    """
+    stats = QueryStats(name)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+    _check_budget(stats, max_queries, strict=True)
+
+
+def snapshot() -> Dict[str, dict]:
+    """Гистограммы по областям учёта: {имя: {"queries": ..., "db_time_ms": ...}}."""
+    return {
+        name: {metric: histogram.as_dict() for metric, histogram in histograms.items()}
+        for name, histograms in sorted(_histograms.items())
+    }
+
+
+def log_summary():
+    """Записать в лог среднее число запросов и время в БД по областям учёта."""
+    for name, histograms in sorted(_histograms.items()):
+        queries, db_time = histograms["queries"], histograms["db_time_ms"]
+        logger.info(
+            f"БД {name}: {queries.count} вызовов, "
+            f"в среднем {queries.sum / queries.count:.1f} запросов и {db_time.sum / db_time.count:.1f} мс"
+        )
+
+
+async def log_summary_loop(interval_minutes: int):
+    """Периодически писать сводку в лог (для процесса бота, у которого нет HTTP)."""
+    while True:
+        await asyncio.sleep(interval_minutes * 60)
+        log_summary()
+
+
+def reset():
+    """Очистить гистограммы."""
+    _histograms.clear()
@@ -0,0 +1,55 @@
+"""Ленивая сессия БД для middleware бота."""
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from app.db import crud
+
+
+class LazySession:
+    """
+    Прокси AsyncSession: настоящая сессия создаётся при первом обращении.
+
+    Update, который отбрасывается фильтрами или обрабатывается без БД,
+    не создаёт сессию и не берёт соединение из пула. Все атрибуты и методы
+    проксируются в AsyncSession, поэтому хендлеры и crud работают как раньше.
+    """
+
+    def __init__(self, session_maker: async_sessionmaker, unit_of_work: bool = True):
+        self._session_maker = session_maker
+        self._unit_of_work = unit_of_work
+        self._session: Optional[AsyncSession] = None
+
+    @property
+    def is_used(self) -> bool:
+        """Обращался ли хендлер к БД."""
+        return self._session is not None
+
+    def _get(self) -> AsyncSession:
+        if self._session is None:
+            self._session = self._session_maker()
+            if self._unit_of_work:
+                # Функции crud только делают flush, commit — один раз в finish()
+                crud.begin_unit_of_work(self._session)
+        return self._session
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    async def finish(self, commit: bool):
+        """Зафиксировать (или откатить) изменения и закрыть сессию, если она создавалась."""
+        if self._session is None:
+            return
+        try:
+            if commit and self._unit_of_work:
+                await self._session.commit()
+            else:
+                await self._session.rollback()
+        finally:
+            await self._session.close()
+
+
+# Сессия текущего update: через неё пишет и хранилище FSM (app/db/fsm_storage.py),
+# поэтому состояние фиксируется в одной транзакции с данными хендлера
+current_session: ContextVar[Optional[LazySession]] = ContextVar("current_session", default=None)
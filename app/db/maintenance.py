@@ -0,0 +1,87 @@
+"""
+Служебные команды для базы данных.
+Использование:
+    python -m app.db.maintenance rebuild-latest-weights
+    python -m app.db.maintenance partition-performed-sets
+    python -m app.db.maintenance create-partitions
+    python -m app.db.maintenance compact-performed-sets --horizon-days 365
+"""
+import argparse
+import asyncio
+import logging
+
+from app.config import ROLLUP_HORIZON_DAYS
+from app.db import crud, partitioning
+from app.db.init_db import init_db, close_db, async_session_maker, engine
+
+logger = logging.getLogger(__name__)
+
+
+async def rebuild_latest_weights():
+    """Пересобрать таблицу latest_weights из истории performed_sets."""
+    async with async_session_maker() as session:
+        count = await crud.rebuild_latest_weights(session)
+    logger.info(f"✅ Таблица latest_weights пересобрана: {count} записей")
+
+
+def _require_postgresql():
+    if engine.dialect.name != "postgresql":
+        raise SystemExit("Секционирование performed_sets поддерживается только для PostgreSQL")
+
+
+async def partition_performed_sets():
+    """Перевести performed_sets в помесячно секционированную таблицу."""
+    _require_postgresql()
+    async with engine.begin() as conn:
+        await partitioning.partition_performed_sets(conn)
+
+
+async def create_partitions():
+    """Создать секции performed_sets на текущий и следующие месяцы (для cron)."""
+    _require_postgresql()
+    async with engine.begin() as conn:
+        months = await partitioning.ensure_partitions(conn)
+    if not months:
+        logger.warning("performed_sets не секционирована, секции не созданы")
+
+
+async def compact_performed_sets(horizon_days: int):
+    """Сжать подходы старше horizon_days в performed_set_rollups."""
+    from app.services.compaction import compact_history
+    
+    await compact_history(horizon_days)
+
+
+COMMANDS = {
+    "rebuild-latest-weights": rebuild_latest_weights,
+    "partition-performed-sets": partition_performed_sets,
+    "create-partitions": create_partitions,
+    "compact-performed-sets": compact_performed_sets,
+}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Служебные команды базы данных")
+    parser.add_argument("command", choices=sorted(COMMANDS))
+    parser.add_argument(
+        "--horizon-days", type=int, default=ROLLUP_HORIZON_DAYS or 365,
+        help="compact-performed-sets: сжимать подходы старше N дней"
+    )
+    args = parser.parse_args()
+
+    await init_db()
+    try:
+        if args.command == "compact-performed-sets":
+            await compact_performed_sets(args.horizon_days)
+        else:
+            await COMMANDS[args.command]()
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    asyncio.run(main())
@@ -0,0 +1,339 @@
+"""
+Версионные миграции схемы базы данных.
+
+Текущая версия хранится в таблице schema_version. При старте читается одна строка:
+если версия совпадает с последней миграцией, ничего больше не выполняется
+(нет create_all и рефлексии таблиц). Иначе по порядку применяются недостающие
+миграции, каждая в своей транзакции вместе с обновлением версии.
+
+Новую миграцию добавляйте в конец MIGRATIONS со следующим номером. Миграции
+должны быть идемпотентными: базы, созданные до появления schema_version,
+проходят все миграции с нуля.
+"""
+import logging
+from typing import Awaitable, Callable, List, NamedTuple
+
+from sqlalchemy import text, select, update, bindparam, exists
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.db.models import (
+    Base, Exercise, ExerciseKey, FsmState, LatestWeight, PerformedSet, PerformedSetRollup, Session, User
+)
+from app.db.pagination import EPOCH
+from app.services.parser import normalize_exercise_name
+
+logger = logging.getLogger(__name__)
+
+# Ключ pg_advisory_xact_lock: бот и API могут стартовать одновременно
+MIGRATION_LOCK_ID = 727_001
+
+
+class Migration(NamedTuple):
+    """Шаг миграции схемы."""
+    version: int
+    description: str
+    apply: Callable[[AsyncConnection, bool], Awaitable[None]]
+
+
+async def _column_exists(conn, table: str, column: str, is_postgresql: bool) -> bool:
+    """Проверить, существует ли колонка в таблице."""
+    if is_postgresql:
+        result = await conn.execute(text("""
+            SELECT column_name
+            FROM information_schema.columns
+            WHERE table_name = :table
+            AND column_name = :column
+            AND table_schema = 'public'
+        """), {"table": table, "column": column})
+        return result.fetchone() is not None
+
+    result = await conn.execute(text(f"PRAGMA table_info({table})"))
+    return any(col[1] == column for col in result.fetchall())
+
+
+async def _create_tables(conn, is_postgresql: bool):
+    """Создать недостающие таблицы (существующие таблицы не перезаписываются)."""
+    await conn.run_sync(Base.metadata.create_all)
+
+
+async def _add_users_username(conn, is_postgresql: bool):
+    """Добавить колонку users.username."""
+    if not await _column_exists(conn, "users", "username", is_postgresql):
+        logger.info("Выполнение миграции: добавление колонки username в таблицу users...")
+        await conn.execute(text("ALTER TABLE users ADD COLUMN username VARCHAR"))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_username ON users(username)"))
+
+
+async def _add_performed_sets_user_id(conn, is_postgresql: bool):
+    """Добавить денормализованный user_id в performed_sets, заполнить его и построить индекс."""
+    if not await _column_exists(conn, "performed_sets", "user_id", is_postgresql):
+        logger.info("Выполнение миграции: добавление колонки user_id в таблицу performed_sets...")
+        await conn.execute(text(
+            "ALTER TABLE performed_sets ADD COLUMN user_id INTEGER REFERENCES users(id) ON DELETE CASCADE"
+        ))
+
+    # Заполняем user_id для старых записей
+    result = await conn.execute(text("""
+        UPDATE performed_sets
+        SET user_id = (
+            SELECT session_runs.user_id
+            FROM session_runs
+            WHERE session_runs.id = performed_sets.session_run_id
+        )
+        WHERE user_id IS NULL
+    """))
+    if result.rowcount:
+        logger.info(f"✅ Заполнен user_id для {result.rowcount} выполненных подходов")
+
+    await conn.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_performed_user_exercise_set_ts
+        ON performed_sets (user_id, exercise_id, set_index, timestamp DESC, weight)
+    """))
+
+
+async def _add_exercise_keys(conn, is_postgresql: bool):
+    """Добавить exercises.exercise_key_id и заполнить каталог нормализованных названий."""
+    if not await _column_exists(conn, "exercises", "exercise_key_id", is_postgresql):
+        logger.info("Выполнение миграции: добавление колонки exercise_key_id в таблицу exercises...")
+        await conn.execute(text(
+            "ALTER TABLE exercises ADD COLUMN exercise_key_id INTEGER REFERENCES exercise_keys(id)"
+        ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_exercises_exercise_key_id ON exercises(exercise_key_id)"
+    ))
+
+    result = await conn.execute(
+        select(Exercise.exercise_id, Exercise.name).where(Exercise.exercise_key_id.is_(None))
+    )
+    exercises = result.all()
+    if not exercises:
+        return
+
+    keys_by_exercise = {row.exercise_id: normalize_exercise_name(row.name) for row in exercises}
+    await _assign_exercise_keys(conn, keys_by_exercise)
+    logger.info(f"✅ Каталог упражнений: привязано {len(keys_by_exercise)} упражнений")
+
+
+async def _assign_exercise_keys(conn, keys_by_exercise: dict):
+    """Привязать упражнения к ключам каталога, добавив недостающие ключи."""
+    result = await conn.execute(select(ExerciseKey.key, ExerciseKey.id))
+    ids_by_key = dict(result.all())
+    missing = set(keys_by_exercise.values()) - ids_by_key.keys()
+    if missing:
+        await conn.execute(ExerciseKey.__table__.insert(), [{"key": key} for key in missing])
+        result = await conn.execute(select(ExerciseKey.key, ExerciseKey.id))
+        ids_by_key = dict(result.all())
+
+    await conn.execute(
+        update(Exercise.__table__)
+        .where(Exercise.__table__.c.exercise_id == bindparam("b_exercise_id"))
+        .values(exercise_key_id=bindparam("b_key_id")),
+        [
+            {"b_exercise_id": exercise_id, "b_key_id": ids_by_key[key]}
+            for exercise_id, key in keys_by_exercise.items()
+        ]
+    )
+
+
+async def _rekey_numbered_exercises(conn, is_postgresql: bool):
+    """
+    Пересчитать ключи каталога после исправления normalize_exercise_name.
+    
+    Раньше из ключа убирались все числа в конце названия, и «Упражнение 1.1» и
+    «Упражнение 1.2» делили историю весов. Упражнения, ключ которых изменился,
+    привязываются к новым ключам, latest_weights пересобирается.
+    """
+    from app.db import crud
+
+    result = await conn.execute(
+        select(Exercise.exercise_id, Exercise.name, ExerciseKey.key)
+        .join(ExerciseKey, ExerciseKey.id == Exercise.exercise_key_id)
+    )
+    keys_by_exercise = {}
+    for row in result:
+        key = normalize_exercise_name(row.name)
+        if key != row.key:
+            keys_by_exercise[row.exercise_id] = key
+    if not keys_by_exercise:
+        return
+    await _assign_exercise_keys(conn, keys_by_exercise)
+    async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+        count = await crud.rebuild_latest_weights(session)
+    logger.info(
+        f"✅ Каталог упражнений: перепривязано {len(keys_by_exercise)} упражнений, latest_weights: {count} записей"
+    )
+
+
+async def _fill_latest_weights(conn, is_postgresql: bool):
+    """Заполнить latest_weights из истории, если таблица пуста."""
+    from app.db import crud
+
+    has_latest = await conn.scalar(select(exists().where(LatestWeight.user_id.is_not(None))))
+    has_history = await conn.scalar(select(exists().where(PerformedSet.id.is_not(None))))
+    if has_latest or not has_history:
+        return
+
+    async with AsyncSession(bind=conn, expire_on_commit=False) as session:
+        count = await crud.rebuild_latest_weights(session)
+    logger.info(f"✅ Таблица latest_weights заполнена: {count} записей")
+
+
+async def _add_pagination_indexes(conn, is_postgresql: bool):
+    """Индексы (created_at, id) для keyset-пагинации пользователей и программ."""
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_users_created_id ON users (created_at, id)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_created_id ON sessions (created_at, session_id)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS idx_sessions_user_created_id ON sessions (user_id, created_at, session_id)"
+    ))
+
+
+async def _create_rollups_table(conn, is_postgresql: bool):
+    """Таблица сжатой истории performed_set_rollups."""
+    await conn.run_sync(lambda sync_conn: PerformedSetRollup.__table__.create(sync_conn, checkfirst=True))
+
+
+async def _fix_sqlite_foreign_keys(conn, is_postgresql: bool):
+    """
+    Исправить нарушения внешних ключей перед включением PRAGMA foreign_keys=ON.
+    
+    Раньше SQLite не проверял ссылки и не выполнял ON DELETE, поэтому могли
+    остаться строки-сироты: они удаляются (или ссылка обнуляется для ON DELETE SET NULL).
+    """
+    if is_postgresql:
+        return
+    result = await conn.execute(text("PRAGMA foreign_key_check"))
+    violations = result.all()
+    if not violations:
+        return
+    
+    fixed = 0
+    for table, rowid, parent, fkid in violations:
+        if rowid is None:
+            continue
+        result = await conn.execute(text(f"PRAGMA foreign_key_list({table})"))
+        foreign_key = next(row for row in result.all() if row[0] == fkid)
+        column, on_delete = foreign_key[3], foreign_key[6]
+        if on_delete == "SET NULL":
+            await conn.execute(text(f"UPDATE {table} SET {column} = NULL WHERE rowid = :rowid"), {"rowid": rowid})
+        else:
+            await conn.execute(text(f"DELETE FROM {table} WHERE rowid = :rowid"), {"rowid": rowid})
+        fixed += 1
+    logger.info(f"✅ Исправлено нарушений внешних ключей: {fixed}")
+
+
+async def _add_performed_sets_idempotency_key(conn, is_postgresql: bool):
+    """Ключ идемпотентности performed_sets.idempotency_key и уникальный индекс по нему."""
+    if not await _column_exists(conn, "performed_sets", "idempotency_key", is_postgresql):
+        logger.info("Выполнение миграции: добавление колонки idempotency_key в таблицу performed_sets...")
+        await conn.execute(text("ALTER TABLE performed_sets ADD COLUMN idempotency_key VARCHAR"))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_performed_sets_idempotency "
+        "ON performed_sets (idempotency_key, timestamp)"
+    ))
+
+
+async def _create_fsm_states_table(conn, is_postgresql: bool):
+    """Таблица fsm_states для хранилища FSM в БД."""
+    await conn.run_sync(lambda sync_conn: FsmState.__table__.create(sync_conn, checkfirst=True))
+
+
+async def _fill_created_at(conn, is_postgresql: bool):
+    """
+    Заполнить пустой created_at старых пользователей и программ.
+    
+    Keyset-пагинация пропускает строки без created_at; старые строки получают
+    начало эпохи и оказываются в начале списка.
+    """
+    for model in (User, Session):
+        # Через модель: SQLite хранит дату строкой, формат должен совпадать с остальными строками
+        result = await conn.execute(
+            update(model).where(model.created_at.is_(None)).values(created_at=EPOCH)
+        )
+        if result.rowcount:
+            logger.info(f"✅ {model.__tablename__}: заполнен created_at у {result.rowcount} строк")
+
+
+async def _delete_empty_fsm_states(conn, is_postgresql: bool):
+    """Удалить строки fsm_states без состояния и данных (раньше clear() оставлял их навсегда)."""
+    result = await conn.execute(
+        FsmState.__table__.delete().where(FsmState.state.is_(None), FsmState.data.is_(None))
+    )
+    if result.rowcount:
+        logger.info(f"✅ fsm_states: удалено {result.rowcount} пустых строк")
+
+
+MIGRATIONS: List[Migration] = [
+    Migration(1, "создание таблиц", _create_tables),
+    Migration(2, "users.username", _add_users_username),
+    Migration(3, "performed_sets.user_id и индекс истории весов", _add_performed_sets_user_id),
+    Migration(4, "каталог упражнений exercise_keys", _add_exercise_keys),
+    Migration(5, "заполнение latest_weights", _fill_latest_weights),
+    Migration(6, "индексы keyset-пагинации", _add_pagination_indexes),
+    Migration(7, "таблица performed_set_rollups", _create_rollups_table),
+    Migration(8, "строки-сироты перед включением внешних ключей SQLite", _fix_sqlite_foreign_keys),
+    Migration(9, "ключ идемпотентности performed_sets", _add_performed_sets_idempotency_key),
+    Migration(10, "таблица fsm_states", _create_fsm_states_table),
+    Migration(11, "created_at старых пользователей и программ", _fill_created_at),
+    Migration(12, "ключи каталога упражнений с числами в названии", _rekey_numbered_exercises),
+    Migration(13, "пустые строки fsm_states", _delete_empty_fsm_states),
+]
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def get_schema_version(engine: AsyncEngine) -> int:
+    """Текущая версия схемы (0, если таблицы schema_version ещё нет)."""
+    try:
+        async with engine.connect() as conn:
+            return await conn.scalar(text("SELECT MAX(version) FROM schema_version")) or 0
+    except Exception:
+        return 0
+
+
+async def migrate(engine: AsyncEngine, is_postgresql: bool) -> int:
+    """
+    Привести схему к последней версии.
+
+    Returns:
+        int: Версия схемы после миграций
+    """
+    version = await get_schema_version(engine)
+    if version >= LATEST_VERSION:
+        logger.info(f"✅ Схема БД актуальна (версия {version})")
+        return version
+
+    async with engine.begin() as conn:
+        await conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+
+    for migration in MIGRATIONS:
+        if migration.version <= version:
+            continue
+        try:
+            async with engine.begin() as conn:
+                if is_postgresql:
+                    await conn.execute(text(f"SELECT pg_advisory_xact_lock({MIGRATION_LOCK_ID})"))
+                # Другой процесс мог применить миграцию, пока мы ждали блокировку
+                current = await conn.scalar(text("SELECT MAX(version) FROM schema_version")) or 0
+                if migration.version <= current:
+                    version = current
+                    continue
+                logger.info(f"Миграция {migration.version}: {migration.description}...")
+                await migration.apply(conn, is_postgresql)
+                await conn.execute(text("DELETE FROM schema_version"))
+                await conn.execute(
+                    text("INSERT INTO schema_version (version) VALUES (:version)"),
+                    {"version": migration.version}
+                )
+            version = migration.version
+            logger.info(f"✅ Миграция {migration.version} выполнена")
+        except Exception as e:
+            logger.error(f"❌ Ошибка при выполнении миграции {migration.version} ({migration.description}): {e}")
+            logger.error("Продолжаем работу, но могут возникнуть проблемы со схемой БД")
+            # Не прерываем работу бота, так как это может быть временная проблема
+            break
+
+    return version
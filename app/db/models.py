@@ -1,7 +1,7 @@
 """Модели базы данных."""
 from datetime import datetime
 from sqlalchemy import (
-    Column, Integer, String, ForeignKey, DateTime, Float, Index
+    Column, Integer, String, Text, ForeignKey, DateTime, Float, Index, JSON, UniqueConstraint, desc
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -9,6 +9,9 @@ from sqlalchemy.orm import relationship
 Base = declarative_base()
 
 
+# Связи с cascade используют passive_deletes=True: дочерние строки удаляет
+# ON DELETE CASCADE в БД (для SQLite включается PRAGMA foreign_keys=ON),
+# ORM не загружает их в память перед удалением
 class User(Base):
     """Модель пользователя."""
     __tablename__ = "users"
@@ -18,8 +21,13 @@ class User(Base):
     username = Column(String, nullable=True, index=True)  # Telegram username (может быть None)
     created_at = Column(DateTime, default=datetime.utcnow)
     
-    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan")
-    session_runs = relationship("SessionRun", back_populates="user", cascade="all, delete-orphan")
+    sessions = relationship("Session", back_populates="user", cascade="all, delete-orphan", passive_deletes=True, order_by="Session.created_at")
+    session_runs = relationship("SessionRun", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        # Keyset-пагинация списка пользователей (app/db/pagination.py)
+        Index("idx_users_created_id", "created_at", "id"),
+    )
 
 
 class Session(Base):
@@ -32,8 +40,14 @@ class Session(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user = relationship("User", back_populates="sessions")
-    workout_days = relationship("WorkoutDay", back_populates="session", cascade="all, delete-orphan")
-    session_runs = relationship("SessionRun", back_populates="session", cascade="all, delete-orphan")
+    workout_days = relationship("WorkoutDay", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+    session_runs = relationship("SessionRun", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+    
+    __table_args__ = (
+        # Keyset-пагинация списка программ (app/db/pagination.py)
+        Index("idx_sessions_created_id", "created_at", "session_id"),
+        Index("idx_sessions_user_created_id", "user_id", "created_at", "session_id"),
+    )
 
 
 class WorkoutDay(Base):
@@ -46,13 +60,21 @@ class WorkoutDay(Base):
     name = Column(String, nullable=False)
     
     session = relationship("Session", back_populates="workout_days")
-    exercises = relationship("Exercise", back_populates="workout_day", cascade="all, delete-orphan", order_by="Exercise.order")
+    exercises = relationship("Exercise", back_populates="workout_day", cascade="all, delete-orphan", passive_deletes=True, order_by="Exercise.order")
     
     __table_args__ = (
         Index("idx_session_day", "session_id", "day_index"),
     )
 
 
+class ExerciseKey(Base):
+    """Каталог упражнений: нормализованное название (см. parser.normalize_exercise_name)."""
+    __tablename__ = "exercise_keys"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    key = Column(String, nullable=False, unique=True)
+
+
 class Exercise(Base):
     """Модель упражнения."""
     __tablename__ = "exercises"
@@ -61,10 +83,13 @@ class Exercise(Base):
     workout_day_id = Column(Integer, ForeignKey("workout_days.id", ondelete="CASCADE"), nullable=False)
     name = Column(String, nullable=False)
     order = Column(Integer, nullable=False)
+    # Ссылка на каталог: по ней сопоставляется история одного упражнения в разных программах
+    exercise_key_id = Column(Integer, ForeignKey("exercise_keys.id"), nullable=True, index=True)
     
     workout_day = relationship("WorkoutDay", back_populates="exercises")
-    sets = relationship("Set", back_populates="exercise", cascade="all, delete-orphan", order_by="Set.set_index")
-    performed_sets = relationship("PerformedSet", back_populates="exercise", cascade="all, delete-orphan")
+    sets = relationship("Set", back_populates="exercise", cascade="all, delete-orphan", passive_deletes=True, order_by="Set.set_index")
+    performed_sets = relationship("PerformedSet", back_populates="exercise", cascade="all, delete-orphan", passive_deletes=True)
+    rollups = relationship("PerformedSetRollup", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Set(Base):
@@ -95,7 +120,8 @@ class SessionRun(Base):
     
     user = relationship("User", back_populates="session_runs")
     session = relationship("Session", back_populates="session_runs")
-    performed_sets = relationship("PerformedSet", back_populates="session_run", cascade="all, delete-orphan")
+    performed_sets = relationship("PerformedSet", back_populates="session_run", cascade="all, delete-orphan", passive_deletes=True)
+    rollups = relationship("PerformedSetRollup", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class PerformedSet(Base):
@@ -103,16 +129,82 @@ class PerformedSet(Base):
     __tablename__ = "performed_sets"
     
     id = Column(Integer, primary_key=True, index=True)
+    # Денормализовано из session_runs.user_id, чтобы запросы истории не делали JOIN
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=True)
     exercise_id = Column(Integer, ForeignKey("exercises.exercise_id", ondelete="CASCADE"), nullable=False)
     set_index = Column(Integer, nullable=False)
     weight = Column(Float, nullable=False)
     timestamp = Column(DateTime, default=datetime.utcnow)
     session_run_id = Column(Integer, ForeignKey("session_runs.id", ondelete="CASCADE"), nullable=False)
+    # Ключ идемпотентности: сообщение Telegram, из которого записан подход ("tg:<chat_id>:<message_id>")
+    idempotency_key = Column(String, nullable=True)
     
     exercise = relationship("Exercise", back_populates="performed_sets")
     session_run = relationship("SessionRun", back_populates="performed_sets")
     
     __table_args__ = (
         Index("idx_exercise_set_run", "exercise_id", "set_index", "session_run_id"),
+        # Покрывающий индекс для поиска последнего веса: фильтр по пользователю,
+        # упражнению и подходу, сортировка по времени, вес читается из индекса
+        Index(
+            "idx_performed_user_exercise_set_ts",
+            "user_id", "exercise_id", "set_index", desc("timestamp"), "weight"
+        ),
+        # Повторная доставка update не создаёт дубль. timestamp входит в ключ, потому что
+        # уникальный индекс секционированной таблицы обязан содержать ключ секционирования;
+        # для подходов с ключом timestamp берётся из даты сообщения и при повторе совпадает
+        Index("uq_performed_sets_idempotency", "idempotency_key", "timestamp", unique=True),
     )
 
+
+
+class LatestWeight(Base):
+    """Последний вес пользователя для упражнения из каталога и номера подхода.
+    
+    Обновляется в одной транзакции с записью performed_sets (crud.create_performed_set),
+    пересобирается командой: python -m app.db.maintenance rebuild-latest-weights
+    """
+    __tablename__ = "latest_weights"
+    
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    exercise_key_id = Column(Integer, ForeignKey("exercise_keys.id"), primary_key=True)
+    set_index = Column(Integer, primary_key=True)
+    weight = Column(Float, nullable=False)
+    timestamp = Column(DateTime, nullable=False)
+    session_run_id = Column(Integer, ForeignKey("session_runs.id", ondelete="SET NULL"), nullable=True)
+
+
+class PerformedSetRollup(Base):
+    """Сжатая история: подходы одного упражнения в одном запуске тренировки.
+    
+    Создаётся фоновым сжатием (crud.compact_performed_sets) из performed_sets
+    старше ROLLUP_HORIZON_DAYS; исходные строки после этого удаляются.
+    """
+    __tablename__ = "performed_set_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    session_run_id = Column(Integer, ForeignKey("session_runs.id", ondelete="CASCADE"), nullable=False)
+    exercise_id = Column(Integer, ForeignKey("exercises.exercise_id", ondelete="CASCADE"), nullable=False)
+    timestamp = Column(DateTime, nullable=False)  # время первого подхода
+    set_count = Column(Integer, nullable=False)
+    max_weight = Column(Float, nullable=False)
+    top_set_weight = Column(Float, nullable=False)  # вес подхода с наибольшим weight * reps
+    volume = Column(Float, nullable=False)  # сумма weight * reps
+    sets = Column(JSON, nullable=False)  # [[set_index, weight], ...] в порядке выполнения
+    
+    __table_args__ = (
+        UniqueConstraint("session_run_id", "exercise_id", name="uq_rollup_run_exercise"),
+        Index("idx_rollup_user_exercise_ts", "user_id", "exercise_id", "timestamp"),
+    )
+
+
+class FsmState(Base):
+    """Состояние FSM aiogram для одного чата (app/db/fsm_storage.py)."""
+    __tablename__ = "fsm_states"
+    
+    key = Column(String, primary_key=True)  # ключ DefaultKeyBuilder: fsm:<bot>:<chat>:<user>:<destiny>
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # компактный JSON, NULL для пустых данных
+    version = Column(Integer, nullable=False, default=1)  # растёт при каждой записи, по нему сверяется кэш
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
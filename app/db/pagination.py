@@ -0,0 +1,132 @@
+"""
+Keyset-пагинация по (created_at, id).
+
+Курсор — компактная строка "<микросекунды от эпохи в hex>.<id в hex>": она
+помещается в callback_data Telegram (до 64 байт) и в query-параметры API.
+Страница запрашивается условием по индексу (created_at, id) вместо OFFSET,
+поэтому время запроса не зависит от номера страницы. Строки с пустым
+created_at в страницы не попадают (у них нет позиции для курсора); у старых
+строк он заполняется миграцией 11.
+"""
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class Page(NamedTuple):
+    """Страница результатов и курсоры соседних страниц (None, если страницы нет)."""
+    items: List
+    next_cursor: Optional[str]
+    prev_cursor: Optional[str]
+
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """Закодировать позицию записи в курсор."""
+    micros = (created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros:x}.{item_id:x}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Раскодировать курсор.
+
+    Raises:
+        ValueError: Если курсор некорректен
+    """
+    try:
+        micros, item_id = cursor.split(".")
+        return EPOCH + timedelta(microseconds=int(micros, 16)), int(item_id, 16)
+    except (ValueError, OverflowError):
+        raise ValueError(f"Некорректный курсор: {cursor!r}")
+
+
+def _after(created_col, id_col, cursor: str):
+    """Условие «строго после курсора» в порядке (created_at, id) по возрастанию."""
+    created_at, item_id = decode_cursor(cursor)
+    # created_at >= X задаёт диапазон по индексу, остальное — фильтр внутри него
+    return and_(
+        created_col >= created_at,
+        or_(created_col > created_at, id_col > item_id)
+    )
+
+
+def _before(created_col, id_col, cursor: str):
+    """Условие «строго до курсора» в порядке (created_at, id) по возрастанию."""
+    created_at, item_id = decode_cursor(cursor)
+    return and_(
+        created_col <= created_at,
+        or_(created_col < created_at, id_col < item_id)
+    )
+
+
+async def paginate(
+    session: AsyncSession,
+    query,
+    created_col,
+    id_col,
+    limit: Optional[int],
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    descending: bool = False
+) -> Page:
+    """
+    Выполнить запрос постранично.
+
+    Args:
+        session: Сессия базы данных
+        query: SELECT одной ORM-сущности (фильтры уже применены, без ORDER BY)
+        created_col: Колонка created_at
+        id_col: Колонка первичного ключа
+        limit: Размер страницы (None — все записи после курсора)
+        after: Курсор: страница после него (next_cursor предыдущего ответа)
+        before: Курсор: страница перед ним (prev_cursor предыдущего ответа)
+        descending: Порядок от новых к старым
+
+    Returns:
+        Page: Записи страницы в порядке сортировки и курсоры соседних страниц
+    """
+    backward = before is not None
+    cursor = before if backward else after
+    # Направление чтения из индекса: по возрастанию или по убыванию ключа
+    ascending = descending == backward
+
+    # NULL сортируется по-разному в SQLite и PostgreSQL и не кодируется в курсор
+    query = query.where(created_col.is_not(None))
+    if cursor:
+        if ascending:
+            query = query.where(_after(created_col, id_col, cursor))
+        else:
+            query = query.where(_before(created_col, id_col, cursor))
+
+    if ascending:
+        query = query.order_by(created_col.asc(), id_col.asc())
+    else:
+        query = query.order_by(created_col.desc(), id_col.desc())
+
+    # Лишняя строка показывает, есть ли ещё страница в направлении чтения
+    if limit is not None:
+        query = query.limit(limit + 1)
+    result = await session.execute(query)
+    items = list(result.scalars().all())
+    has_more = limit is not None and len(items) > limit
+    items = items[:limit]
+    if backward:
+        items.reverse()
+
+    if not items:
+        return Page(items=[], next_cursor=None, prev_cursor=None)
+
+    def cursor_of(item) -> str:
+        return encode_cursor(getattr(item, created_col.key), getattr(item, id_col.key))
+
+    if backward:
+        prev_cursor = cursor_of(items[0]) if has_more else None
+        next_cursor = cursor_of(items[-1])
+    else:
+        next_cursor = cursor_of(items[-1]) if has_more else None
+        prev_cursor = cursor_of(items[0]) if cursor else None
+    return Page(items=items, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,212 @@
+"""
+Помесячное секционирование performed_sets (только PostgreSQL).
+
+performed_sets — единственная таблица, которая растёт без ограничений. При
+PERFORMED_SETS_PARTITIONING=true она хранится как RANGE-секционированная по
+timestamp таблица: одна секция на календарный месяц плюс секция DEFAULT для
+строк вне созданных месяцев. Старые месяцы можно обслуживать (VACUUM, архив,
+DETACH PARTITION) независимо от текущих.
+
+- Перевод существующей таблицы: python -m app.db.maintenance partition-performed-sets
+- Секции на текущий и PARTITION_MONTHS_AHEAD следующих месяцев создаются при
+  старте (init_db), затем раз в PARTITION_CHECK_INTERVAL_HOURS в фоне процесса
+  и командой: python -m app.db.maintenance create-partitions
+"""
+import logging
+from datetime import date, datetime
+from typing import List
+
+from sqlalchemy import text
+
+from app import config
+
+logger = logging.getLogger(__name__)
+
+TABLE = "performed_sets"
+DEFAULT_PARTITION = "performed_sets_default"
+LEGACY_TABLE = "performed_sets_unpartitioned"
+
+# Индексы создаются на родительской таблице и наследуются секциями
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS ix_performed_sets_id ON performed_sets (id)",
+    "CREATE INDEX IF NOT EXISTS idx_exercise_set_run ON performed_sets (exercise_id, set_index, session_run_id)",
+    "CREATE INDEX IF NOT EXISTS idx_performed_user_exercise_set_ts "
+    "ON performed_sets (user_id, exercise_id, set_index, timestamp DESC, weight)",
+    "CREATE UNIQUE INDEX IF NOT EXISTS uq_performed_sets_idempotency "
+    "ON performed_sets (idempotency_key, timestamp)",
+]
+
+
+def month_start(value: date) -> date:
+    """Первое число месяца."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(value: date, months: int) -> date:
+    """Первое число месяца через months месяцев."""
+    index = value.year * 12 + value.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    """Имя секции месяца, например performed_sets_y2024m01."""
+    return f"{TABLE}_y{month.year:04d}m{month.month:02d}"
+
+
+def months_between(first: date, last: date) -> List[date]:
+    """Первые числа месяцев от first до last включительно."""
+    months = []
+    current = month_start(first)
+    while current <= last:
+        months.append(current)
+        current = add_months(current, 1)
+    return months
+
+
+async def is_partitioned(conn) -> bool:
+    """Является ли performed_sets секционированной таблицей."""
+    result = await conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:table)"
+    ), {"table": TABLE})
+    return result.first() is not None
+
+
+async def _create_month_partition(conn, month: date):
+    """
+    Создать секцию месяца, если её нет.
+
+    Если строки этого месяца уже попали в DEFAULT, PostgreSQL не даст создать
+    секцию: DEFAULT отсоединяется, строки переносятся в новую секцию и DEFAULT
+    подключается обратно (всё в одной транзакции).
+    """
+    name = partition_name(month)
+    exists = await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+    if exists:
+        return
+
+    end = add_months(month, 1)
+    bounds = {
+        "start": datetime(month.year, month.month, 1),
+        "end": datetime(end.year, end.month, 1),
+    }
+    has_default = await conn.scalar(
+        text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION}
+    )
+    stray_rows = has_default and await conn.scalar(text(
+        f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} "
+        f"WHERE timestamp >= :start AND timestamp < :end)"
+    ), bounds)
+
+    if stray_rows:
+        await conn.execute(text(f"ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}"))
+
+    await conn.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {TABLE} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{end.isoformat()}')"
+    ))
+
+    if stray_rows:
+        result = await conn.execute(text(
+            f"WITH moved AS ("
+            f"DELETE FROM {DEFAULT_PARTITION} WHERE timestamp >= :start AND timestamp < :end "
+            f"RETURNING *) INSERT INTO {TABLE} SELECT * FROM moved"
+        ), bounds)
+        await conn.execute(text(f"ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT"))
+        logger.info(f"Секция {name}: перенесено {result.rowcount} строк из {DEFAULT_PARTITION}")
+    else:
+        logger.info(f"✅ Создана секция {name}")
+
+
+async def ensure_partitions(conn, months_ahead: int = None) -> int:
+    """
+    Создать секции на текущий и months_ahead следующих месяцев.
+
+    Returns:
+        int: Количество месяцев, для которых проверены секции (0, если таблица не секционирована)
+    """
+    if months_ahead is None:
+        months_ahead = config.PARTITION_MONTHS_AHEAD
+    if not await is_partitioned(conn):
+        return 0
+    # Бот и API проверяют секции одновременно: создаёт их один из процессов
+    await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:table))"), {"table": TABLE})
+
+    current = month_start(datetime.utcnow().date())
+    months = months_between(current, add_months(current, months_ahead))
+    for month in months:
+        await _create_month_partition(conn, month)
+    await conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+    return len(months)
+
+
+async def partition_performed_sets(conn) -> int:
+    """
+    Перевести performed_sets в секционированную таблицу (одна транзакция).
+
+    Старая таблица переименовывается, создаётся секционированная с PRIMARY KEY
+    (id, timestamp) и той же последовательностью id, секции создаются для всех
+    месяцев с данными, строки копируются, старая таблица удаляется.
+
+    Returns:
+        int: Количество перенесённых строк (0, если таблица уже секционирована)
+    """
+    if await is_partitioned(conn):
+        logger.info("performed_sets уже секционирована")
+        return 0
+
+    # Освобождаем имена таблицы, первичного ключа и индексов для новой таблицы
+    await conn.execute(text(f"ALTER TABLE {TABLE} RENAME TO {LEGACY_TABLE}"))
+    await conn.execute(text(
+        f"ALTER TABLE {LEGACY_TABLE} RENAME CONSTRAINT performed_sets_pkey TO {LEGACY_TABLE}_pkey"
+    ))
+    await conn.execute(text(
+        "DROP INDEX IF EXISTS ix_performed_sets_id, idx_exercise_set_run, idx_performed_user_exercise_set_ts, "
+        "uq_performed_sets_idempotency"
+    ))
+    await conn.execute(text("ALTER SEQUENCE performed_sets_id_seq OWNED BY NONE"))
+    await conn.execute(text(f"ALTER TABLE {LEGACY_TABLE} ALTER COLUMN id DROP DEFAULT"))
+
+    # Ключ секционирования обязан входить в первичный ключ
+    await conn.execute(text(f"""
+        CREATE TABLE {TABLE} (
+            id INTEGER NOT NULL DEFAULT nextval('performed_sets_id_seq'),
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            exercise_id INTEGER NOT NULL REFERENCES exercises(exercise_id) ON DELETE CASCADE,
+            set_index INTEGER NOT NULL,
+            weight FLOAT NOT NULL,
+            timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            session_run_id INTEGER NOT NULL REFERENCES session_runs(id) ON DELETE CASCADE,
+            idempotency_key VARCHAR,
+            PRIMARY KEY (id, timestamp)
+        ) PARTITION BY RANGE (timestamp)
+    """))
+    await conn.execute(text("ALTER SEQUENCE performed_sets_id_seq OWNED BY performed_sets.id"))
+
+    # Старые строки без timestamp получают время начала тренировки
+    await conn.execute(text(f"""
+        UPDATE {LEGACY_TABLE} AS ps
+        SET timestamp = COALESCE(sr.started_at, now() AT TIME ZONE 'utc')
+        FROM session_runs AS sr
+        WHERE ps.timestamp IS NULL AND sr.id = ps.session_run_id
+    """))
+
+    first = await conn.scalar(text(f"SELECT MIN(timestamp) FROM {LEGACY_TABLE}"))
+    current = month_start(datetime.utcnow().date())
+    first_month = month_start(first.date()) if first else current
+    for month in months_between(first_month, add_months(current, config.PARTITION_MONTHS_AHEAD)):
+        await _create_month_partition(conn, month)
+    await conn.execute(text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT"))
+
+    result = await conn.execute(text(f"""
+        INSERT INTO {TABLE} (id, user_id, exercise_id, set_index, weight, timestamp, session_run_id, idempotency_key)
+        SELECT id, user_id, exercise_id, set_index, weight, timestamp, session_run_id, idempotency_key
+        FROM {LEGACY_TABLE}
+        WHERE timestamp IS NOT NULL
+    """))
+    for statement in INDEXES:
+        await conn.execute(text(statement))
+    await conn.execute(text(f"DROP TABLE {LEGACY_TABLE}"))
+    await conn.execute(text(f"ANALYZE {TABLE}"))
+
+    logger.info(f"✅ performed_sets секционирована: перенесено {result.rowcount} строк")
+    return result.rowcount
@@ -0,0 +1,172 @@
+"""
+Журнал медленных SQL-запросов.
+
+Запрос дольше SLOW_QUERY_THRESHOLD_MS записывается в SLOW_QUERY_LOG_FILE
+(ротация по размеру): текст, параметры без значений, хендлер или маршрут из
+app/db/instrumentation.py и план выполнения.
+
+Хук after_cursor_execute только ставит запрос в очередь: план снимает фоновая
+задача на отдельном engine без пула (NullPool, без хуков учёта), поэтому
+EXPLAIN не занимает соединение из пула приложения и не задерживает хендлер.
+На PostgreSQL снимается EXPLAIN без выполнения запроса. EXPLAIN ANALYZE
+(SLOW_QUERY_EXPLAIN_ANALYZE=true) выполняет SELECT повторно и удваивает
+нагрузку как раз тогда, когда база медленная; для изменяющих запросов он не
+используется никогда: их повторное выполнение ждало бы блокировок исходной
+транзакции. На SQLite — EXPLAIN QUERY PLAN.
+Если очередь переполнена, запрос записывается без плана.
+"""
+import asyncio
+import logging
+import os
+from logging.handlers import RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.engine import URL
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import NullPool
+
+from app.config import (
+    SLOW_QUERY_EXPLAIN_ANALYZE, SLOW_QUERY_LOG_BACKUP_COUNT, SLOW_QUERY_LOG_FILE, SLOW_QUERY_LOG_MAX_BYTES
+)
+
+logger = logging.getLogger(__name__)
+
+# Отдельный логгер пишет только в файл журнала
+slow_query_logger = logging.getLogger("app.db.slow_queries")
+slow_query_logger.propagate = False
+slow_query_logger.setLevel(logging.INFO)
+
+# Медленных запросов, ожидающих EXPLAIN; сверх этого записываются без плана
+QUEUE_SIZE = 100
+
+_queue: Optional[asyncio.Queue] = None
+_worker: Optional[asyncio.Task] = None
+# URL базы -> engine для EXPLAIN
+_explain_engines: Dict[str, AsyncEngine] = {}
+
+
+def _ensure_file_handler():
+    if slow_query_logger.handlers:
+        return
+    directory = os.path.dirname(SLOW_QUERY_LOG_FILE)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    handler = RotatingFileHandler(
+        SLOW_QUERY_LOG_FILE,
+        maxBytes=SLOW_QUERY_LOG_MAX_BYTES,
+        backupCount=SLOW_QUERY_LOG_BACKUP_COUNT,
+        encoding="utf-8",
+    )
+    handler.setFormatter(logging.Formatter("%(asctime)s %(message)s"))
+    slow_query_logger.addHandler(handler)
+
+
+def redact(value: Any) -> Any:
+    """Заменить значение параметра его типом (в параметрах — telegram_id, имена и т.п.)."""
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, dict):
+        return {key: redact(item) for key, item in value.items()}
+    if isinstance(value, (str, bytes)):
+        return f"<{type(value).__name__}:{len(value)}>"
+    return f"<{type(value).__name__}>"
+
+
+def _explain_engine(url: URL) -> AsyncEngine:
+    key = url.render_as_string(hide_password=False)
+    explain_engine = _explain_engines.get(key)
+    if explain_engine is None:
+        explain_engine = _explain_engines[key] = create_async_engine(url, poolclass=NullPool)
+    return explain_engine
+
+
+async def _explain(url: URL, dialect: str, statement: str, parameters) -> List[str]:
+    """План запроса на отдельном соединении (транзакция откатывается)."""
+    if dialect == "postgresql":
+        is_select = statement.lstrip().upper().startswith("SELECT") and "FOR UPDATE" not in statement.upper()
+        prefix = "EXPLAIN (ANALYZE, BUFFERS) " if SLOW_QUERY_EXPLAIN_ANALYZE and is_select else "EXPLAIN "
+    else:
+        prefix = "EXPLAIN QUERY PLAN "
+
+    async with _explain_engine(url).connect() as explain_conn:
+        rows = (await explain_conn.exec_driver_sql(prefix + statement, parameters)).fetchall()
+    return [" | ".join(str(column) for column in row) for row in rows]
+
+
+def _write(statement: str, parameters, duration_ms: float, scope: Optional[str], plan: List[str]):
+    _ensure_file_handler()
+    slow_query_logger.info(
+        f"{duration_ms:.1f} мс, {scope or 'вне хендлера'}\n"
+        f"{statement}\n"
+        f"параметры: {redact(parameters)}\n"
+        + "\n".join(plan) + "\n"
+    )
+    logger.warning(f"Медленный запрос {duration_ms:.1f} мс в {scope or 'вне хендлера'}, см. {SLOW_QUERY_LOG_FILE}")
+
+
+async def _explain_loop(queue: asyncio.Queue):
+    """Фоновая задача: снять план и записать запрос в журнал."""
+    while True:
+        url, dialect, statement, parameters, duration_ms, scope = await queue.get()
+        try:
+            try:
+                plan = await _explain(url, dialect, statement, parameters)
+            except Exception as e:
+                plan = [f"(не удалось получить план: {e})"]
+            _write(statement, parameters, duration_ms, scope, plan)
+        except Exception as e:
+            logger.error(f"❌ Ошибка записи журнала медленных запросов: {e}", exc_info=True)
+        finally:
+            queue.task_done()
+
+
+def _get_queue() -> Optional[asyncio.Queue]:
+    """Очередь фоновой задачи текущего event loop (None вне event loop)."""
+    global _queue, _worker
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    if _worker is None or _worker.done() or _worker.get_loop() is not loop:
+        _queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        _worker = loop.create_task(_explain_loop(_queue))
+    return _queue
+
+
+def record(conn, statement: str, parameters, executemany: bool, duration_ms: float, scope: Optional[str]):
+    """Поставить медленный запрос в очередь журнала (ошибки только логируются)."""
+    try:
+        queue = None if executemany else _get_queue()
+        if queue is not None:
+            try:
+                queue.put_nowait((conn.engine.url, conn.dialect.name, statement, parameters, duration_ms, scope))
+                return
+            except asyncio.QueueFull:
+                plan = ["(очередь EXPLAIN переполнена: план не снят)"]
+        elif executemany:
+            plan = ["(executemany: план не снимается)"]
+        else:
+            plan = ["(вне event loop: план не снимается)"]
+        _write(statement, parameters, duration_ms, scope, plan)
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи журнала медленных запросов: {e}", exc_info=True)
+
+
+async def flush():
+    """Дождаться записи запросов из очереди."""
+    if _queue is not None and _worker is not None and not _worker.done():
+        await _queue.join()
+
+
+async def stop():
+    """Записать очередь, остановить фоновую задачу и закрыть engine для EXPLAIN."""
+    global _queue, _worker
+    await flush()
+    if _worker is not None:
+        _worker.cancel()
+    _queue = _worker = None
+    for explain_engine in _explain_engines.values():
+        await explain_engine.dispose()
+    _explain_engines.clear()
@@ -5,7 +5,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.config import MAX_PROGRAMS_PER_USER
+from app.config import MAX_PROGRAMS_PER_USER, PROGRAMS_PAGE_SIZE
 from app.db import crud
 from app.services.parser import parse_exercise_string, format_exercise_name
 from app.utils.keyboards import (
@@ -112,10 +112,10 @@ async def handle_add_program_existing(callback: CallbackQuery, state: FSMContext
         await callback.answer()
         return
     
-    # Получаем все существующие программы (исключая программы пользователя)
-    all_programs = await crud.get_all_sessions(session, exclude_user_id=user.id)
+    # Первая страница существующих программ (исключая программы пользователя)
+    page = await crud.get_all_sessions(session, exclude_user_id=user.id, limit=PROGRAMS_PAGE_SIZE)
     
-    if not all_programs:
+    if not page.items:
         await callback.message.edit_text(
             "К сожалению, пока нет доступных программ для выбора.\n"
             "Вы можете создать новую программу."
@@ -126,7 +126,42 @@ async def handle_add_program_existing(callback: CallbackQuery, state: FSMContext
     await callback.message.edit_text(
         "Выберите программу, которую хотите добавить:\n\n"
         "⚠️ Обратите внимание: программа будет скопирована без сохранённых рабочих весов.",
-        reply_markup=get_programs_keyboard(all_programs, prefix="select_existing")
+        reply_markup=get_programs_keyboard(
+            page.items, prefix="select_existing",
+            next_cursor=page.next_cursor, prev_cursor=page.prev_cursor
+        )
+    )
+    await callback.answer()
+
+
+@router.callback_query(F.data.startswith("select_existing_page_"))
+async def handle_existing_programs_page(callback: CallbackQuery, session: AsyncSession):
+    """Переключение страницы списка существующих программ."""
+    # select_existing_page_after_<курсор> / select_existing_page_before_<курсор>
+    direction, cursor = callback.data[len("select_existing_page_"):].split("_", 1)
+    username = callback.from_user.username
+    user = await crud.get_or_create_user(session, callback.from_user.id, username=username)
+    
+    try:
+        page = await crud.get_all_sessions(
+            session,
+            exclude_user_id=user.id,
+            limit=PROGRAMS_PAGE_SIZE,
+            after=cursor if direction == "after" else None,
+            before=cursor if direction == "before" else None
+        )
+    except ValueError:
+        page = None
+    
+    if not page or not page.items:
+        await callback.answer("Список программ изменился, откройте его заново", show_alert=True)
+        return
+    
+    await callback.message.edit_reply_markup(
+        reply_markup=get_programs_keyboard(
+            page.items, prefix="select_existing",
+            next_cursor=page.next_cursor, prev_cursor=page.prev_cursor
+        )
     )
     await callback.answer()
 
@@ -491,25 +526,22 @@ async def process_program_name(message: Message, state: FSMContext, session: Asy
     username = message.from_user.username
     user = await crud.get_or_create_user(session, message.from_user.id, username=username)
     
-    # Создаём программу
-    session_obj = await crud.create_session(session, user.id, program_name)
-    
-    # Создаём дни и упражнения
-    for day_index, day_data in enumerate(program_data["days"]):
-        workout_day = await crud.create_workout_day(
-            session, session_obj.session_id, day_index, day_data["name"]
-        )
-        
-        for exercise_order, exercise_data in enumerate(day_data["exercises"]):
-            # Сохраняем исходный формат в name, если он есть, иначе используем formatted_name
-            exercise_name_to_save = exercise_data.get("original_format", exercise_data["name"])
-            exercise = await crud.create_exercise(
-                session, workout_day.id, exercise_name_to_save, exercise_order
-            )
-            
-            # Создаём подходы
-            for set_index, reps in enumerate(exercise_data["reps"], start=1):
-                await crud.create_set(session, exercise.exercise_id, set_index, reps)
+    # Создаём программу со всеми днями, упражнениями и подходами одной транзакцией
+    days = [
+        {
+            "name": day_data["name"],
+            "exercises": [
+                {
+                    # Сохраняем исходный формат в name, если он есть, иначе используем formatted_name
+                    "name": exercise_data.get("original_format", exercise_data["name"]),
+                    "reps": exercise_data["reps"]
+                }
+                for exercise_data in day_data["exercises"]
+            ]
+        }
+        for day_data in program_data["days"]
+    ]
+    await crud.create_program_tree(session, user.id, program_name, days)
     
     await state.clear()
     
@@ -230,16 +230,11 @@ async def save_ai_program(callback: CallbackQuery, state: FSMContext, session: A
         username = callback.from_user.username
         user = await crud.get_or_create_user(session, callback.from_user.id, username=username)
         
-        # Создаём программу
-        session_obj = await crud.create_session(session, user.id, program_data["name"])
-        
-        # Создаём дни и упражнения
-        for day_index, day_data in enumerate(program_data["days"]):
-            workout_day = await crud.create_workout_day(
-                session, session_obj.session_id, day_index, day_data["name"]
-            )
-            
-            for exercise_order, exercise_text in enumerate(day_data["exercises"]):
+        # Собираем дни и упражнения
+        days = []
+        for day_data in program_data["days"]:
+            exercises = []
+            for exercise_text in day_data["exercises"]:
                 # Парсим упражнение
                 exercise_name, reps_list = parse_exercise_string(exercise_text)
                 
@@ -247,16 +242,11 @@ async def save_ai_program(callback: CallbackQuery, state: FSMContext, session: A
                     continue  # Пропускаем некорректные упражнения
                 
                 # Сохраняем исходный формат
-                exercise_name_to_save = exercise_text
-                
-                # Создаём упражнение
-                exercise = await crud.create_exercise(
-                    session, workout_day.id, exercise_name_to_save, exercise_order
-                )
-                
-                # Создаём подходы
-                for set_index, reps in enumerate(reps_list, start=1):
-                    await crud.create_set(session, exercise.exercise_id, set_index, reps)
+                exercises.append({"name": exercise_text, "reps": reps_list})
+            days.append({"name": day_data["name"], "exercises": exercises})
+        
+        # Создаём программу целиком одной транзакцией
+        await crud.create_program_tree(session, user.id, program_data["name"], days)
         
         await state.clear()
         
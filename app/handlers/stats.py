@@ -26,15 +26,14 @@ class StatsStates(StatesGroup):
     selecting_exercise = State()
 
 
-@router.message(F.text == "Посмотреть статистику")
+@router.message(F.text == "Посмотреть статистику", flags={crud.READ_ONLY: True})
 async def cmd_view_stats(message: Message, state: FSMContext, session: AsyncSession):
     """Начало просмотра статистики."""
     # Очищаем предыдущее состояние и данные, чтобы не было конфликтов
     await state.clear()
     
-    username = message.from_user.username
-    user = await crud.get_or_create_user(session, message.from_user.id, username=username)
-    programs = await crud.get_user_sessions(session, user.id)
+    user = await crud.get_user_by_telegram_id(session, message.from_user.id)
+    programs = await crud.get_user_sessions(session, user.id) if user else []
     
     if not programs:
         await message.answer(
@@ -59,7 +58,7 @@ async def cmd_view_stats(message: Message, state: FSMContext, session: AsyncSess
         )
 
 
-@router.callback_query(F.data.startswith("stats_program_"))
+@router.callback_query(F.data.startswith("stats_program_"), flags={crud.READ_ONLY: True})
 async def select_program_for_stats(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка выбора программы для статистики."""
     program_id = int(callback.data.split("_")[-1])
@@ -97,7 +96,7 @@ async def show_workout_days(message: Message, state: FSMContext, session: AsyncS
     )
 
 
-@router.callback_query(F.data.startswith("stats_day_"))
+@router.callback_query(F.data.startswith("stats_day_"), flags={crud.READ_ONLY: True})
 async def select_day_for_stats(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка выбора дня для статистики."""
     # Проверяем, находимся ли мы в режиме статистики
@@ -151,7 +150,7 @@ async def show_exercises(message: Message, state: FSMContext, session: AsyncSess
     )
 
 
-@router.callback_query(F.data.startswith("stats_exercise_"))
+@router.callback_query(F.data.startswith("stats_exercise_"), flags={crud.READ_ONLY: True})
 async def show_exercise_stats(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Показать статистику по упражнению."""
     exercise_id = int(callback.data.split("_")[-1])
@@ -164,11 +163,10 @@ async def show_exercise_stats(callback: CallbackQuery, state: FSMContext, sessio
         return
     
     data = await state.get_data()
-    username = callback.from_user.username
-    user = await crud.get_or_create_user(session, callback.from_user.id, username=username)
+    user = await crud.get_user_by_telegram_id(session, callback.from_user.id)
     
     # Получаем статистику
-    stats = await crud.get_exercise_statistics(session, user.id, exercise_id)
+    stats = await crud.get_exercise_statistics(session, user.id, exercise_id) if user else {}
     
     # Формируем сообщение
     text = f"📊 <b>Упражнение: {exercise.name}</b>\n\n"
@@ -211,7 +209,7 @@ async def show_exercise_stats(callback: CallbackQuery, state: FSMContext, sessio
         )
 
 
-@router.callback_query(F.data.startswith("stats_back_"))
+@router.callback_query(F.data.startswith("stats_back_"), flags={crud.READ_ONLY: True})
 async def stats_back(callback: CallbackQuery, state: FSMContext, session: AsyncSession):
     """Обработка кнопки 'Назад' в статистике."""
     parts = callback.data.split("_")
@@ -1,11 +1,16 @@
 """Обработчики для проведения тренировки."""
+from datetime import timezone
+
 from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db import crud
+from app.config import PERFORMED_SETS_WRITE_BEHIND
+from app.db import crud, instrumentation
+from app.services import workout_state, write_behind
+from app.services.workout_state import WorkoutState
 from app.services.stats import get_comparison_stats
 from app.utils.keyboards import (
     get_main_keyboard, 
@@ -132,27 +137,15 @@ async def select_training_day(callback: CallbackQuery, state: FSMContext, sessio
         await callback.message.edit_text("День не найден.")
         return
     
-    # Получаем упражнения
-    exercises = await crud.get_exercises_by_day(session, day_id)
+    # Упражнения с подходами уже загружены вместе с днём
+    exercises = workout_day.exercises
     
     if not exercises:
         await callback.message.edit_text("В этом дне нет упражнений.")
         return
     
-    # Формируем список упражнений и подходов для тренировки
-    exercises_list = []
-    for exercise in exercises:
-        sets_list = []
-        for set_obj in sorted(exercise.sets, key=lambda x: x.set_index):
-            sets_list.append({
-                "set_index": set_obj.set_index,
-                "reps": set_obj.reps
-            })
-        exercises_list.append({
-            "exercise_id": exercise.exercise_id,
-            "name": exercise.name,
-            "sets": sets_list
-        })
+    # Структура дня хранится в кэше процесса, в FSM — только day_id
+    workout_state.remember_day(day_id, exercises)
     
     # Показываем информацию о дне
     day_info = format_workout_day_info(workout_day, exercises)
@@ -162,12 +155,7 @@ async def select_training_day(callback: CallbackQuery, state: FSMContext, sessio
     )
     
     # Сохраняем данные для тренировки
-    await state.update_data(
-        day_id=day_id,
-        exercises=exercises_list,
-        current_exercise_index=0,
-        current_set_index=0
-    )
+    await state.update_data(day_id=day_id)
 
 
 @router.callback_query(F.data == "start_training")
@@ -177,7 +165,8 @@ async def begin_training(callback: CallbackQuery, state: FSMContext, session: As
     
     data = await state.get_data()
     session_id = data.get("selected_session_id")
-    exercises = data.get("exercises", [])
+    day_id = data.get("day_id")
+    exercises = await workout_state.get_day(session, day_id) if day_id else ()
     
     if not exercises:
         await callback.message.edit_text("Ошибка: нет упражнений для тренировки.")
@@ -188,102 +177,49 @@ async def begin_training(callback: CallbackQuery, state: FSMContext, session: As
     user = await crud.get_or_create_user(session, callback.from_user.id, username=username)
     session_run = await crud.create_session_run(session, user.id, session_id)
     
-    await state.update_data(
-        current_session_run_id=session_run.id,
-        current_user_id=user.id,  # Сохраняем user_id для использования в поиске
-        current_exercise_index=0,
-        current_set_index=0
+    # Загружаем прошлые веса для всех подходов дня одним запросом,
+    # дальше подсказки берутся из памяти без обращений к БД
+    workout_state.remember_previous_sets(
+        session_run.id, await crud.get_previous_sets_for_day(session, user.id, day_id)
     )
     await state.set_state(TrainingStates.waiting_for_weight)
     
     # Начинаем с первого упражнения и первого подхода
-    # Обновляем data из состояния, чтобы получить актуальные значения
-    data = await state.get_data()
-    await ask_for_weight(callback.message, session, state, data)
+    workout = WorkoutState(run_id=session_run.id, day_id=day_id, user_id=user.id)
+    await ask_for_weight(callback.message, session, state, workout)
 
 
 async def ask_for_weight(
-    message: Message, session: AsyncSession, state: FSMContext, data: dict
+    message: Message, session: AsyncSession, state: FSMContext, workout: WorkoutState
 ):
-    """Запросить вес для текущего подхода."""
-    exercises = data.get("exercises", [])
-    current_exercise_index = data.get("current_exercise_index", 0)
-    current_set_index = data.get("current_set_index", 0)
-    
-    if current_exercise_index >= len(exercises):
-        # Тренировка завершена
-        await finish_training(message, session, state, data)
-        return
+    """Запросить вес для текущего подхода и сохранить позицию в FSM."""
+    exercises = await workout_state.get_day(session, workout.day_id)
     
-    exercise = exercises[current_exercise_index]
-    sets = exercise["sets"]
+    # Пропускаем упражнения без оставшихся подходов
+    while workout.exercise_index < len(exercises) and \
+            workout.set_index >= len(exercises[workout.exercise_index].sets):
+        workout = workout._replace(exercise_index=workout.exercise_index + 1, set_index=0)
     
-    if current_set_index >= len(sets):
-        # Переходим к следующему упражнению
-        await state.update_data(
-            current_exercise_index=current_exercise_index + 1,
-            current_set_index=0
-        )
-        data = await state.get_data()
-        await ask_for_weight(message, session, state, data)
+    if workout.exercise_index >= len(exercises):
+        # Тренировка завершена
+        await finish_training(message, session, state, workout)
         return
     
-    current_set = sets[current_set_index]
+    exercise = exercises[workout.exercise_index]
+    set_index, reps = exercise.sets[workout.set_index]
     
-    # Логируем для отладки
-    import logging
-    logger = logging.getLogger(__name__)
-    logger.info(f"Asking for weight: exercise_id={exercise['exercise_id']}, current_set_index={current_set_index}, set_index={current_set['set_index']}, reps={current_set['reps']}, total_sets={len(sets)}")
-    
-    # Получаем прошлый вес (если есть)
-    # Используем user_id из состояния (из SessionRun), чтобы избежать проблем с разными user_id
-    user_id = data.get("current_user_id")
-    if not user_id:
-        # Если user_id не сохранен в состоянии, получаем пользователя
-        username = message.from_user.username
-        user = await crud.get_or_create_user(session, message.from_user.id, username=username)
-        user_id = user.id
-        await state.update_data(current_user_id=user_id)
-    
-    logger.info(f"Searching for previous weight: user_id={user_id}, exercise_id={exercise['exercise_id']}, set_index={current_set['set_index']}, exercise_name='{exercise['name']}'")
-    
-    # Сначала пытаемся найти по exercise_id (для той же программы)
-    last_weight = await crud.get_last_weight_for_set(
-        session, user_id, exercise["exercise_id"], current_set["set_index"]
-    )
-    logger.info(f"Searching for last weight by exercise_id: found={last_weight is not None}, weight={last_weight}")
-    
-    # Если не нашли, ищем по названию упражнения (для других программ)
-    if not last_weight:
-        last_weight = await crud.get_last_weight_for_exercise_by_name(
-            session, user_id, exercise["name"], current_set["set_index"]
-        )
-        logger.info(f"Searching for last weight by name: found={last_weight is not None}, weight={last_weight}, exercise_name='{exercise['name']}'")
-    
-    # Получаем информацию о прошлой тренировке для контекста
-    last_performed_set = await crud.get_last_performed_set_for_exercise(
-        session, user_id, exercise["exercise_id"], current_set["set_index"]
-    )
-    logger.info(f"Searching for last performed set by exercise_id: found={last_performed_set is not None}")
-    
-    # Если не нашли по ID, ищем по названию
-    if not last_performed_set:
-        last_performed_set = await crud.get_last_performed_set_for_exercise_by_name(
-            session, user_id, exercise["name"], current_set["set_index"]
-        )
-        logger.info(f"Searching for last performed set by name: found={last_performed_set is not None}, exercise_name='{exercise['name']}'")
+    # Прошлый вес берём из снимка, загруженного в begin_training
+    previous_sets = await workout_state.get_previous_sets(session, workout)
+    last_weight, last_date = previous_sets.get((exercise.exercise_id, set_index), (None, None))
     
     # Формируем сообщение
-    text = f"💪 {exercise['name']}\n"
-    text += f"Подход {current_set['set_index']}: {current_set['reps']} раз\n\n"
+    text = f"💪 {exercise.name}\n"
+    text += f"Подход {set_index}: {reps} раз\n\n"
     
     if last_weight:
         text += f"📊 Прошлый вес: {last_weight} кг\n"
-        if last_performed_set and last_performed_set.timestamp:
-            from datetime import datetime
-            # Форматируем дату последней тренировки
-            date_str = last_performed_set.timestamp.strftime("%d.%m.%Y")
-            text += f"   (последняя тренировка: {date_str})\n"
+        if last_date:
+            text += f"   (последняя тренировка: {last_date:%d.%m.%Y})\n"
         text += "\n"
     else:
         text += "📊 Это первый раз для этого подхода\n\n"
@@ -291,11 +227,14 @@ async def ask_for_weight(
     text += "Введите вес для этого подхода (в кг):"
     
     bot_message = await message.answer(text)
-    # Сохраняем ID сообщения для последующего удаления
-    await state.update_data(last_bot_message_id=bot_message.message_id)
+    # Одна запись в FSM на подход: позиция и ID сообщения для последующего удаления
+    await state.set_data(workout._replace(last_bot_message_id=bot_message.message_id).to_data())
 
 
-@router.message(TrainingStates.waiting_for_weight)
+# Обычный подход — 2 запроса (подход и latest_weights); последний подход с итогами
+# тренировки и пустым кэшем дня после перезапуска — до 9. С FSM_STORAGE=database
+# добавляются чтение состояния (до 2) и запись данных, а в конце тренировки — очистка
+@router.message(TrainingStates.waiting_for_weight, flags={instrumentation.QUERY_BUDGET: 13})
 async def process_weight(message: Message, state: FSMContext, session: AsyncSession):
     """Обработка введённого веса."""
     try:
@@ -305,49 +244,75 @@ async def process_weight(message: Message, state: FSMContext, session: AsyncSess
             await message.answer("Вес не может быть отрицательным. Введите корректное значение:")
             return
         
-        data = await state.get_data()
-        exercises = data.get("exercises", [])
-        current_exercise_index = data.get("current_exercise_index", 0)
-        current_set_index = data.get("current_set_index", 0)
-        session_run_id = data.get("current_session_run_id")
+        workout = WorkoutState.from_data(await state.get_data())
+        if workout is None:
+            await message.answer("Тренировка не найдена. Начните её заново.", reply_markup=get_programs_menu_keyboard())
+            await state.clear()
+            return
         
-        if current_exercise_index >= len(exercises):
-            await finish_training(message, session, state, data)
+        exercises = await workout_state.get_day(session, workout.day_id)
+        if workout.exercise_index >= len(exercises) or \
+                workout.set_index >= len(exercises[workout.exercise_index].sets):
+            await ask_for_weight(message, session, state, workout)
             return
         
-        exercise = exercises[current_exercise_index]
-        current_set = exercise["sets"][current_set_index]
+        exercise = exercises[workout.exercise_index]
+        set_index, _ = exercise.sets[workout.set_index]
         
         # Логируем для отладки
         import logging
         logger = logging.getLogger(__name__)
-        logger.info(f"Saving performed set: exercise_id={exercise['exercise_id']}, set_index={current_set['set_index']}, weight={weight}, session_run_id={session_run_id}")
+        logger.info(f"Saving performed set: exercise_id={exercise.exercise_id}, set_index={set_index}, weight={weight}, session_run_id={workout.run_id}")
         
-        # Сохраняем выполненный подход
-        await crud.create_performed_set(
-            session,
-            exercise["exercise_id"],
-            current_set["set_index"],
-            weight,
-            session_run_id
-        )
+        # Сохраняем выполненный подход (в режиме write-behind — в журнал, в БД позже).
+        # Ключ и время берутся из сообщения: повторная доставка update не создаёт дубль.
+        # Журнал пишется вне транзакции update: если обработка упала после записи,
+        # повторная доставка на той же позиции считается принятой и продвигает тренировку
+        idempotency_key = f"tg:{message.chat.id}:{message.message_id}"
+        timestamp = message.date.astimezone(timezone.utc).replace(tzinfo=None)
+        if PERFORMED_SETS_WRITE_BEHIND:
+            created = await write_behind.append(
+                exercise.exercise_id,
+                set_index,
+                weight,
+                workout.run_id,
+                user_id=workout.user_id,
+                idempotency_key=idempotency_key,
+                timestamp=timestamp
+            )
+        else:
+            _, created = await crud.create_performed_set(
+                session,
+                exercise.exercise_id,
+                set_index,
+                weight,
+                workout.run_id,
+                user_id=workout.user_id,
+                idempotency_key=idempotency_key,
+                timestamp=timestamp
+            )
+        
+        if not created:
+            # Повторная доставка update: подход уже сохранён, позиция уже сдвинута
+            # и следующий запрос веса уже отправлен
+            logger.info(f"Duplicate performed set ignored: {idempotency_key}")
+            return
         
         logger.info(f"Performed set saved successfully")
         
         # Удаляем предыдущее сообщение бота и сообщение пользователя
-        last_bot_msg_id = data.get("last_bot_message_id")
         try:
-            if last_bot_msg_id:
-                await message.bot.delete_message(message.chat.id, last_bot_msg_id)
+            if workout.last_bot_message_id:
+                await message.bot.delete_message(message.chat.id, workout.last_bot_message_id)
             await message.delete()
         except Exception:
             pass  # Игнорируем ошибки удаления
         
         # Переходим к следующему подходу
-        current_set_index += 1
-        if current_set_index >= len(exercise["sets"]):
+        workout = workout._replace(set_index=workout.set_index + 1)
+        if workout.set_index >= len(exercise.sets):
             # Упражнение завершено - показываем сообщение
-            exercise_name = exercise["name"]
+            exercise_name = exercise.name
             # Извлекаем базовое название
             import re
             # Если это исходный формат (содержит " — числа"), извлекаем название до " —"
@@ -359,26 +324,29 @@ async def process_weight(message: Message, state: FSMContext, session: AsyncSess
                 base_name = re.sub(r'\s*—\s*\d+\s+подхода?', '', exercise_name).strip()
             await message.answer(f"✅ Упражнение «{base_name}» завершено")
             
+            if PERFORMED_SETS_WRITE_BEHIND:
+                write_behind.schedule_flush()
+            
             # Переходим к следующему упражнению
-            current_exercise_index += 1
-            current_set_index = 0
-        
-        await state.update_data(
-            current_exercise_index=current_exercise_index,
-            current_set_index=current_set_index
-        )
+            workout = workout._replace(exercise_index=workout.exercise_index + 1, set_index=0)
         
         # Запрашиваем вес для следующего подхода
-        data = await state.get_data()
-        await ask_for_weight(message, session, state, data)
+        await ask_for_weight(message, session, state, workout)
         
     except ValueError:
         await message.answer("Пожалуйста, введите число (например: 20 или 20.5):")
 
 
-async def finish_training(message: Message, session: AsyncSession, state: FSMContext, data: dict):
+async def finish_training(message: Message, session: AsyncSession, state: FSMContext, workout: WorkoutState):
     """Завершение тренировки и показ итогов."""
-    session_run_id = data.get("current_session_run_id")
+    session_run_id = workout.run_id
+    workout_state.forget_run(session_run_id)
+    
+    if PERFORMED_SETS_WRITE_BEHIND:
+        # Итоги читаются из БД: дописываем подходы из журнала и ждём подходы,
+        # принятые другими процессами
+        exercises = await workout_state.get_day(session, workout.day_id)
+        await write_behind.wait_for_run(session_run_id, sum(len(exercise.sets) for exercise in exercises))
     
     # Получаем все выполненные подходы
     performed_sets = await crud.get_performed_sets_by_run(session, session_run_id)
@@ -395,9 +363,12 @@ async def finish_training(message: Message, session: AsyncSession, state: FSMCon
         program_name = session_run.session.name
     
     # Получаем статистику сравнения
-    username = message.from_user.username
-    user = await crud.get_or_create_user(session, message.from_user.id, username=username)
-    stats = await get_comparison_stats(session, user.id, performed_sets)
+    user_id = workout.user_id
+    if not user_id:
+        username = message.from_user.username
+        user = await crud.get_or_create_user(session, message.from_user.id, username=username)
+        user_id = user.id
+    stats = await get_comparison_stats(session, user_id, session_run_id)
     
     # Показываем сообщение о завершении тренировки
     if program_name:
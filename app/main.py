@@ -1,7 +1,9 @@
 """Точка входа в приложение."""
 import asyncio
 import logging
-from app.bot import create_bot, setup_database
+from app.bot import create_bot, start_services, stop_services
+from app.config import BOT_MODE
+from app.webhook import run_webhook
 
 logger = logging.getLogger(__name__)
 
@@ -10,15 +12,23 @@ async def main():
     """Главная функция запуска бота."""
     logger.info("Запуск бота...")
     
-    # Инициализация базы данных
-    await setup_database()
+    # Инициализация базы данных и фоновых задач
+    await start_services()
     
     # Создание бота и диспетчера
     bot, dp = await create_bot()
     
     # Запуск бота
-    logger.info("Бот запущен и готов к работе")
-    await dp.start_polling(bot)
+    logger.info(f"Бот запущен и готов к работе (режим {BOT_MODE})")
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(bot, dp)
+        else:
+            # После работы в режиме webhook getUpdates недоступен, пока webhook не снят
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await stop_services()
 
 
 if __name__ == "__main__":
@@ -28,4 +38,3 @@ if __name__ == "__main__":
         logger.info("Бот остановлен пользователем")
     except Exception as e:
         logger.error(f"Ошибка при запуске бота: {e}", exc_info=True)
-
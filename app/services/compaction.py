@@ -0,0 +1,45 @@
+"""Фоновое сжатие старой истории подходов в performed_set_rollups."""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+
+from app.config import ROLLUP_HORIZON_DAYS, ROLLUP_INTERVAL_HOURS
+from app.db import crud
+from app.db.init_db import async_session_maker
+
+logger = logging.getLogger(__name__)
+
+
+async def compact_history(horizon_days: int = ROLLUP_HORIZON_DAYS) -> int:
+    """
+    Сжать подходы старше horizon_days для всех пользователей.
+
+    Подходы пользователя сжимаются порциями по ROLLUP_BATCH_SIZE групп, каждая
+    в своей транзакции, поэтому прерванный запуск можно просто повторить.
+
+    Returns:
+        int: Количество созданных rollup-строк
+    """
+    older_than = datetime.utcnow() - timedelta(days=horizon_days)
+    async with async_session_maker() as session:
+        user_ids = await crud.get_users_with_history_before(session, older_than)
+
+    total = 0
+    for user_id in user_ids:
+        async with async_session_maker() as session:
+            total += await crud.compact_user_performed_sets(session, user_id, older_than)
+    logger.info(
+        f"Сжатие истории: {total} групп (запуск, упражнение) у {len(user_ids)} пользователей, "
+        f"граница {older_than:%d.%m.%Y}"
+    )
+    return total
+
+
+async def compaction_loop():
+    """Периодически сжимать историю (раз в ROLLUP_INTERVAL_HOURS)."""
+    while True:
+        try:
+            await compact_history()
+        except Exception as e:
+            logger.error(f"❌ Ошибка при сжатии истории подходов: {e}", exc_info=True)
+        await asyncio.sleep(ROLLUP_INTERVAL_HOURS * 3600)
@@ -215,3 +215,32 @@ def format_exercise_name(exercise_name: str, sets_count: int) -> str:
     """Форматирует название упражнения с количеством подходов."""
     return f"{exercise_name} — {sets_count} подхода"
 
+
+
+# Подходы/повторения в конце названия, которые парсер мог не отделить:
+# "3*10", "4×8-10", "10-12", "3 подхода", "3 подхода по 10"
+_TRAILING_SETS = re.compile(
+    r'(?:\s*[—–-]?\s*(?:'
+    r'\d+\s*[×xх*]\s*\d+(?:\s*[-–]\s*\d+)?'
+    r'|\d+\s*[-–]\s*\d+'
+    r'|\d+\s+подход\w*(?:\s+по\s+\d+(?:\s*[-–]\s*\d+)?)?'
+    r'))+\s*$',
+    re.IGNORECASE
+)
+
+
+def normalize_exercise_name(exercise_name: str) -> str:
+    """
+    Канонический ключ упражнения для сопоставления истории между программами.
+    
+    Убирает подходы/повторения ("— 4×10", "— 3 подхода"), приводит к нижнему регистру,
+    заменяет ё на е и схлопывает пунктуацию и пробелы:
+    "Жим лёжа — 4×10" -> "жим лежа"
+    Остальные числа — часть названия: "Упражнение 1.1" и "Упражнение 1.2",
+    "Жим гантелей 30°" и "Жим гантелей 45°" — разные упражнения.
+    """
+    name = _TRAILING_SETS.sub('', exercise_name)
+    base_name, _ = parse_exercise_string(name)
+    key = (base_name or name).lower().replace("ё", "е")
+    key = re.sub(r'[^\w]+', ' ', key)
+    return key.strip() or exercise_name.lower().strip()
@@ -0,0 +1,132 @@
+"""
+Компактное состояние тренировки в FSM.
+
+В данных FSM хранится только WorkoutState — список из нескольких чисел: версия
+формата, запуск, день, пользователь и позиция (упражнение, подход). Структура
+дня (упражнения и подходы) и прошлые веса берутся из кэша процесса и при
+промахе (перезапуск, другой процесс бота) перечитываются из БД.
+
+Функции crud, меняющие упражнения и подходы или удаляющие программы, после
+commit убирают затронутые дни из кэша (forget_days). Изменение из другого
+процесса (API) сюда не доходит: устаревший exercise_id приводит к
+IntegrityError при записи подхода, и UpdateSessionMiddleware очищает кэш дней.
+"""
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import WORKOUT_CACHE_SIZE, WORKOUT_CACHE_TTL
+from app.db import crud
+from app.db.models import Exercise
+from app.utils.cache import TTLCache
+
+# Ключ данных FSM и версия формата записи
+WORKOUT_KEY = "workout"
+WORKOUT_STATE_VERSION = 1
+
+
+class DayExercise(NamedTuple):
+    """Упражнение дня: подходы — пары (set_index, reps) по порядку."""
+    exercise_id: int
+    name: str
+    sets: Tuple[Tuple[int, int], ...]
+
+
+class WorkoutState(NamedTuple):
+    """Позиция пользователя в тренировке."""
+    run_id: int
+    day_id: int
+    user_id: Optional[int]
+    exercise_index: int = 0
+    set_index: int = 0
+    last_bot_message_id: Optional[int] = None
+
+    def to_data(self) -> dict:
+        """Данные FSM с этим состоянием."""
+        return {WORKOUT_KEY: [WORKOUT_STATE_VERSION, *self]}
+
+    @classmethod
+    def from_data(cls, data: dict) -> Optional["WorkoutState"]:
+        """
+        Прочитать состояние из данных FSM (None, если тренировка не идёт).
+
+        Понимает и прежний формат с полным списком упражнений: такие состояния
+        могли сохраниться в fsm_states до обновления.
+        """
+        packed = data.get(WORKOUT_KEY)
+        if packed is not None and packed[0] == WORKOUT_STATE_VERSION:
+            return cls(*packed[1:])
+        if data.get("current_session_run_id") and data.get("day_id"):
+            return cls(
+                run_id=data["current_session_run_id"],
+                day_id=data["day_id"],
+                user_id=data.get("current_user_id"),
+                exercise_index=data.get("current_exercise_index", 0),
+                set_index=data.get("current_set_index", 0),
+                last_bot_message_id=data.get("last_bot_message_id")
+            )
+        return None
+
+
+# day_id -> структура дня; run_id -> {(exercise_id, set_index): (weight, timestamp)}
+_days = TTLCache(max_size=WORKOUT_CACHE_SIZE, ttl=WORKOUT_CACHE_TTL)
+_previous_sets = TTLCache(max_size=WORKOUT_CACHE_SIZE, ttl=WORKOUT_CACHE_TTL)
+
+
+def remember_day(day_id: int, exercises: List[Exercise]) -> Tuple[DayExercise, ...]:
+    """Положить в кэш структуру дня из загруженных упражнений (с подходами)."""
+    structure = tuple(
+        DayExercise(
+            exercise.exercise_id,
+            exercise.name,
+            tuple((s.set_index, s.reps) for s in sorted(exercise.sets, key=lambda s: s.set_index))
+        )
+        for exercise in exercises
+    )
+    _days.set(day_id, structure)
+    return structure
+
+
+async def get_day(session: AsyncSession, day_id: int) -> Tuple[DayExercise, ...]:
+    """Структура дня из кэша или из БД."""
+    structure = _days.get(day_id)
+    if structure is None:
+        structure = remember_day(day_id, await crud.get_exercises_by_day(session, day_id))
+    return structure
+
+
+def remember_previous_sets(run_id: int, previous_sets: Dict[Tuple[int, int], Tuple[float, datetime]]):
+    """Запомнить прошлые веса, загруженные в начале тренировки."""
+    _previous_sets.set(run_id, previous_sets)
+
+
+async def get_previous_sets(
+    session: AsyncSession, workout: WorkoutState
+) -> Dict[Tuple[int, int], Tuple[float, datetime]]:
+    """
+    Прошлые веса для подходов дня.
+
+    При промахе кэша веса перечитываются из БД (crud.get_previous_sets_for_day):
+    для подходов, ещё не выполненных в этой тренировке, это те же значения, что
+    и в её начале.
+    """
+    previous_sets = _previous_sets.get(workout.run_id)
+    if previous_sets is None:
+        previous_sets = await crud.get_previous_sets_for_day(session, workout.user_id, workout.day_id)
+        _previous_sets.set(workout.run_id, previous_sets)
+    return previous_sets
+
+
+def forget_days(day_ids: Optional[Iterable[int]] = None):
+    """Убрать структуру дней из кэша (None — всех дней)."""
+    if day_ids is None:
+        _days.clear()
+        return
+    for day_id in day_ids:
+        _days.pop(day_id)
+
+
+def forget_run(run_id: int):
+    """Убрать прошлые веса завершённой тренировки из кэша."""
+    _previous_sets.pop(run_id)
@@ -0,0 +1,356 @@
+"""
+Отложенная запись выполненных подходов (PERFORMED_SETS_WRITE_BEHIND=true).
+
+process_weight не ждёт commit: подход дописывается в локальный журнал
+(JSON Lines, fsync) и в память, а в БД попадает пачкой — в конце упражнения,
+раз в WRITE_BEHIND_FLUSH_SECONDS и перед итогами тренировки. После успешного
+commit записанные строки удаляются из журнала. Повторная запись пачки не
+создаёт дублей (см. crud.create_performed_sets).
+
+Запись и fsync журнала выполняются в пуле потоков: подходы, пришедшие пока
+идёт fsync, пишутся следующим fsync одной группой, event loop не блокируется.
+
+У каждого процесса свой журнал WRITE_BEHIND_JOURNAL_PATH.<хост>-<pid> и файл
+блокировки рядом с ним, заблокированный (flock) пока процесс жив. При старте
+воспроизводятся журналы всех процессов, блокировку которых удалось взять
+(процесс завершился или упал), в том числе журнал по старому общему пути, —
+подходы, подтверждённые до падения, не теряются.
+
+Журнал должен лежать на постоянном диске (на Railway — volume).
+"""
+import asyncio
+import glob
+import json
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: журналы других процессов воспроизводятся без проверки блокировки
+    fcntl = None
+
+from app.config import WRITE_BEHIND_FLUSH_SECONDS, WRITE_BEHIND_JOURNAL_PATH
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.utils.cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+LOCK_SUFFIX = ".lock"
+
+# Сколько помнить ключи подходов, уже записанных в БД (ключ -> позиция подхода):
+# повторная доставка update после flush не должна попасть в журнал второй раз
+FLUSHED_KEYS_SIZE = 10000
+FLUSHED_KEYS_TTL = 24 * 3600
+
+# Подходы, записанные в журнал, но ещё не в БД
+_pending: List[dict] = []
+# Подходы, ожидающие записи в журнал, и future подтверждения
+_unsynced: List[Tuple[dict, asyncio.Future]] = []
+_journal = None
+_journal_path: Optional[str] = None
+_lock_file = None
+# Запись в журнал и его замена после flush не должны пересекаться
+_journal_lock = asyncio.Lock()
+_flush_lock = asyncio.Lock()
+_sync_task: Optional[asyncio.Task] = None
+_flush_task: Optional[asyncio.Task] = None
+# Ссылки на фоновые flush: иначе задачу может собрать сборщик мусора
+_background_tasks: Set[asyncio.Task] = set()
+_flushed_keys = TTLCache(max_size=FLUSHED_KEYS_SIZE, ttl=FLUSHED_KEYS_TTL)
+
+
+def _process_journal_path() -> str:
+    return f"{WRITE_BEHIND_JOURNAL_PATH}.{socket.gethostname()}-{os.getpid()}"
+
+
+def _try_lock(lock_file) -> bool:
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _open_journal():
+    global _journal
+    _journal = open(_journal_path, "a", encoding="utf-8")
+
+
+def _serialize(entry: dict) -> str:
+    return json.dumps({**entry, "timestamp": entry["timestamp"].isoformat()}) + "\n"
+
+
+def _write_entries(entries: List[dict]):
+    """Дописать записи в журнал и сделать fsync (в пуле потоков)."""
+    _journal.write("".join(_serialize(entry) for entry in entries))
+    _journal.flush()
+    os.fsync(_journal.fileno())
+
+
+def _rewrite_journal(entries: List[dict]):
+    """Атомарно заменить журнал оставшимися записями (в пуле потоков)."""
+    _journal.close()
+    tmp_path = _journal_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as tmp:
+        tmp.write("".join(_serialize(entry) for entry in entries))
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    os.replace(tmp_path, _journal_path)
+    _open_journal()
+
+
+def _read_journal(path: str) -> List[dict]:
+    if not os.path.exists(path):
+        return []
+    entries = []
+    with open(path, encoding="utf-8") as journal:
+        for line in journal:
+            try:
+                entry = json.loads(line)
+                entry["timestamp"] = datetime.fromisoformat(entry["timestamp"])
+            except (ValueError, KeyError):
+                # Недописанная последняя строка после падения процесса
+                logger.warning(f"Пропущена повреждённая строка журнала {path}: {line!r}")
+                continue
+            entries.append(entry)
+    return entries
+
+
+def _orphaned_journals() -> List[Tuple[str, Optional[object]]]:
+    """Журналы завершившихся процессов и взятые блокировки их файлов."""
+    journals = []
+    if os.path.exists(WRITE_BEHIND_JOURNAL_PATH):
+        # Общий журнал версий до журналов по процессам
+        journals.append((WRITE_BEHIND_JOURNAL_PATH, None))
+    for path in sorted(glob.glob(glob.escape(WRITE_BEHIND_JOURNAL_PATH) + ".*")):
+        if path == _journal_path or path.endswith((LOCK_SUFFIX, ".tmp")):
+            continue
+        lock_file = open(path + LOCK_SUFFIX, "a")
+        if _try_lock(lock_file):
+            journals.append((path, lock_file))
+        else:
+            lock_file.close()
+    return journals
+
+
+async def append(
+    exercise_id: int,
+    set_index: int,
+    weight: float,
+    session_run_id: int,
+    user_id: Optional[int] = None,
+    idempotency_key: Optional[str] = None,
+    timestamp: Optional[datetime] = None
+) -> bool:
+    """
+    Подтвердить подход: дождаться записи в журнал и поставить в очередь на запись в БД.
+
+    Журнал пишется вне транзакции update. Если подход с этим ключом уже принят
+    на той же позиции (запуск, упражнение, подход), прошлая обработка update
+    упала после записи в журнал и позиция тренировки откатилась: подход не
+    пишется повторно, но считается принятым, чтобы тренировка продвинулась.
+
+    Returns:
+        bool: False, если подход с этим ключом идемпотентности уже принят на
+        другой позиции (повторная доставка уже обработанного update)
+    """
+    global _sync_task
+    position = (session_run_id, exercise_id, set_index)
+    if idempotency_key is not None:
+        accepted = _accepted_position(idempotency_key)
+        if accepted is not None:
+            accepted_position, synced = accepted
+            if synced is not None:
+                await asyncio.shield(synced)
+            return accepted_position == position
+    entry = {
+        "exercise_id": exercise_id,
+        "set_index": set_index,
+        "weight": weight,
+        "session_run_id": session_run_id,
+        "user_id": user_id,
+        "idempotency_key": idempotency_key,
+        "timestamp": timestamp or datetime.utcnow(),
+    }
+    synced = asyncio.get_running_loop().create_future()
+    _unsynced.append((entry, synced))
+    if _sync_task is None or _sync_task.done():
+        _sync_task = asyncio.create_task(_sync_journal())
+    await synced
+    return True
+
+
+def _position(entry: dict) -> Tuple[int, int, int]:
+    return entry["session_run_id"], entry["exercise_id"], entry["set_index"]
+
+
+def _accepted_position(idempotency_key: str) -> Optional[Tuple[Tuple[int, int, int], Optional[asyncio.Future]]]:
+    """
+    Позиция подхода с этим ключом, если он уже в журнале, в очереди на запись
+    или недавно записан в БД, и future записи в журнал (если она ещё идёт).
+    """
+    position = _flushed_keys.get(idempotency_key)
+    if position is not None:
+        return position, None
+    for entry in _pending:
+        if entry["idempotency_key"] == idempotency_key:
+            return _position(entry), None
+    for entry, synced in _unsynced:
+        if entry["idempotency_key"] == idempotency_key:
+            return _position(entry), synced
+    return None
+
+
+async def _sync_journal():
+    """Записать в журнал все ожидающие подходы одним fsync (group commit)."""
+    loop = asyncio.get_running_loop()
+    while _unsynced:
+        # Пачка остаётся в _unsynced до записи: _accepted_position видит её ключи
+        batch = list(_unsynced)
+        async with _journal_lock:
+            try:
+                await loop.run_in_executor(None, _write_entries, [entry for entry, _ in batch])
+            except Exception as e:
+                del _unsynced[:len(batch)]
+                for _, synced in batch:
+                    synced.set_exception(e)
+                continue
+            del _unsynced[:len(batch)]
+            _pending.extend(entry for entry, _ in batch)
+        for _, synced in batch:
+            synced.set_result(None)
+
+
+async def flush() -> int:
+    """
+    Записать накопленные подходы в БД одной транзакцией.
+
+    При ошибке подходы остаются в журнале и памяти до следующей попытки.
+
+    Returns:
+        int: Количество записанных подходов
+    """
+    async with _flush_lock:
+        if not _pending:
+            return 0
+        batch = list(_pending)
+        async with async_session_maker() as session:
+            written = await crud.create_performed_sets(session, batch)
+        async with _journal_lock:
+            # Под блокировкой журнала новые подходы не попадают между снимком и заменой
+            del _pending[:len(batch)]
+            for entry in batch:
+                if entry.get("idempotency_key"):
+                    _flushed_keys.set(entry["idempotency_key"], _position(entry))
+            await asyncio.get_running_loop().run_in_executor(None, _rewrite_journal, list(_pending))
+        logger.debug(f"Write-behind: записано {written} из {len(batch)} подходов")
+        return written
+
+
+async def _flush_safely():
+    try:
+        await flush()
+    except Exception as e:
+        logger.error(f"❌ Ошибка записи подходов из журнала: {e}", exc_info=True)
+
+
+def schedule_flush():
+    """Записать накопленные подходы в фоне (конец упражнения)."""
+    task = asyncio.create_task(_flush_safely())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def wait_for_run(session_run_id: int, expected_sets: int) -> bool:
+    """
+    Записать свои подходы и дождаться в БД всех подходов запуска.
+
+    Подходы одной тренировки могут быть в журналах разных процессов (webhook
+    за балансировщиком): другой процесс пишет их не позже чем через
+    WRITE_BEHIND_FLUSH_SECONDS. Ожидание ограничено двумя такими интервалами.
+
+    Returns:
+        bool: False, если за это время в БД не оказалось expected_sets подходов
+    """
+    await flush()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + WRITE_BEHIND_FLUSH_SECONDS * 2
+    while True:
+        async with async_session_maker() as session:
+            count = await crud.count_performed_sets_by_run(session, session_run_id)
+        if count >= expected_sets:
+            return True
+        if loop.time() >= deadline:
+            logger.warning(
+                f"Write-behind: в запуске {session_run_id} записано {count} из {expected_sets} подходов"
+            )
+            return False
+        await asyncio.sleep(min(0.2, WRITE_BEHIND_FLUSH_SECONDS))
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(WRITE_BEHIND_FLUSH_SECONDS)
+        await _flush_safely()
+
+
+async def start():
+    """Открыть журнал процесса, воспроизвести журналы завершившихся процессов и запустить периодическую запись."""
+    global _flush_task, _journal_path, _lock_file
+    _journal_path = _process_journal_path()
+    directory = os.path.dirname(_journal_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    _lock_file = open(_journal_path + LOCK_SUFFIX, "a")
+    if not _try_lock(_lock_file):
+        raise RuntimeError(f"Журнал {_journal_path} уже используется другим процессом")
+    # Журнал от прошлого процесса с тем же pid (перезапуск контейнера)
+    _pending.extend(_read_journal(_journal_path))
+    _open_journal()
+
+    for path, lock_file in _orphaned_journals():
+        entries = _read_journal(path)
+        logger.info(f"Write-behind: воспроизведение журнала {path}, {len(entries)} подходов")
+        try:
+            if entries:
+                async with async_session_maker() as session:
+                    await crud.create_performed_sets(session, entries)
+            os.remove(path)
+            if lock_file is not None:
+                os.remove(path + LOCK_SUFFIX)
+        except Exception as e:
+            logger.error(f"❌ Ошибка воспроизведения журнала {path}: {e}", exc_info=True)
+        finally:
+            if lock_file is not None:
+                lock_file.close()
+
+    if _pending:
+        logger.info(f"Write-behind: воспроизведение журнала, {len(_pending)} подходов")
+        await _flush_safely()
+    _flush_task = asyncio.create_task(_flush_loop())
+
+
+async def stop():
+    """Остановить периодическую запись и записать остаток."""
+    global _journal, _lock_file
+    if _flush_task is not None:
+        _flush_task.cancel()
+    if _background_tasks:
+        await asyncio.gather(*_background_tasks, return_exceptions=True)
+    await _flush_safely()
+    if _journal is not None:
+        _journal.close()
+        _journal = None
+        if not _pending:
+            # Всё записано в БД: пустой журнал процесса не нужен
+            os.remove(_journal_path)
+            os.remove(_journal_path + LOCK_SUFFIX)
+    if _lock_file is not None:
+        _lock_file.close()
+        _lock_file = None
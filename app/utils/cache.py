@@ -0,0 +1,45 @@
+"""Простой in-process кэш с ограничением размера (LRU) и временем жизни записей (TTL)."""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class TTLCache:
+    """LRU-кэш с TTL. Не потокобезопасен: рассчитан на один event loop."""
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Получить значение или None, если записи нет или она устарела."""
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        """Сохранить значение, вытесняя самые давно использованные записи."""
+        if self.max_size <= 0:
+            return
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """Удалить запись (если есть)."""
+        self._data.pop(key, None)
+
+    def clear(self):
+        """Очистить кэш."""
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
@@ -62,8 +62,13 @@ def get_days_count_keyboard() -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
-def get_programs_keyboard(programs: List, prefix: str = "select") -> InlineKeyboardMarkup:
-    """Клавиатура для выбора программы."""
+def get_programs_keyboard(
+    programs: List,
+    prefix: str = "select",
+    next_cursor: Optional[str] = None,
+    prev_cursor: Optional[str] = None
+) -> InlineKeyboardMarkup:
+    """Клавиатура для выбора программы (с кнопками страниц, если переданы курсоры)."""
     buttons = []
     # Группируем по 2 кнопки в ряду
     for i in range(0, len(programs), 2):
@@ -81,6 +86,19 @@ def get_programs_keyboard(programs: List, prefix: str = "select") -> InlineKeybo
                 )
             )
         buttons.append(row)
+    
+    # Кнопки страниц: курсор передаётся в callback_data
+    page_row = []
+    if prev_cursor:
+        page_row.append(
+            InlineKeyboardButton(text="⬅️ Назад", callback_data=f"{prefix}_page_before_{prev_cursor}")
+        )
+    if next_cursor:
+        page_row.append(
+            InlineKeyboardButton(text="Далее ➡️", callback_data=f"{prefix}_page_after_{next_cursor}")
+        )
+    if page_row:
+        buttons.append(page_row)
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
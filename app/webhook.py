@@ -0,0 +1,118 @@
+"""
+Приём обновлений Telegram через webhook (BOT_MODE=webhook).
+
+Встроенный aiohttp-сервер слушает WEBHOOK_HOST:WEBHOOK_PORT и принимает POST на
+WEBHOOK_PATH. Запросы без заголовка X-Telegram-Bot-Api-Secret-Token, равного
+WEBHOOK_SECRET, отклоняются с 401. При старте webhook регистрируется в Telegram
+на WEBHOOK_URL + WEBHOOK_PATH; при остановке не удаляется, чтобы Telegram копил
+обновления до запуска новой версии.
+
+Update обрабатывается в фоне: Telegram сразу получает 200 и не держит
+соединение (их не больше max_connections) на время ответа AI, а долгий
+хендлер не упирается в ~60 секунд ожидания, после которых Telegram повторяет
+update. При остановке сервер перестаёт принимать запросы и до SHUTDOWN_TIMEOUT
+ждёт update, обрабатываемых в фоне. Update, прерванный падением процесса,
+повторно не доставляется: пользователь отправит сообщение ещё раз (повторная
+доставка и так не дублирует подходы).
+
+Сервер можно запустить отдельно (python -m app.main) или в процессе API
+(WEBHOOK_IN_API=true, см. app/api/main.py).
+"""
+import asyncio
+import logging
+import re
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from app.config import WEBHOOK_HOST, WEBHOOK_PATH, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_URL
+
+logger = logging.getLogger(__name__)
+
+# Допустимые символы secret_token в setWebhook
+SECRET_TOKEN_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,256}$")
+SHUTDOWN_TIMEOUT = 30  # секунд на завершение текущих обработчиков
+
+
+class BackgroundRequestHandler(SimpleRequestHandler):
+    """Обработка update в фоне; при остановке дожидается незавершённых update."""
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, **kwargs):
+        super().__init__(dispatcher=dispatcher, bot=bot, handle_in_background=True, **kwargs)
+
+    async def close(self) -> None:
+        tasks = set(self._background_feed_update_tasks)
+        if tasks:
+            logger.info(f"Ожидание {len(tasks)} update в обработке")
+            _, pending = await asyncio.wait(tasks, timeout=SHUTDOWN_TIMEOUT)
+            if pending:
+                logger.warning(f"⚠️ {len(pending)} update не обработаны за {SHUTDOWN_TIMEOUT} с")
+        await super().close()
+
+
+def build_webhook_app(bot: Bot, dp: Dispatcher, secret: str = WEBHOOK_SECRET) -> web.Application:
+    """aiohttp-приложение с обработчиком webhook и жизненным циклом диспетчера."""
+    if not secret or not SECRET_TOKEN_PATTERN.match(secret):
+        raise ValueError("WEBHOOK_SECRET не задан или содержит недопустимые символы (A-Z, a-z, 0-9, _, -)")
+
+    app = web.Application()
+    # Регистрируется до setup_application: при остановке сначала дожидаемся
+    # фоновых update, затем останавливаем диспетчер и закрываем сессию бота
+    BackgroundRequestHandler(dp, bot, secret_token=secret).register(app, path=WEBHOOK_PATH)
+    # startup/shutdown диспетчера (и закрытие сессии бота) вместе с приложением
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def _register_webhook(bot: Bot, dp: Dispatcher, secret: str):
+    if not WEBHOOK_URL:
+        logger.warning("WEBHOOK_URL не задан: webhook в Telegram не регистрируется")
+        return
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=secret,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info(f"✅ Webhook зарегистрирован: {WEBHOOK_URL.rstrip('/')}{WEBHOOK_PATH}")
+
+
+async def start_webhook(
+    bot: Bot,
+    dp: Dispatcher,
+    host: str = WEBHOOK_HOST,
+    port: int = WEBHOOK_PORT,
+    secret: str = WEBHOOK_SECRET
+) -> web.AppRunner:
+    """Запустить сервер webhook в текущем event loop и зарегистрировать webhook."""
+    runner = web.AppRunner(build_webhook_app(bot, dp, secret), handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port, shutdown_timeout=SHUTDOWN_TIMEOUT)
+    await site.start()
+    logger.info(f"Webhook-сервер слушает {host}:{port}{WEBHOOK_PATH}")
+    await _register_webhook(bot, dp, secret)
+    return runner
+
+
+async def stop_webhook(runner: web.AppRunner):
+    """Перестать принимать запросы, дождаться текущих обработчиков и остановить диспетчер."""
+    await runner.cleanup()
+    logger.info("Webhook-сервер остановлен")
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher):
+    """Работать в режиме webhook до SIGINT/SIGTERM."""
+    runner = await start_webhook(bot, dp)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:
+            # Windows: остановка через KeyboardInterrupt
+            pass
+    try:
+        await stop.wait()
+    finally:
+        await stop_webhook(runner)
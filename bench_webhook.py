@@ -0,0 +1,254 @@
+"""
+Задержка обработки update в режиме webhook на локальном «фейковом Telegram».
+Использование:
+    python bench_webhook.py
+    python bench_webhook.py --updates 200 --max-p95-ms 150
+
+Поднимаются два локальных сервера: заглушка Bot API (принимает sendMessage и
+другие методы и запоминает время вызова) и webhook-сервер бота (app/webhook.py)
+с временной SQLite базой. На webhook отправляются update от разных
+пользователей, замеряется время от отправки update до sendMessage в этот чат.
+Сценарий тренировки проходит её целиком (начало, выбор дня, веса, итоги) и на
+каждом шаге ждёт ответ с ожидаемым текстом. Дополнительно проверяется, что
+update без правильного secret token отклоняется. Завершается с ошибкой, если
+ответ не пришёл или p95 больше --max-p95-ms.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Dict, List, Tuple
+
+from aiohttp import ClientSession, web
+
+# Окружение задаётся до импорта app: engine и конфиг создаются при импорте
+TMP_DIR = tempfile.mkdtemp(prefix="fitness_webhook_")
+os.environ["TELEGRAM_BOT_TOKEN"] = "123456:BENCH"
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(TMP_DIR, 'bench.db')}"
+os.environ["WEBHOOK_URL"] = "http://127.0.0.1"
+os.environ.setdefault("WEBHOOK_SECRET", "bench-secret")
+os.environ.setdefault("SLOW_QUERY_THRESHOLD_MS", "0")
+
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+
+from app.bot import create_bot, setup_database
+from app.config import WEBHOOK_PATH, WEBHOOK_SECRET
+from app.db import crud
+from app.db.init_db import async_session_maker, close_db
+from app.webhook import start_webhook, stop_webhook
+
+# (текст сообщения, описание сценария)
+SCENARIOS = [
+    ("Мои Программы тренировок", "меню без БД"),
+    ("Посмотреть статистику", "статистика (чтение БД)"),
+]
+
+
+# Тренировка: (действие, текст или callback_data, ожидаемый фрагмент ответа).
+# {day_id} подставляется после создания программы
+WORKOUT_DAYS = [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8]}, {"name": "Тяга", "reps": [5]}]}]
+WORKOUT_STEPS: List[Tuple[str, str, str]] = [
+    ("message", "Начать тренировку", "Выберите тренировочный день"),
+    ("callback", "select_day_{day_id}", "Готовы начать тренировку?"),
+    ("callback", "start_training", "Подход 1: 10 раз"),
+    ("message", "50", "Подход 2: 8 раз"),
+    ("message", "52.5", "Тяга\nПодход 1: 5 раз"),
+    ("message", "70", "Тренировка завершена!"),
+]
+
+
+class FakeTelegram:
+    """Заглушка Bot API: отвечает на методы и будит ожидающих ответа в чат."""
+
+    def __init__(self):
+        self.message_id = 0
+        self.calls: Dict[str, int] = {}
+        # chat_id -> (ожидаемый фрагмент текста, future)
+        self.waiters: Dict[int, Tuple[str, asyncio.Future]] = {}
+        self.replies: Dict[int, List[str]] = {}
+
+    def expect_reply(self, chat_id: int, contains: str = "") -> asyncio.Future:
+        """Future со временем первого ответа в чат, содержащего contains."""
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[chat_id] = (contains, future)
+        return future
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        params = await request.post()
+        if method in ("sendMessage", "editMessageText"):
+            chat_id = int(params["chat_id"])
+            self.message_id += 1
+            text = params.get("text", "")
+            self.replies.setdefault(chat_id, []).append(text)
+            contains, future = self.waiters.get(chat_id, ("", None))
+            if future is not None and contains in text:
+                del self.waiters[chat_id]
+                if not future.done():
+                    future.set_result(time.perf_counter())
+            result = {
+                "message_id": self.message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+        elif method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "Bench"}
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+
+def make_update(update_id: int, chat_id: int, text: str) -> dict:
+    user = {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"bench{chat_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+def make_callback(update_id: int, chat_id: int, data: str) -> dict:
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Bench", "username": f"bench{chat_id}"},
+            "chat_instance": str(chat_id),
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "Bench"},
+                "text": "",
+            },
+            "data": data,
+        },
+    }
+
+
+def report(title: str, timings: List[float], max_p95_ms: float) -> bool:
+    """Напечатать строку таблицы; False, если p95 больше порога."""
+    if not timings:
+        return True
+    p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+    print(f"{title:>24} {len(timings):>7} {statistics.median(timings):>12.2f} {p95:>9.2f}")
+    if max_p95_ms and p95 > max_p95_ms:
+        print(f"{title}: p95 {p95:.2f} мс больше {max_p95_ms} мс")
+        return False
+    return True
+
+
+async def bench_workout(client, url, headers, fake: FakeTelegram, users: int, first_update_id: int, max_p95_ms: float) -> bool:
+    """Пройти тренировку за users пользователей, проверяя ответ на каждом шаге."""
+    ok = True
+    timings = []
+    update_id = first_update_id
+    for i in range(users):
+        chat_id = 50_000 + i
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, chat_id, username=f"bench{chat_id}")
+            program = await crud.create_program_tree(session, user.id, "Бенчмарк", WORKOUT_DAYS)
+            day_id = (await crud.get_workout_days(session, program.session_id))[0].id
+        for kind, value, expected in WORKOUT_STEPS:
+            update_id += 1
+            value = value.format(day_id=day_id)
+            update = make_update(update_id, chat_id, value) if kind == "message" else make_callback(update_id, chat_id, value)
+            reply = fake.expect_reply(chat_id, expected)
+            started = time.perf_counter()
+            async with client.post(url, json=update, headers=headers) as response:
+                await response.read()
+            try:
+                replied = await asyncio.wait_for(reply, timeout=5)
+            except asyncio.TimeoutError:
+                fake.waiters.pop(chat_id, None)
+                print(f"тренировка: на «{value}» нет ответа с «{expected}», ответы: {fake.replies.get(chat_id, [])[-3:]}")
+                ok = False
+                break
+            timings.append((replied - started) * 1000)
+    return report("тренировка (шаг)", timings, max_p95_ms) and ok
+
+
+async def bench(updates: int, max_p95_ms: float) -> bool:
+    fake = FakeTelegram()
+    fake_app = web.Application()
+    fake_app.router.add_post("/bot{token}/{method}", fake.handle)
+    fake_runner = web.AppRunner(fake_app)
+    await fake_runner.setup()
+    fake_site = web.TCPSite(fake_runner, "127.0.0.1", 0)
+    await fake_site.start()
+    api_port = fake_runner.addresses[0][1]
+
+    await setup_database()
+    bot, dp = await create_bot(
+        session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{api_port}"))
+    )
+    runner = await start_webhook(bot, dp, host="127.0.0.1", port=0)
+    url = f"http://127.0.0.1:{runner.addresses[0][1]}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": WEBHOOK_SECRET}
+
+    ok = fake.calls.get("setWebhook") == 1
+    if not ok:
+        print("setWebhook не вызван при старте")
+    try:
+        async with ClientSession() as client:
+            async with client.post(url, json=make_update(1, 1, "x"), headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}) as response:
+                if response.status != 401:
+                    print(f"update с неверным secret token: статус {response.status}, ожидался 401")
+                    ok = False
+
+            print(f"{'сценарий':>24} {'update':>7} {'медиана, мс':>12} {'p95, мс':>9}")
+            update_id = 1
+            for text, title in SCENARIOS:
+                timings = []
+                for i in range(updates):
+                    update_id += 1
+                    chat_id = 1000 + i
+                    reply = fake.expect_reply(chat_id)
+                    started = time.perf_counter()
+                    async with client.post(url, json=make_update(update_id, chat_id, text), headers=headers) as response:
+                        await response.read()
+                    try:
+                        replied = await asyncio.wait_for(reply, timeout=5)
+                    except asyncio.TimeoutError:
+                        print(f"{title}: нет ответа на update {update_id}")
+                        ok = False
+                        continue
+                    timings.append((replied - started) * 1000)
+                ok = report(title, timings, max_p95_ms) and ok
+
+            users = max(1, updates // len(WORKOUT_STEPS))
+            ok = await bench_workout(client, url, headers, fake, users, update_id, max_p95_ms) and ok
+    finally:
+        await stop_webhook(runner)
+        await fake_runner.cleanup()
+        await close_db()
+    return ok
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Задержка webhook на фейковом Telegram")
+    parser.add_argument("--updates", type=int, default=50, help="Update на сценарий")
+    parser.add_argument("--max-p95-ms", type=float, default=0, help="Порог p95, мс (0 — не проверять)")
+    args = parser.parse_args()
+    try:
+        ok = await bench(args.updates, args.max_p95_ms)
+    finally:
+        shutil.rmtree(TMP_DIR, ignore_errors=True)
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
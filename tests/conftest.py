@@ -0,0 +1,235 @@
+"""
+Общие фикстуры тестов.
+
+Тесты работают на временной SQLite базе. Окружение задаётся до импорта app:
+config и engine создаются при импорте. Тесты PostgreSQL выполняются, если
+TEST_POSTGRES_URL указывает на пустую тестовую базу (таблицы в ней
+пересоздаются), иначе пропускаются. Фикстура telegram прогоняет update через
+настоящий Dispatcher бота с заглушкой Bot API вместо сети.
+"""
+import asyncio
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import List
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix="fitness_tests_")
+DB_FILE = os.path.join(TMP_DIR, "test.db")
+os.environ["TELEGRAM_BOT_TOKEN"] = "123456:TEST"
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{DB_FILE}"
+os.environ["SLOW_QUERY_THRESHOLD_MS"] = "0"
+os.environ["DB_METRICS_LOG_INTERVAL_MINUTES"] = "0"
+
+TEST_POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.fsm.storage.memory import MemoryStorage  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+from sqlalchemy import event  # noqa: E402
+
+from app.db import crud  # noqa: E402
+from app.db.init_db import build_engine, close_db, init_db  # noqa: E402
+from app.db.migrations import migrate  # noqa: E402
+from app.db.models import Base  # noqa: E402
+from app.services import workout_state  # noqa: E402
+
+
+def _clear_caches():
+    # id в новой базе начинаются с 1: кэши процесса не должны переживать тест
+    crud._user_cache.clear()
+    workout_state._days.clear()
+    workout_state._previous_sets.clear()
+
+
+@pytest.fixture
+def run():
+    """Выполнить корутинную функцию на чистой SQLite базе."""
+    def _run(scenario):
+        async def wrapper():
+            await init_db()
+            try:
+                return await scenario()
+            finally:
+                await close_db()
+
+        try:
+            return asyncio.run(wrapper())
+        finally:
+            _clear_caches()
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(DB_FILE + suffix):
+                    os.remove(DB_FILE + suffix)
+
+    return _run
+
+
+@pytest.fixture
+def run_postgres():
+    """Выполнить корутинную функцию scenario(engine) на тестовой базе PostgreSQL."""
+    if not TEST_POSTGRES_URL:
+        pytest.skip("TEST_POSTGRES_URL не задан")
+    pytest.importorskip("asyncpg")
+    url = TEST_POSTGRES_URL
+    if url.startswith("postgres://"):
+        url = url.replace("postgres://", "postgresql+asyncpg://", 1)
+    elif url.startswith("postgresql://"):
+        url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+
+    def _run(scenario):
+        async def wrapper():
+            engine = build_engine(url)
+            try:
+                async with engine.begin() as conn:
+                    await conn.run_sync(Base.metadata.drop_all)
+                    await conn.exec_driver_sql("DROP TABLE IF EXISTS schema_version")
+                await migrate(engine, True)
+                return await scenario(engine)
+            finally:
+                await engine.dispose()
+
+        try:
+            return asyncio.run(wrapper())
+        finally:
+            _clear_caches()
+
+    return _run
+
+
+@pytest.fixture
+def captured_statements():
+    """Контекстный менеджер: список (statement, parameters), выполненных на engine."""
+    @contextmanager
+    def capture(engine):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append((statement, parameters))
+
+        event.listen(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine.sync_engine, "before_cursor_execute", before_cursor_execute)
+
+    return capture
+
+
+class FakeTelegramSession(BaseSession):
+    """Заглушка Bot API: запоминает вызванные методы, sendMessage и editMessageText возвращают сообщение."""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = []
+        self.message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.requests.append(method)
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.message_id += 1
+            return Message(
+                message_id=self.message_id,
+                date=datetime.now(),
+                chat=Chat(id=method.chat_id or 0, type="private"),
+                text=method.text,
+            ).as_(bot)
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        raise NotImplementedError
+        yield b""
+
+    async def close(self):
+        pass
+
+
+class TelegramHarness:
+    """Отправка сообщений и нажатий кнопок в Dispatcher бота от имени пользователя."""
+
+    def __init__(self, bot, dp, fake: FakeTelegramSession):
+        self.bot = bot
+        self.dp = dp
+        self.fake = fake
+        self.update_id = 0
+
+    def reset(self):
+        self.fake.requests.clear()
+        self.dp.fsm.storage = MemoryStorage()
+
+    def _user(self, chat_id: int) -> dict:
+        return {"id": chat_id, "is_bot": False, "first_name": "Test", "username": f"user{chat_id}"}
+
+    def _message(self, chat_id: int, text: str) -> dict:
+        self.update_id += 1
+        return {
+            "message_id": self.update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self._user(chat_id),
+            "text": text,
+        }
+
+    async def feed(self, update: dict) -> List[str]:
+        """Обработать update, вернуть тексты отправленных и изменённых сообщений."""
+        start = len(self.fake.requests)
+        await self.dp.feed_update(self.bot, Update.model_validate(update, context={"bot": self.bot}))
+        return [
+            method.text for method in self.fake.requests[start:]
+            if isinstance(method, (SendMessage, EditMessageText))
+        ]
+
+    def message_update(self, chat_id: int, text: str) -> dict:
+        message = self._message(chat_id, text)
+        return {"update_id": self.update_id, "message": message}
+
+    async def send(self, chat_id: int, text: str) -> List[str]:
+        """Сообщение пользователя."""
+        return await self.feed(self.message_update(chat_id, text))
+
+    async def press(self, chat_id: int, data: str) -> List[str]:
+        """Нажатие inline-кнопки под сообщением бота."""
+        message = self._message(chat_id, "")
+        message["from"] = {"id": 123456, "is_bot": True, "first_name": "Bot"}
+        return await self.feed({
+            "update_id": self.update_id,
+            "callback_query": {
+                "id": str(self.update_id),
+                "from": self._user(chat_id),
+                "chat_instance": str(chat_id),
+                "message": message,
+                "data": data,
+            },
+        })
+
+    async def start_workout(self, chat_id: int, days: list) -> List[str]:
+        """Создать пользователю программу и начать тренировку первого дня; вернуть первый запрос веса."""
+        from app.db.init_db import async_session_maker
+
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, chat_id, username=f"user{chat_id}")
+            program = await crud.create_program_tree(session, user.id, "Тренировка", days)
+            day_id = (await crud.get_workout_days(session, program.session_id))[0].id
+        await self.send(chat_id, "Начать тренировку")
+        await self.press(chat_id, f"select_day_{day_id}")
+        return await self.press(chat_id, "start_training")
+
+
+_harness = None
+
+
+@pytest.fixture
+def telegram():
+    """Dispatcher бота с заглушкой Bot API (роутеры подключаются к Dispatcher один раз за процесс)."""
+    global _harness
+    if _harness is None:
+        from app.bot import create_bot
+
+        fake = FakeTelegramSession()
+        bot, dp = asyncio.run(create_bot(session=fake))
+        _harness = TelegramHarness(bot, dp, fake)
+    _harness.reset()
+    return _harness
@@ -0,0 +1,115 @@
+"""Удаление программы и пользователя одним DELETE: каскад SQLite (PRAGMA foreign_keys=ON)."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, select
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.db.models import (
+    Exercise, LatestWeight, PerformedSet, Session, SessionRun, Set, User, WorkoutDay
+)
+
+DAYS = [
+    {"name": "День 1", "exercises": [{"name": "Жим лёжа", "reps": [10, 8]}, {"name": "Тяга", "reps": [5]}]},
+    {"name": "День 2", "exercises": [{"name": "Присед", "reps": [6, 6]}]},
+]
+
+
+async def _trained_program(session, user_id, name, weight, timestamp):
+    """Программа DAYS с одной выполненной тренировкой по всем подходам."""
+    program = await crud.create_program_tree(session, user_id, name, DAYS)
+    run = await crud.create_session_run(session, user_id, program.session_id)
+    for day in await crud.get_workout_days(session, program.session_id):
+        day = await crud.get_workout_day_by_id(session, day.id)
+        for exercise in day.exercises:
+            for workout_set in exercise.sets:
+                await crud.create_performed_set(
+                    session, exercise.exercise_id, workout_set.set_index, weight, run.id,
+                    user_id=user_id, timestamp=timestamp
+                )
+    return program.session_id
+
+
+async def _rows(session, program_ids):
+    """Число строк каждой таблицы, относящихся к программам program_ids."""
+    day_ids = select(WorkoutDay.id).where(WorkoutDay.session_id.in_(program_ids))
+    exercise_ids = select(Exercise.exercise_id).where(Exercise.workout_day_id.in_(day_ids))
+    run_ids = select(SessionRun.id).where(SessionRun.session_id.in_(program_ids))
+    queries = {
+        "programs": select(func.count()).where(Session.session_id.in_(program_ids)),
+        "days": select(func.count()).where(WorkoutDay.session_id.in_(program_ids)),
+        "exercises": select(func.count()).where(Exercise.exercise_id.in_(exercise_ids)),
+        "sets": select(func.count()).where(Set.exercise_id.in_(exercise_ids)),
+        "runs": select(func.count()).where(SessionRun.id.in_(run_ids)),
+        "performed_sets": select(func.count()).where(PerformedSet.exercise_id.in_(exercise_ids)),
+    }
+    return {table: await session.scalar(query) for table, query in queries.items()}
+
+
+async def _latest_weights(session, user_id):
+    result = await session.execute(
+        select(LatestWeight.set_index, LatestWeight.weight).where(LatestWeight.user_id == user_id)
+    )
+    return sorted(result.all())
+
+
+EMPTY = {"programs": 0, "days": 0, "exercises": 0, "sets": 0, "runs": 0, "performed_sets": 0}
+# Одна программа DAYS с одной тренировкой
+PROGRAM = {"programs": 1, "days": 2, "exercises": 3, "sets": 5, "runs": 1, "performed_sets": 5}
+
+
+def test_delete_program_cascades_and_rebuilds_latest_weights(run):
+    async def scenario():
+        now = datetime.utcnow()
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 8001)
+            kept = await _trained_program(session, user.id, "A", 50, now - timedelta(days=2))
+            deleted = await _trained_program(session, user.id, "B", 70, now - timedelta(days=1))
+            weights_before = await _latest_weights(session, user.id)
+            assert await crud.delete_session(session, deleted)
+
+        async with async_session_maker() as session:
+            return (
+                weights_before,
+                await _rows(session, [deleted]),
+                await _rows(session, [kept]),
+                await _latest_weights(session, user.id),
+            )
+
+    weights_before, deleted_rows, kept_rows, weights_after = run(scenario)
+    assert {weight for _, weight in weights_before} == {70}
+    assert deleted_rows == EMPTY
+    assert kept_rows == PROGRAM
+    # Последние веса пересобраны из оставшейся программы
+    assert weights_after == [(1, 50), (1, 50), (1, 50), (2, 50), (2, 50)]
+
+
+def test_delete_user_cascades(run):
+    async def scenario():
+        now = datetime.utcnow()
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 8002)
+            other = await crud.get_or_create_user(session, 8003)
+            programs = [
+                await _trained_program(session, user.id, "A", 50, now - timedelta(days=2)),
+                await _trained_program(session, user.id, "B", 70, now - timedelta(days=1)),
+            ]
+            other_program = await _trained_program(session, other.id, "C", 90, now)
+            assert await crud.delete_user(session, user.id) == 8002
+
+        async with async_session_maker() as session:
+            return (
+                await session.scalar(select(func.count()).where(User.id == user.id)),
+                await _rows(session, programs),
+                await _latest_weights(session, user.id),
+                await _rows(session, [other_program]),
+                await _latest_weights(session, other.id),
+            )
+
+    users, rows, weights, other_rows, other_weights = run(scenario)
+    assert users == 0
+    assert rows == EMPTY
+    assert weights == []
+    # Данные другого пользователя не затронуты
+    assert other_rows == PROGRAM
+    assert {weight for _, weight in other_weights} == {90}
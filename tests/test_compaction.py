@@ -0,0 +1,77 @@
+"""Сжатие старой истории: порции по batch_size групп и та же статистика после сжатия."""
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, func, select, update
+
+from app.config import ROLLUP_KEEP_RECENT_RUNS
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.db.models import PerformedSet, PerformedSetRollup
+
+RUNS = 7
+
+
+async def _old_history(session, reps=(5, 5)):
+    """RUNS старых тренировок по одному упражнению."""
+    user = await crud.get_or_create_user(session, 3001, username="compaction")
+    program = await crud.create_program_tree(
+        session, user.id, "Сжатие", [{"name": "День 1", "exercises": [{"name": "Тяга", "reps": list(reps)}]}]
+    )
+    exercise_id = (await crud.get_workout_days(session, program.session_id))[0].exercises[0].exercise_id
+    for weight in range(RUNS):
+        run = await crud.create_session_run(session, user.id, program.session_id)
+        for set_index in (1, 2):
+            await crud.create_performed_set(session, exercise_id, set_index, 100 + weight, run.id, user_id=user.id)
+        await session.execute(
+            update(PerformedSet)
+            .where(PerformedSet.session_run_id == run.id)
+            .values(timestamp=datetime.utcnow() - timedelta(days=400 - weight))
+        )
+    await session.commit()
+    return user.id, exercise_id
+
+
+def test_compaction_commits_in_batches(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user_id, _ = await _old_history(session)
+        commits = []
+        async with async_session_maker() as session:
+            event.listen(session.sync_session, "after_commit", lambda s: commits.append(1))
+            compacted = await crud.compact_user_performed_sets(
+                session, user_id, datetime.utcnow() - timedelta(days=365), batch_size=2
+            )
+        async with async_session_maker() as session:
+            rollups = await session.scalar(select(func.count()).select_from(PerformedSetRollup))
+            remaining = await session.scalar(select(func.count()).select_from(PerformedSet))
+        return compacted, len(commits), rollups, remaining
+
+    compacted, commits, rollups, remaining = run(scenario)
+    # Два последних запуска остаются в performed_sets
+    assert compacted == rollups == RUNS - ROLLUP_KEEP_RECENT_RUNS
+    assert commits == 3
+    assert remaining == ROLLUP_KEEP_RECENT_RUNS * 2
+
+
+def test_compacted_history_keeps_statistics_and_volume(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            # Повторения подходов различаются, объём зависит от set_index
+            user_id, exercise_id = await _old_history(session, reps=(5, 8))
+
+        async def statistics():
+            async with async_session_maker() as session:
+                return (
+                    await crud.get_exercise_statistics(session, user_id, exercise_id),
+                    await crud.get_exercise_volume(session, user_id, exercise_id),
+                )
+
+        before = await statistics()
+        async with async_session_maker() as session:
+            await crud.compact_user_performed_sets(session, user_id, datetime.utcnow() - timedelta(days=365))
+        return before, await statistics()
+
+    (stats_before, volume_before), (stats_after, volume_after) = run(scenario)
+    assert stats_after == stats_before
+    assert volume_after == volume_before
+    assert [volume for _, volume in volume_before] == [(100 + weight) * (5 + 8) for weight in range(RUNS)]
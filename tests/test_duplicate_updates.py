@@ -0,0 +1,88 @@
+"""Повторная доставка update с весом не сохраняет подход второй раз; тренировка сдвигается ровно один раз."""
+import pytest
+from sqlalchemy import select
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.db.models import SessionRun
+from app.handlers import training
+from app.services import write_behind
+
+WORKOUT = [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8, 6]}]}]
+
+
+@pytest.mark.parametrize("write_behind_mode", [False, True])
+def test_redelivered_weight_is_ignored(run, telegram, tmp_path, monkeypatch, write_behind_mode):
+    monkeypatch.setattr(training, "PERFORMED_SETS_WRITE_BEHIND", write_behind_mode)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_PATH", str(tmp_path / "performed_sets.journal"))
+    chat_id = 6001
+
+    async def scenario():
+        if write_behind_mode:
+            await write_behind.start()
+        try:
+            await telegram.start_workout(chat_id, WORKOUT)
+            update = telegram.message_update(chat_id, "50")
+            first = await telegram.feed(update)
+            if write_behind_mode:
+                await write_behind.flush()
+            duplicate = await telegram.feed(update)
+            # Следующий вес относится ко второму подходу, а не к третьему
+            second = await telegram.send(chat_id, "55")
+            if write_behind_mode:
+                await write_behind.flush()
+        finally:
+            if write_behind_mode:
+                await write_behind.stop()
+        async with async_session_maker() as session:
+            user = await crud.get_user_by_telegram_id(session, chat_id)
+            run_id = await session.scalar(select(SessionRun.id).where(SessionRun.user_id == user.id))
+            sets = await crud.get_performed_sets_by_run(session, run_id)
+        return first, duplicate, second, [(s.set_index, s.weight) for s in sets]
+
+    first, duplicate, second, sets = run(scenario)
+    assert first and "Подход 2" in first[-1]
+    assert duplicate == []
+    assert "Подход 3" in second[-1]
+    assert sets == [(1, 50.0), (2, 55.0)]
+
+
+@pytest.mark.parametrize("write_behind_mode", [False, True])
+def test_redelivery_after_failed_update_advances_workout(run, telegram, tmp_path, monkeypatch, write_behind_mode):
+    monkeypatch.setattr(training, "PERFORMED_SETS_WRITE_BEHIND", write_behind_mode)
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_PATH", str(tmp_path / "performed_sets.journal"))
+    chat_id = 6002
+    ask_for_weight = training.ask_for_weight
+
+    async def failing_ask_for_weight(*args, **kwargs):
+        raise RuntimeError("Telegram недоступен")
+
+    async def scenario():
+        if write_behind_mode:
+            await write_behind.start()
+        try:
+            await telegram.start_workout(chat_id, WORKOUT)
+            update = telegram.message_update(chat_id, "50")
+            # Подход принят (в режиме write-behind — записан в журнал), но следующий
+            # запрос веса не отправлен: update откатывается и доставляется снова
+            monkeypatch.setattr(training, "ask_for_weight", failing_ask_for_weight)
+            with pytest.raises(RuntimeError):
+                await telegram.feed(update)
+            monkeypatch.setattr(training, "ask_for_weight", ask_for_weight)
+            redelivered = await telegram.feed(update)
+            second = await telegram.send(chat_id, "55")
+            if write_behind_mode:
+                await write_behind.flush()
+        finally:
+            if write_behind_mode:
+                await write_behind.stop()
+        async with async_session_maker() as session:
+            user = await crud.get_user_by_telegram_id(session, chat_id)
+            run_id = await session.scalar(select(SessionRun.id).where(SessionRun.user_id == user.id))
+            sets = await crud.get_performed_sets_by_run(session, run_id)
+        return redelivered, second, [(s.set_index, s.weight) for s in sets]
+
+    redelivered, second, sets = run(scenario)
+    assert redelivered and "Подход 2" in redelivered[-1]
+    assert "Подход 3" in second[-1]
+    assert sets == [(1, 50.0), (2, 55.0)]
@@ -0,0 +1,86 @@
+"""Хранилище FSM в БД: запись через сессию update (один commit, одно соединение), удаление пустых строк."""
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import event, func, select
+
+from app.db.fsm_storage import DatabaseStorage
+from app.db.init_db import async_session_maker, engine
+from app.db.lazy_session import LazySession, current_session
+from app.db.models import FsmState
+
+WORKOUT = [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8]}, {"name": "Тяга", "reps": [5]}]}]
+KEY = StorageKey(bot_id=1, chat_id=7001, user_id=7001)
+
+
+def test_full_workout_with_database_storage(run, telegram):
+    checkouts = []
+
+    def on_checkout(*args):
+        checkouts.append(1)
+
+    async def scenario():
+        telegram.dp.fsm.storage = DatabaseStorage(engine)
+        first = await telegram.start_workout(7002, WORKOUT)
+        event.listen(engine.sync_engine, "checkout", on_checkout)
+        try:
+            replies = [await telegram.send(7002, weight) for weight in ("50", "52.5", "70")]
+        finally:
+            event.remove(engine.sync_engine, "checkout", on_checkout)
+        async with async_session_maker() as session:
+            states = (await session.execute(select(FsmState.state, FsmState.data))).all()
+        return first, replies, states
+
+    try:
+        first, replies, states = run(scenario)
+    finally:
+        telegram.reset()
+    assert "Подход 1: 10 раз" in first[-1]
+    assert "Подход 2: 8 раз" in replies[0][-1]
+    assert replies[1] == ["✅ Упражнение «Жим» завершено", replies[1][1]] and "Тяга" in replies[1][1]
+    assert replies[2][-1].startswith("✅ Тренировка завершена!")
+    assert "Жим" in replies[2][-1] and "Тяга" in replies[2][-1]
+    # Тренировка завершена: строка без состояния и данных удалена
+    assert states == []
+    # FSM и хендлер используют одно соединение на update
+    assert len(checkouts) == 3
+
+
+def test_rolled_back_update_discards_state(run):
+    async def scenario():
+        storage = DatabaseStorage(engine)
+        session = LazySession(async_session_maker)
+        token = current_session.set(session)
+        try:
+            await storage.set_state(KEY, "training:waiting_for_weight")
+            # Внутри update изменение уже видно
+            in_update = await storage.get_state(KEY)
+        finally:
+            current_session.reset(token)
+            await session.finish(commit=False)
+        after_rollback = await storage.get_state(KEY)
+
+        session = LazySession(async_session_maker)
+        token = current_session.set(session)
+        try:
+            await storage.set_data(KEY, {"day_id": 1})
+        finally:
+            current_session.reset(token)
+            await session.finish(commit=True)
+        return in_update, after_rollback, await storage.get_data(KEY)
+
+    assert run(scenario) == ("training:waiting_for_weight", None, {"day_id": 1})
+
+
+def test_recreated_row_is_not_served_from_stale_cache(run):
+    async def scenario():
+        # Два процесса бота с общим fsm_states
+        first, second = DatabaseStorage(engine), DatabaseStorage(engine)
+        await first.set_state(KEY, "menu:main")
+        cached = await second.get_state(KEY)
+        await first.set_state(KEY, None)
+        async with async_session_maker() as session:
+            rows_after_clear = await session.scalar(select(func.count()).select_from(FsmState))
+        # Строка создаётся заново с той же version, что в кэше второго процесса
+        await first.set_state(KEY, "training:waiting_for_weight")
+        return cached, rows_after_clear, await second.get_state(KEY)
+
+    assert run(scenario) == ("menu:main", 0, "training:waiting_for_weight")
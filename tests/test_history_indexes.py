@@ -0,0 +1,60 @@
+"""Запрос последнего веса читает только покрывающий индекс performed_sets."""
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.db import crud
+from app.db.init_db import async_session_maker, engine
+
+COVERING_INDEX = "idx_performed_user_exercise_set_ts"
+
+
+async def _history(session):
+    """Пользователь с одной программой и двумя тренировками."""
+    user = await crud.get_or_create_user(session, 1001, username="history")
+    program = await crud.create_program_tree(
+        session, user.id, "История", [{"name": "День 1", "exercises": [{"name": "Жим лёжа", "reps": [10, 8]}]}]
+    )
+    day = (await crud.get_workout_days(session, program.session_id))[0]
+    exercise_id = day.exercises[0].exercise_id
+    for weight in (50, 55):
+        run = await crud.create_session_run(session, user.id, program.session_id)
+        for set_index in (1, 2):
+            await crud.create_performed_set(session, exercise_id, set_index, weight, run.id, user_id=user.id)
+    return user.id, exercise_id
+
+
+async def _last_weight_statement(session, engine, captured_statements):
+    user_id, exercise_id = await _history(session)
+    with captured_statements(engine) as statements:
+        weight = await crud.get_last_weight_for_set(session, user_id, exercise_id, 1)
+    assert weight == 55
+    assert len(statements) == 1
+    return statements[0]
+
+
+def test_last_weight_uses_covering_index_sqlite(run, captured_statements):
+    async def scenario():
+        async with async_session_maker() as session:
+            statement, parameters = await _last_weight_statement(session, engine, captured_statements)
+            conn = await session.connection()
+            plan = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)).all()
+        return [row[-1] for row in plan]
+
+    details = run(scenario)
+    assert any(f"USING COVERING INDEX {COVERING_INDEX}" in detail for detail in details), details
+    # Сортировка по timestamp берётся из порядка индекса
+    assert not any("TEMP B-TREE" in detail for detail in details), details
+
+
+def test_last_weight_uses_index_only_scan_postgresql(run_postgres, captured_statements):
+    async def scenario(pg_engine):
+        async with async_sessionmaker(pg_engine, expire_on_commit=False)() as session:
+            statement, parameters = await _last_weight_statement(session, pg_engine, captured_statements)
+            conn = await session.connection()
+            # На нескольких строках планировщик выбрал бы seq scan
+            await conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+            plan = (await conn.exec_driver_sql("EXPLAIN " + statement, parameters)).scalars().all()
+        return plan
+
+    plan = run_postgres(scenario)
+    assert any("Index Only Scan" in line and COVERING_INDEX in line for line in plan), plan
+    assert not any(line.lstrip().startswith("Sort") for line in plan), plan
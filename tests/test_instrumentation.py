@@ -0,0 +1,67 @@
+"""Области учёта SQL-запросов: имена маршрутов API, упавшие и медленные запросы."""
+import logging
+
+import httpx
+import pytest
+from sqlalchemy import event, select, text
+from sqlalchemy.exc import OperationalError
+
+from app.api.main import app
+from app.db import instrumentation, slow_query_log
+from app.db.init_db import engine
+from app.db.models import User
+
+
+def test_unknown_paths_share_unmatched_label(run):
+    async def scenario():
+        instrumentation.reset()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            for path in ("/api/nope/1", "/api/nope/2"):
+                assert (await client.get(path)).status_code == 404
+            assert (await client.get("/health")).status_code == 200
+        return instrumentation.snapshot()
+
+    metrics = run(scenario)
+    assert metrics[instrumentation.UNMATCHED_ROUTE]["queries"]["count"] == 2
+    assert "GET /health" in metrics
+    assert not any("/api/nope" in name for name in metrics)
+
+
+def test_failed_statement_does_not_leak_start_time(run):
+    async def scenario():
+        async with engine.connect() as conn:
+            for _ in range(3):
+                with pytest.raises(OperationalError):
+                    await conn.execute(text("SELECT * FROM missing_table"))
+            return list(conn.sync_connection.info.get("query_start_time", []))
+
+    assert run(scenario) == []
+
+
+def test_slow_query_plan_is_taken_off_the_request_path(run, captured_statements, monkeypatch):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_THRESHOLD_MS", 1e-6)
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+    slow_query_log.slow_query_logger.addHandler(handler)
+
+    checkouts = []
+
+    async def scenario():
+        event.listen(engine.sync_engine, "checkout", lambda *args: checkouts.append(1))
+        async with engine.connect() as conn:
+            with captured_statements(engine) as statements:
+                await conn.execute(select(User.id).where(User.telegram_id == 1))
+        await slow_query_log.flush()
+        return statements
+
+    try:
+        statements = run(scenario)
+    finally:
+        slow_query_log.slow_query_logger.removeHandler(handler)
+    # EXPLAIN не выполнялся на engine приложения и не брал второе соединение
+    assert len(statements) == 1 and len(checkouts) == 1
+    entries = [record.getMessage() for record in records if "users.telegram_id" in record.getMessage()]
+    assert len(entries) == 1
+    assert "SEARCH users USING" in entries[0]
@@ -0,0 +1,83 @@
+"""Версионные миграции: полная миграция с нуля, быстрый старт на актуальной схеме, перепривязка ключей упражнений."""
+import asyncio
+import time
+
+from sqlalchemy import delete, text, update
+
+from app.db import crud
+from app.db.init_db import async_session_maker, build_engine, engine
+from app.db.migrations import LATEST_VERSION, migrate
+from app.db.models import Base, Exercise, LatestWeight
+
+
+async def _migrate_timed(engine, captured_statements):
+    with captured_statements(engine) as statements:
+        started = time.perf_counter()
+        version = await migrate(engine, False)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+    return version, [statement for statement, _ in statements], elapsed_ms
+
+
+def test_cold_and_warm_start(tmp_path, captured_statements):
+    async def scenario():
+        engine = build_engine(f"sqlite+aiosqlite:///{tmp_path / 'startup.db'}")
+        try:
+            cold = await _migrate_timed(engine, captured_statements)
+            warm = await _migrate_timed(engine, captured_statements)
+        finally:
+            await engine.dispose()
+        return cold, warm
+
+    (cold_version, cold_statements, cold_ms), (warm_version, warm_statements, warm_ms) = asyncio.run(scenario())
+    print(f"migrate(): холодный старт {cold_ms:.1f} мс, актуальная схема {warm_ms:.1f} мс")
+
+    assert cold_version == warm_version == LATEST_VERSION
+    # Актуальная схема: один SELECT версии, без create_all и PRAGMA table_info
+    assert len(warm_statements) == 1, warm_statements
+    assert warm_statements[0].strip().upper().startswith("SELECT MAX(VERSION) FROM SCHEMA_VERSION")
+    assert len(cold_statements) > len(warm_statements)
+    assert warm_ms < cold_ms
+
+
+def test_database_without_schema_version_is_migrated(tmp_path):
+    async def scenario():
+        engine = build_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}")
+        try:
+            # База, созданная до появления schema_version: таблицы есть, версии нет
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            return await migrate(engine, False)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(scenario()) == LATEST_VERSION
+
+
+def test_numbered_exercises_are_rekeyed(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 4001, username="rekey")
+            program = await crud.create_program_tree(session, user.id, "Нумерация", [{
+                "name": "День 1",
+                "exercises": [{"name": "Упражнение 1.1", "reps": [10]}, {"name": "Упражнение 1.2", "reps": [10]}],
+            }])
+            exercises = (await crud.get_workout_days(session, program.session_id))[0].exercises
+            session_run = await crud.create_session_run(session, user.id, program.session_id)
+            for exercise, weight in zip(exercises, (20, 30)):
+                await crud.create_performed_set(session, exercise.exercise_id, 1, weight, session_run.id, user_id=user.id)
+            # Ключи, которые давала прежняя нормализация: общий «упражнение»
+            old_key = await crud.get_or_create_exercise_key_ids(session, ["Упражнение"])
+            await session.execute(update(Exercise).values(exercise_key_id=old_key["Упражнение"]))
+            await session.execute(delete(LatestWeight))
+            await session.execute(text("UPDATE schema_version SET version = 11"))
+            await session.commit()
+
+        await migrate(engine, False)
+
+        async with async_session_maker() as session:
+            return [
+                await crud.get_last_weight_for_exercise_by_name(session, user.id, name, 1)
+                for name in ("Упражнение 1.1", "Упражнение 1.2")
+            ]
+
+    assert run(scenario) == [20, 30]
@@ -0,0 +1,65 @@
+"""Keyset-пагинация (app/db/pagination.py)."""
+from fastapi import Response
+from sqlalchemy import insert, select, text
+
+from app.api.routes import get_programs, get_users_with_programs
+from app.db import crud
+from app.db.init_db import async_session_maker, engine
+from app.db.migrations import _fill_created_at
+from app.db.models import Session, User
+
+
+async def _all_pages(session, limit):
+    telegram_ids, cursor = [], None
+    while True:
+        page = await crud.get_users_page(session, limit=limit, after=cursor)
+        telegram_ids.extend(user.telegram_id for user in page.items)
+        cursor = page.next_cursor
+        if not cursor:
+            return telegram_ids
+
+
+def test_users_without_created_at(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            await session.execute(insert(User), [{"telegram_id": 5000 + i} for i in range(5)])
+            # Старые строки без created_at
+            await session.execute(text("INSERT INTO users (telegram_id, created_at) VALUES (4998, NULL), (4999, NULL)"))
+            await session.commit()
+            before = await _all_pages(session, limit=2)
+
+        async with engine.begin() as conn:
+            await _fill_created_at(conn, False)
+
+        async with async_session_maker() as session:
+            after = await _all_pages(session, limit=2)
+        return before, after
+
+    before, after = run(scenario)
+    assert before == [5000 + i for i in range(5)]
+    # После миграции старые строки идут первыми
+    assert after == [4998, 4999] + [5000 + i for i in range(5)]
+
+
+def test_api_without_limit_returns_full_lists(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            await session.execute(insert(User), [{"telegram_id": 6000 + i} for i in range(60)])
+            user_id = await session.scalar(select(User.id).where(User.telegram_id == 6000))
+            await session.execute(insert(Session), [{"user_id": user_id, "name": f"p{n}"} for n in range(60)])
+            await session.commit()
+
+            users = await get_users_with_programs(limit=None, after=None, before=None, session=session)
+            programs = await get_programs(Response(), user_id=user_id, limit=None, after=None, before=None, session=session)
+            all_programs = await get_programs(Response(), user_id=None, limit=None, after=None, before=None, session=session)
+            paged = await get_programs(Response(), user_id=user_id, limit=10, after=None, before=None, session=session)
+        return users, [p.name for p in programs], [p.name for p in all_programs], [p.name for p in paged]
+
+    users, programs, all_programs, paged = run(scenario)
+    # Без limit — все записи и прежний порядок, как до пагинации
+    assert users["total_users"] == 60
+    assert users["next_cursor"] is None
+    assert programs == [f"p{n}" for n in range(60)]
+    assert all_programs == programs[::-1]
+    # С limit — страница от новых к старым
+    assert paged == [f"p{n}" for n in range(59, 49, -1)]
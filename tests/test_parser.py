@@ -0,0 +1,28 @@
+"""Ключ упражнения: из названия убираются только подходы и повторения."""
+import pytest
+
+from app.services.parser import normalize_exercise_name
+
+
+@pytest.mark.parametrize("name, key", [
+    ("Жим лёжа — 4×10", "жим лежа"),
+    ("Жим лежа 3*10-12", "жим лежа"),
+    ("Жим лежа 3x10", "жим лежа"),
+    ("Жим лежа 10-12", "жим лежа"),
+    ("Жим лежа — 3 подхода", "жим лежа"),
+    ("Жим лежа — 3 подхода по 10", "жим лежа"),
+])
+def test_sets_and_reps_are_stripped(name, key):
+    assert normalize_exercise_name(name) == key
+
+
+def test_numbered_exercises_keep_distinct_keys():
+    first = normalize_exercise_name("Упражнение 1.1")
+    second = normalize_exercise_name("Упражнение 1.2 — 3×12")
+    assert first == "упражнение 1 1"
+    assert second == "упражнение 1 2"
+
+
+def test_bench_angles_keep_distinct_keys():
+    assert normalize_exercise_name("Жим гантелей 30°") == "жим гантелей 30"
+    assert normalize_exercise_name("Жим гантелей 45° 4x8") == "жим гантелей 45"
@@ -0,0 +1,55 @@
+"""Секционирование performed_sets: перенос строк и отсечение секций в запросах истории (PostgreSQL)."""
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from app.db import crud, partitioning
+from app.db.models import PerformedSet, Session
+
+OLD_MONTH = datetime(2024, 1, 15)
+
+
+async def _two_programs(session):
+    """Старая программа с подходами в январе 2024 и новая с подходами сейчас."""
+    user = await crud.get_or_create_user(session, 2001, username="partitions")
+    exercise_ids = []
+    for name in ("Старая", "Новая"):
+        program = await crud.create_program_tree(
+            session, user.id, name, [{"name": "День 1", "exercises": [{"name": "Присед", "reps": [5]}]}]
+        )
+        exercise_id = (await crud.get_workout_days(session, program.session_id))[0].exercises[0].exercise_id
+        run = await crud.create_session_run(session, user.id, program.session_id)
+        await crud.create_performed_set(session, exercise_id, 1, 100, run.id, user_id=user.id)
+        exercise_ids.append((program.session_id, exercise_id))
+    old_program, old_exercise = exercise_ids[0]
+    await session.execute(update(Session).where(Session.session_id == old_program).values(created_at=OLD_MONTH))
+    await session.execute(
+        update(PerformedSet).where(PerformedSet.exercise_id == old_exercise).values(timestamp=OLD_MONTH)
+    )
+    await session.commit()
+    return user.id, exercise_ids[1][1]
+
+
+def test_history_prunes_old_partitions_postgresql(run_postgres, captured_statements, monkeypatch):
+    monkeypatch.setattr(crud, "PERFORMED_SETS_PARTITIONING", True)
+
+    async def scenario(pg_engine):
+        async with async_sessionmaker(pg_engine, expire_on_commit=False)() as session:
+            user_id, exercise_id = await _two_programs(session)
+        async with pg_engine.begin() as conn:
+            moved = await partitioning.partition_performed_sets(conn)
+        async with async_sessionmaker(pg_engine, expire_on_commit=False)() as session:
+            with captured_statements(pg_engine) as statements:
+                weight = await crud.get_last_weight_for_set(session, user_id, exercise_id, 1)
+            statement, parameters = statements[0]
+            conn = await session.connection()
+            # Граница — подзапрос, поэтому секции отсекаются при выполнении
+            plan = (await conn.exec_driver_sql("EXPLAIN ANALYZE " + statement, parameters)).scalars().all()
+        return moved, weight, plan
+
+    moved, weight, plan = run_postgres(scenario)
+    assert moved == 2
+    assert weight == 100
+    old_partition = partitioning.partition_name(OLD_MONTH.date())
+    assert not any(old_partition in line and "never executed" not in line for line in plan), plan
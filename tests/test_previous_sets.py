@@ -0,0 +1,84 @@
+"""Подсказки прошлого веса в тренировке (crud.get_previous_sets_for_day)."""
+from datetime import datetime, timedelta
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+
+
+async def _program(session, user_id, name, exercise_name="Жим лёжа"):
+    program = await crud.create_program_tree(
+        session, user_id, name, [{"name": "День 1", "exercises": [{"name": exercise_name, "reps": [10, 8]}]}]
+    )
+    day = (await crud.get_workout_days(session, program.session_id))[0]
+    return program.session_id, day.id, day.exercises[0].exercise_id
+
+
+async def _perform(session, user_id, session_id, exercise_id, weights, timestamp):
+    run = await crud.create_session_run(session, user_id, session_id)
+    for set_index, weight in enumerate(weights, start=1):
+        await crud.create_performed_set(
+            session, exercise_id, set_index, weight, run.id, user_id=user_id, timestamp=timestamp
+        )
+
+
+def test_same_exercise_is_preferred_over_catalog(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 2001)
+            a_session, a_day, a_exercise = await _program(session, user.id, "A")
+            b_session, _, b_exercise = await _program(session, user.id, "B", exercise_name="жим  лёжа")
+            now = datetime.utcnow()
+            await _perform(session, user.id, a_session, a_exercise, [50], now - timedelta(days=2))
+            # Позже то же упражнение из каталога в другой программе
+            await _perform(session, user.id, b_session, b_exercise, [70, 65], now - timedelta(days=1))
+            return a_exercise, await crud.get_previous_sets_for_day(session, user.id, a_day)
+
+    exercise_id, previous = run(scenario)
+    # Подход 1 выполнялся в этой программе, подход 2 — только в другой
+    assert previous[(exercise_id, 1)][0] == 50
+    assert previous[(exercise_id, 2)][0] == 65
+
+
+def test_catalog_fallback_for_new_program(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 2002)
+            a_session, _, a_exercise = await _program(session, user.id, "A")
+            await _perform(session, user.id, a_session, a_exercise, [50, 45], datetime.utcnow())
+            _, b_day, b_exercise = await _program(session, user.id, "B")
+            return b_exercise, await crud.get_previous_sets_for_day(session, user.id, b_day)
+
+    exercise_id, previous = run(scenario)
+    assert {key: weight for key, (weight, _) in previous.items()} == {(exercise_id, 1): 50, (exercise_id, 2): 45}
+
+
+def test_deleted_program_weights_leave_catalog(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 2003)
+            a_session, _, a_exercise = await _program(session, user.id, "A")
+            b_session, _, b_exercise = await _program(session, user.id, "B")
+            now = datetime.utcnow()
+            await _perform(session, user.id, a_session, a_exercise, [50, 45], now - timedelta(days=2))
+            await _perform(session, user.id, b_session, b_exercise, [70, 65], now - timedelta(days=1))
+            assert await crud.delete_session(session, b_session)
+            _, c_day, c_exercise = await _program(session, user.id, "C")
+            return c_exercise, await crud.get_previous_sets_for_day(session, user.id, c_day)
+
+    exercise_id, previous = run(scenario)
+    assert {key: weight for key, (weight, _) in previous.items()} == {(exercise_id, 1): 50, (exercise_id, 2): 45}
+
+
+def test_renamed_exercise_moves_catalog_weights(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 2004)
+            a_session, _, a_exercise = await _program(session, user.id, "A")
+            await _perform(session, user.id, a_session, a_exercise, [50, 45], datetime.utcnow())
+            exercise = await crud.get_exercise_by_id(session, a_exercise)
+            await crud.update_exercise(session, exercise, name="Присед")
+            old_weight = await crud.get_last_weight_for_exercise_by_name(session, user.id, "Жим лёжа", 1)
+            new_weight = await crud.get_last_weight_for_exercise_by_name(session, user.id, "Присед", 1)
+            return old_weight, new_weight
+
+    assert run(scenario) == (None, 50)
@@ -0,0 +1,143 @@
+"""Число SQL-запросов не зависит от объёма данных (регрессии N+1)."""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import insert, select
+
+from app.api.routes import get_users_with_programs
+from app.db import crud, instrumentation
+from app.db.fsm_storage import DatabaseStorage
+from app.db.init_db import async_session_maker, engine
+from app.db.models import Session, User
+from app.services import workout_state
+
+# Пользователи + их программы одним selectinload
+USERS_PAGE_MAX_QUERIES = 2
+
+
+def _program_days(days_count: int, exercises_count: int, sets_count: int) -> list:
+    return [
+        {
+            "name": f"День {day + 1}",
+            "exercises": [
+                {"name": f"Упражнение {day + 1}.{exercise + 1}", "reps": [10] * sets_count}
+                for exercise in range(exercises_count)
+            ]
+        }
+        for day in range(days_count)
+    ]
+
+
+def test_users_api_pages_10k_users_with_fixed_query_count(run):
+    users_count, page_size = 10_000, 500
+
+    async def scenario():
+        async with async_session_maker() as session:
+            await session.execute(
+                insert(User), [{"telegram_id": 10_000_000 + i, "username": f"u{i}"} for i in range(users_count)]
+            )
+            user_ids = (await session.scalars(select(User.id))).all()
+            await session.execute(
+                insert(Session), [{"user_id": user_id, "name": f"p{n}"} for user_id in user_ids for n in range(2)]
+            )
+            await session.commit()
+
+        seen, programs, cursor = 0, 0, None
+        while True:
+            async with async_session_maker() as session:
+                # QueryBudgetExceeded, если запросов на страницу больше бюджета
+                with instrumentation.query_budget(USERS_PAGE_MAX_QUERIES, "GET /api/users"):
+                    response = await get_users_with_programs(
+                        limit=page_size, after=cursor, before=None, session=session
+                    )
+            seen += len(response["users"])
+            programs += sum(len(user["programs"]) for user in response["users"])
+            cursor = response["next_cursor"]
+            if not cursor:
+                return seen, programs
+
+    assert run(scenario) == (users_count, users_count * 2)
+
+
+def test_copy_statement_count_does_not_depend_on_program_size(run, captured_statements):
+    async def scenario():
+        counts = []
+        async with async_session_maker() as session:
+            owner = await crud.get_or_create_user(session, 4001)
+            target = await crud.get_or_create_user(session, 4002)
+            for size in [(1, 1, 1), (7, 30, 6)]:
+                source = await crud.create_program_tree(session, owner.id, "source", _program_days(*size))
+                with captured_statements(engine) as statements:
+                    copy = await crud.copy_session_without_weights(session, source.session_id, target.id, "copy")
+                counts.append(len(statements))
+                details = await crud.get_session_with_details(session, copy.session_id)
+                counts.append(sum(len(exercise.sets) for day in details.workout_days for exercise in day.exercises))
+        return counts
+
+    small_statements, small_sets, large_statements, large_sets = run(scenario)
+    assert (small_sets, large_sets) == (1, 7 * 30 * 6)
+    # Проверка источника, INSERT программы, дней, упражнений и подходов, чтение копии
+    assert small_statements == large_statements == 6
+
+
+def test_performed_set_write_statement_count(run, captured_statements):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 4003)
+            program = await crud.create_program_tree(session, user.id, "writes", _program_days(1, 1, 3))
+            day = (await crud.get_workout_days(session, program.session_id))[0]
+            run_ = await crud.create_session_run(session, user.id, program.session_id)
+            with captured_statements(engine) as statements:
+                await crud.create_performed_set(
+                    session, day.exercises[0].exercise_id, 1, 50.0, run_.id,
+                    user_id=user.id, idempotency_key="tg:1:1", timestamp=datetime.utcnow()
+                )
+        return [statement for statement, _ in statements]
+
+    statements = run(scenario)
+    # INSERT ... ON CONFLICT DO NOTHING RETURNING и upsert latest_weights
+    assert len(statements) == 2, statements
+    assert all(statement.lstrip().upper().startswith("INSERT") for statement in statements)
+
+
+WORKOUT = [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8]}, {"name": "Тяга", "reps": [5]}]}]
+
+
+def _process_weight_flags():
+    from app.handlers import training
+
+    for handler in training.router.message.handlers:
+        if handler.callback is training.process_weight:
+            return handler.flags
+    raise AssertionError("process_weight не зарегистрирован")
+
+
+@pytest.mark.parametrize("database_fsm", [False, True])
+def test_workout_stays_within_process_weight_budget(run, telegram, monkeypatch, database_fsm):
+    monkeypatch.setattr(instrumentation, "DB_QUERY_BUDGET_STRICT", True)
+
+    async def scenario():
+        if database_fsm:
+            telegram.dp.fsm.storage = DatabaseStorage(engine)
+        await telegram.start_workout(4001, WORKOUT)
+        await telegram.send(4001, "50")
+        await telegram.send(4001, "52.5")
+        # Худший случай: последний подход после перезапуска процесса
+        workout_state._days.clear()
+        workout_state._previous_sets.clear()
+        return await telegram.send(4001, "70")
+
+    replies = run(scenario)
+    assert replies[-1].startswith("✅ Тренировка завершена!"), replies
+
+
+def test_process_weight_over_budget_fails(run, telegram, monkeypatch):
+    monkeypatch.setattr(instrumentation, "DB_QUERY_BUDGET_STRICT", True)
+    monkeypatch.setitem(_process_weight_flags(), instrumentation.QUERY_BUDGET, 1)
+
+    async def scenario():
+        await telegram.start_workout(4002, WORKOUT)
+        await telegram.send(4002, "50")
+
+    with pytest.raises(instrumentation.QueryBudgetExceeded):
+        run(scenario)
@@ -0,0 +1,38 @@
+"""Кэш пользователей процесса (crud.get_or_create_user)."""
+import pytest
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.db.models import User
+
+
+def test_user_deleted_elsewhere_is_evicted_after_integrity_error(run):
+    async def scenario():
+        async with async_session_maker() as session:
+            user = await crud.get_or_create_user(session, 3001, username="cached")
+            await crud.create_session(session, user.id, "Программа")
+
+        # Другой процесс удаляет пользователя: кэш этого процесса о нём не знает
+        async with async_session_maker() as other:
+            await other.execute(delete(User).where(User.id == user.id))
+            await other.commit()
+
+        async with async_session_maker() as session:
+            cached = await crud.get_or_create_user(session, 3001, username="cached")
+            assert cached.id == user.id
+            with pytest.raises(IntegrityError):
+                try:
+                    await crud.create_session(session, cached.id, "Новая программа")
+                except IntegrityError:
+                    crud.forget_cached_users(session)
+                    raise
+
+        # Следующее обращение создаёт пользователя заново, запись проходит
+        async with async_session_maker() as session:
+            recreated = await crud.get_or_create_user(session, 3001, username="cached")
+            await crud.create_session(session, recreated.id, "Новая программа")
+            return len(await crud.get_user_sessions(session, recreated.id))
+
+    assert run(scenario) == 1
@@ -0,0 +1,119 @@
+"""Webhook: проверка secret token, ответ 200 до конца обработки, ожидание фоновых update при остановке."""
+import asyncio
+import logging
+
+from aiogram import Dispatcher, F, Router
+from aiogram.methods import SendMessage
+from aiogram.types import Message
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+
+from app import webhook
+from app.config import WEBHOOK_PATH
+from app.webhook import BackgroundRequestHandler, build_webhook_app
+
+SECRET = "test_secret"
+HEADERS = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+
+
+def _blocking_dispatcher(release: asyncio.Event, finished: list) -> Dispatcher:
+    """Dispatcher с хендлером, который отвечает только после release."""
+    router = Router()
+
+    @router.message(F.text == "долго")
+    async def slow(message: Message):
+        await release.wait()
+        await message.answer("готово")
+        finished.append(message.chat.id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def _replies(fake, timeout: float = 5) -> list:
+    """Дождаться хотя бы одного sendMessage в заглушке Bot API."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while asyncio.get_running_loop().time() < deadline:
+        replies = [method.text for method in fake.requests if isinstance(method, SendMessage)]
+        if replies:
+            return replies
+        await asyncio.sleep(0.01)
+    return []
+
+
+def test_webhook_rejects_wrong_secret_and_replies(run, telegram):
+    async def scenario():
+        update = telegram.message_update(7001, "Мои Программы тренировок")
+        app = build_webhook_app(telegram.bot, telegram.dp, SECRET)
+        async with TestClient(TestServer(app)) as client:
+            missing = await client.post(WEBHOOK_PATH, json=update)
+            wrong = await client.post(
+                WEBHOOK_PATH, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"}
+            )
+            rejected_requests = len(telegram.fake.requests)
+            accepted = await client.post(WEBHOOK_PATH, json=update, headers=HEADERS)
+            replies = await _replies(telegram.fake)
+        return missing.status, wrong.status, rejected_requests, accepted.status, replies
+
+    missing, wrong, rejected_requests, accepted, replies = run(scenario)
+    assert missing == wrong == 401
+    assert rejected_requests == 0
+    assert accepted == 200
+    assert replies
+
+
+def test_webhook_acknowledges_before_handler_finishes(run, telegram):
+    async def scenario():
+        release = asyncio.Event()
+        finished = []
+        app = build_webhook_app(telegram.bot, _blocking_dispatcher(release, finished), SECRET)
+        async with TestClient(TestServer(app)) as client:
+            response = await asyncio.wait_for(
+                client.post(WEBHOOK_PATH, json=telegram.message_update(7002, "долго"), headers=HEADERS),
+                timeout=5,
+            )
+            finished_before_release = list(finished)
+            release.set()
+            replies = await _replies(telegram.fake)
+        return response.status, finished_before_release, replies
+
+    status, finished_before_release, replies = run(scenario)
+    assert status == 200
+    assert finished_before_release == []
+    assert replies == ["готово"]
+
+
+def test_close_waits_for_background_updates(run, telegram, caplog, monkeypatch):
+    monkeypatch.setattr(webhook, "SHUTDOWN_TIMEOUT", 0.2)
+
+    async def post_and_close(release: asyncio.Event, release_after: float):
+        finished = []
+        handler = BackgroundRequestHandler(_blocking_dispatcher(release, finished), telegram.bot, secret_token=SECRET)
+        app = web.Application()
+        app.router.add_route("POST", WEBHOOK_PATH, handler.handle)
+        async with TestClient(TestServer(app)) as client:
+            response = await client.post(WEBHOOK_PATH, json=telegram.message_update(7003, "долго"), headers=HEADERS)
+            assert response.status == 200
+            asyncio.get_running_loop().call_later(release_after, release.set)
+            await handler.close()
+            # Обработан ли update к возврату из close()
+            finished_on_close = list(finished)
+            release.set()
+            await asyncio.gather(*handler._background_feed_update_tasks)
+        return finished_on_close
+
+    async def scenario():
+        # Update завершается во время ожидания: close() возвращается после него
+        drained = await post_and_close(asyncio.Event(), 0.05)
+        # Update не успевает за SHUTDOWN_TIMEOUT: close() сообщает о нём
+        timed_out = await post_and_close(asyncio.Event(), 10)
+        return drained, timed_out
+
+    with caplog.at_level(logging.INFO, logger="app.webhook"):
+        drained, timed_out = run(scenario)
+    assert drained == [7003]
+    assert timed_out == []
+    messages = [record.getMessage() for record in caplog.records if record.name == "app.webhook"]
+    assert messages.count("Ожидание 1 update в обработке") == 2
+    assert sum("1 update не обработаны за 0.2 с" in message for message in messages) == 1
@@ -0,0 +1,52 @@
+"""Кэш структуры дня тренировки сбрасывается при изменении упражнений."""
+import pytest
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.db.models import Exercise
+
+WORKOUT = [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8]}, {"name": "Тяга", "reps": [5]}]}]
+
+
+async def _exercise(name: str) -> Exercise:
+    async with async_session_maker() as session:
+        return await session.scalar(select(Exercise).where(Exercise.name == name))
+
+
+def test_exercise_edits_reach_running_workout(run, telegram):
+    chat_id = 8001
+
+    async def scenario():
+        await telegram.start_workout(chat_id, WORKOUT)
+        bench = await _exercise("Жим")
+        # Правка через API в этом же процессе: третий подход и новое название
+        async with async_session_maker() as session:
+            await crud.create_set(session, bench.exercise_id, 3, 6)
+            await crud.update_exercise(session, await session.get(Exercise, bench.exercise_id), name="Жим лёжа")
+        second = await telegram.send(chat_id, "50")
+        third = await telegram.send(chat_id, "52.5")
+        return second, third
+
+    second, third = run(scenario)
+    assert "Жим лёжа" in second[-1] and "Подход 2" in second[-1]
+    assert "Подход 3: 6 раз" in third[-1]
+
+
+def test_exercise_deleted_by_other_process_is_reloaded(run, telegram):
+    chat_id = 8002
+
+    async def scenario():
+        await telegram.start_workout(chat_id, WORKOUT)
+        bench = await _exercise("Жим")
+        # Другой процесс удаляет упражнение мимо crud: кэш этого процесса не знает об этом
+        async with async_session_maker() as session:
+            await session.execute(delete(Exercise).where(Exercise.exercise_id == bench.exercise_id))
+            await session.commit()
+        with pytest.raises(IntegrityError):
+            await telegram.send(chat_id, "50")
+        return await telegram.send(chat_id, "50")
+
+    replies = run(scenario)
+    assert "Тяга" in replies[-1]
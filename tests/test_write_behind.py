@@ -0,0 +1,108 @@
+"""Журнал отложенной записи подходов: журналы процессов, group commit, ожидание подходов запуска."""
+import asyncio
+import fcntl
+import json
+import os
+from datetime import datetime
+
+from app.db import crud
+from app.db.init_db import async_session_maker
+from app.services import write_behind
+
+
+async def _run_with_exercise():
+    async with async_session_maker() as session:
+        user = await crud.get_or_create_user(session, 5001, username="journal")
+        program = await crud.create_program_tree(
+            session, user.id, "Журнал", [{"name": "День 1", "exercises": [{"name": "Жим", "reps": [10, 8, 6]}]}]
+        )
+        exercise_id = (await crud.get_workout_days(session, program.session_id))[0].exercises[0].exercise_id
+        run = await crud.create_session_run(session, user.id, program.session_id)
+    return user.id, exercise_id, run.id
+
+
+def _entry(user_id, exercise_id, run_id, set_index, key):
+    return {
+        "exercise_id": exercise_id, "set_index": set_index, "weight": 50.0, "session_run_id": run_id,
+        "user_id": user_id, "idempotency_key": key, "timestamp": datetime.utcnow().isoformat(),
+    }
+
+
+def test_start_replays_journals_of_finished_processes_only(run, tmp_path, monkeypatch):
+    base = str(tmp_path / "performed_sets.journal")
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_PATH", base)
+
+    async def scenario():
+        user_id, exercise_id, run_id = await _run_with_exercise()
+        # Упавший процесс, живой процесс (его блокировка взята) и старый общий журнал
+        for suffix, set_index in ((".crashed-1", 1), (".alive-2", 2), ("", 3)):
+            with open(base + suffix, "w") as journal:
+                journal.write(json.dumps(_entry(user_id, exercise_id, run_id, set_index, f"k{set_index}")) + "\n")
+        alive_lock = open(base + ".alive-2.lock", "a")
+        fcntl.flock(alive_lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            await write_behind.start()
+            await write_behind.stop()
+        finally:
+            alive_lock.close()
+        async with async_session_maker() as session:
+            sets = await crud.get_performed_sets_by_run(session, run_id)
+        return sorted(performed_set.set_index for performed_set in sets)
+
+    assert run(scenario) == [1, 3]
+    assert sorted(os.listdir(tmp_path)) == ["performed_sets.journal.alive-2", "performed_sets.journal.alive-2.lock"]
+
+
+def test_concurrent_appends_share_fsync(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_PATH", str(tmp_path / "performed_sets.journal"))
+    fsyncs = []
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        fsyncs.append(fd)
+        real_fsync(fd)
+
+    async def scenario():
+        user_id, exercise_id, run_id = await _run_with_exercise()
+        await write_behind.start()
+        monkeypatch.setattr(write_behind.os, "fsync", counting_fsync)
+        try:
+            await asyncio.gather(*(
+                write_behind.append(exercise_id, set_index, 50.0, run_id, user_id=user_id, idempotency_key=f"g{set_index}")
+                for set_index in range(1, 21)
+            ))
+            journaled = len(write_behind._read_journal(write_behind._journal_path))
+            appended_fsyncs = len(fsyncs)
+            complete = await write_behind.wait_for_run(run_id, 20)
+        finally:
+            await write_behind.stop()
+        return journaled, appended_fsyncs, complete
+
+    journaled, appended_fsyncs, complete = run(scenario)
+    assert journaled == 20
+    assert appended_fsyncs < 20
+    assert complete
+
+
+def test_wait_for_run_waits_for_sets_of_other_processes(run, tmp_path, monkeypatch):
+    monkeypatch.setattr(write_behind, "WRITE_BEHIND_JOURNAL_PATH", str(tmp_path / "performed_sets.journal"))
+
+    async def scenario():
+        user_id, exercise_id, run_id = await _run_with_exercise()
+        await write_behind.start()
+        try:
+            await write_behind.append(exercise_id, 1, 50.0, run_id, user_id=user_id, idempotency_key="local")
+
+            async def other_process():
+                await asyncio.sleep(0.3)
+                async with async_session_maker() as session:
+                    await crud.create_performed_set(session, exercise_id, 2, 55.0, run_id, user_id=user_id)
+
+            other = asyncio.create_task(other_process())
+            complete = await write_behind.wait_for_run(run_id, 2)
+            await other
+        finally:
+            await write_behind.stop()
+        return complete
+
+    assert run(scenario)